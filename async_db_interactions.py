@@ -0,0 +1,435 @@
+# asyncio version of the Organizer, so the gui can talk to the database without freezing while it waits on the server.
+# it does the same things with the same sql (and shares the search cache and upc index), just on an asyncpg pool
+import re
+import sys
+import asyncio
+from threading import Thread
+from time import perf_counter_ns
+
+import asyncpg
+
+from db_interactions import (
+    get_location, get_search_cache, get_upc_index, max_pool_connections, prepared_queries,
+    part_search_sql, user_search_sql, part_ranked_search_sql, part_search_predicates, changed_rows_sql,
+    cart_checkout_sql, cart_holders_sql, cart_checkin_sql, description_characters, deletable_tables,
+    build_search, search_rows, search_words, like_escape, text_search_query, active_filters, make_upc,
+    part_results, user_results, part_details, user_details, cart_checkout_results, cart_checkin_results,
+    rows_are_cached, update_cached_rows, record_query
+)
+
+# %s, %(name)s and %% in psycopg2 style sql
+placeholder_pattern = re.compile(r"%\((\w+)\)s|%s|%%")
+# $1, $2, ... in sql that's already written for asyncpg, like prepared_queries
+numbered_pattern = re.compile(r"\$\d+")
+
+# the parts of the Organizer's conn_info that asyncpg uses
+connect_keys = ("database", "user", "password", "host", "port")
+
+
+def numbered_params(query, values=()):
+    """
+    change the psycopg2 style placeholders (%s or %(name)s) in the sql into asyncpg's $1, $2, ...
+    so all the sql in db_interactions works here too. sql that's already numbered is left alone.
+    :returns: (sql, [values in $ order])
+    """
+    kinds = {match.group(1) is None for match in placeholder_pattern.finditer(query) if match.group(0) != "%%"}
+    if numbered_pattern.search(query):
+        # the %s ones would get numbers that are already taken
+        if kinds: raise TypeError("can't mix $1 style placeholders with %s style ones")
+        return query, list(values)
+    if len(kinds) > 1: raise TypeError("can't mix %s and %(name)s placeholders")
+
+    args = []
+    numbers = {}
+
+    def number(match):
+        if match.group(0) == "%%": return "%"
+
+        # the same name is the same $ number every time it shows up
+        name = match.group(1)
+        if name is None:
+            args.append(values[len(args)])
+            return f"${len(args)}"
+        if name not in numbers:
+            args.append(values[name])
+            numbers[name] = len(args)
+        return f"${numbers[name]}"
+
+    return placeholder_pattern.sub(number, query), args
+
+
+class AsyncOrganizer:
+    """
+    the Organizer's searches, info panels, checkouts, and add/update/delete as coroutines.
+    call connect() first (on the loop it'll be used from, see TkBridge), and close() when done.
+    """
+    def __init__(self, conn_info):
+        self.conn_info = {key: value for key, value in conn_info.items() if key in connect_keys}
+        self.pool = None
+
+        # the same ones the Organizer for this database uses, so a write from either one keeps both up to date
+        self.search_cache = get_search_cache(conn_info)
+        self.upc_index = get_upc_index(conn_info)
+
+    async def connect(self):
+        if self.pool: return
+        self.pool = await asyncpg.create_pool(min_size=1, max_size=max_pool_connections, **self.conn_info)
+        print("async pool opened for", self.conn_info["database"])
+
+    async def close(self):
+        if self.pool: await self.pool.close()
+        self.pool = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def fetch(self, query, values=(), connection=None):
+        """
+        run psycopg2 style sql and get the rows as tuples, like cursor.fetchall().
+        asyncpg prepares every statement the first time a connection sees it, so this doesn't re-plan either
+        """
+        numbered, args = numbered_params(query, values)
+        # timed the same as the Organizer's cursors, so these show up in query_stats() too
+        start, rows = perf_counter_ns(), ()
+        try:
+            rows = await (connection or self.pool).fetch(numbered, *args)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, len(rows), query)
+        return [tuple(row) for row in rows]
+
+    async def fetch_prepared(self, name, *values, connection=None):
+        """run one of the prepared_queries. They're already written with $1, $2, ..."""
+        start, rows = perf_counter_ns(), ()
+        try:
+            rows = await (connection or self.pool).fetch(prepared_queries[name][1], *values)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, len(rows), prepared_queries[name][1])
+        return [tuple(row) for row in rows]
+
+    # ------ lookups
+
+    async def userid_exists(self, userid):
+        result = await self.fetch_prepared("userid_exists", userid)
+        return bool(result) and result[0][0] == userid
+
+    async def upc_exists(self, upc):
+        return bool(await self.fetch_prepared("upc_exists", int(upc)))
+
+    async def part_num_from_upc(self, upc):
+        return (await self.fetch_prepared("part_num_from_upc", int(upc)))[0][0]
+
+    async def lookup_upc(self, upc):
+        """(part number, placement, checked out) for a upc, from the upc index if it's loaded. See Organizer.lookup_upc"""
+        if self.upc_index.loaded:
+            part = self.upc_index.lookup(upc)
+            if part or len(str(upc)) < 12: return part
+
+        rows = await self.fetch_prepared("upc_index_rows", [int(upc)])
+        if not rows: return None
+
+        part = rows[0][1:]
+        if self.upc_index.loaded: self.upc_index.update(upc, part)
+        return part
+
+    # ------ searches (the results are the same as the Organizer's, and come out of the same cache)
+
+    async def search_general(self, search_sql, search_term, filters, raw_table=False, predicates=None, order_column=None, page_size=None, after=None):
+        search = build_search(search_sql, search_term, filters, predicates, order_column, page_size, after)
+
+        # if no filters are on, nothing can match
+        if not search:
+            if raw_table: return [["No matching items", "No matching items"]]
+            return ["No matching items"]
+
+        return search_rows(await self.fetch(*search), raw_table)
+
+    async def part_search(self, search_term, search_columns=None, more_info=True, full_text=False, limit=50, page_size=None, after=None):
+        text_query = text_search_query(search_term) if full_text else None
+        if text_query:
+            return await self.part_search_ranked(text_query, more_info, limit)
+
+        if search_columns is None:
+            search_columns = {column: True for column in ("part_upc", "part_placement", "mfr_pn", "mfr_name", "part_desc", "url")}
+
+        if after is not None: after = int(after)
+        cache_key = ("parts", search_words(search_term), active_filters(search_columns), False, page_size, after)
+        generation = self.search_cache.generation("parts")
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            results = await self.search_general(part_search_sql, search_term, search_columns, predicates=part_search_predicates,
+                                                order_column="parts.part_upc", page_size=page_size, after=after)
+            self.search_cache.put(cache_key, (row[2] for row in results if isinstance(row, tuple)), results, generation)
+
+        return part_results(results, more_info)
+
+    async def part_search_ranked(self, text_query, more_info=True, limit=50):
+        cache_key = ("parts", (text_query,), (), True, limit)
+        generation = self.search_cache.generation("parts")
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            results = await self.fetch(part_ranked_search_sql, {"query": text_query, "limit": limit})
+            self.search_cache.put(cache_key, (row[2] for row in results), results, generation)
+
+        return part_results(results, more_info)
+
+    async def user_search(self, search_term, columns=None, use_full_names=False, page_size=None, after=None):
+        if not columns:
+            columns = {column: True for column in ("user_id", "first_name", "last_name", "email")}
+
+        cache_key = ("users", search_words(search_term), active_filters(columns), False, page_size, after)
+        generation = self.search_cache.generation("users")
+        results_table = self.search_cache.get(cache_key)
+        if results_table is None:
+            results_table = await self.search_general(user_search_sql, search_term, columns, raw_table=True,
+                                                      order_column="users.user_id", page_size=page_size, after=after)
+            self.search_cache.put(cache_key, (row[0] for row in results_table if isinstance(row, tuple)), results_table, generation)
+
+        return user_results(results_table, use_full_names)
+
+    async def part_data(self, target_upc, raw=False):
+        if not target_upc or (isinstance(target_upc, str) and not target_upc.isdecimal()):
+            return {"Invalid Search": ""}
+
+        return part_details(await self.fetch_prepared("part_data", int(target_upc)), raw)
+
+    async def user_data(self, target_id, raw=False):
+        return user_details(await self.fetch_prepared("user_data", target_id), raw)
+
+    # ------ checkouts
+
+    async def part_checkout(self, part_upc, user_id, force=False):
+        """same results as Organizer.part_checkout"""
+        part_upc = int(part_upc)
+
+        async with self.pool.acquire() as connection, connection.transaction():
+            holder = await self.fetch_prepared("part_holder", part_upc, connection=connection)
+
+            if holder:
+                # tell the user that the part is already checked out
+                if not force:
+                    holder_name = await self.fetch_prepared("user_name", holder[0][0], connection=connection)
+                    return "-PART_HOLDER-;;" + " ".join(holder_name[0])
+
+                await self.fetch_prepared("checkout_transfer", part_upc, user_id, connection=connection)
+            else:
+                await self.fetch_prepared("checkout_insert", part_upc, user_id, connection=connection)
+
+            await self.fetch_prepared("update_location", part_upc, get_location(), connection=connection)
+
+        await self.rows_changed("parts", [part_upc])
+        return "-CHECKOUT_SUCCESS-"
+
+    async def part_checkin(self, upc):
+        """same results as Organizer.part_checkin"""
+        upc = int(upc)
+        if not await self.upc_exists(upc):
+            return """This hasn't been added yet.
+Please click "Add part" to add a part for the first time"""
+
+        async with self.pool.acquire() as connection, connection.transaction():
+            returned = await self.fetch("DELETE FROM part_locations WHERE checked_out_part = %s RETURNING checked_out_part", (upc,), connection)
+            if not returned: return "The scanned part was never checked out."
+
+            await self.fetch_prepared("update_location", upc, get_location(), connection=connection)
+
+        await self.rows_changed("parts", [upc])
+        return "Part successfully returned."
+
+    async def cart_checkout(self, upcs, user_id, force=False):
+        """see Organizer.cart_checkout"""
+        cart = [int(upc) for upc in upcs]
+
+        async with self.pool.acquire() as connection, connection.transaction():
+            checked_out = await self.fetch(cart_checkout_sql, {"cart": cart, "user_id": user_id, "force": force, "location": get_location()}, connection)
+            done = {row[0] for row in checked_out}
+
+            holders = {}
+            if len(done) < len(set(cart)):
+                holders = dict(await self.fetch(cart_holders_sql, {"cart": [upc for upc in cart if upc not in done]}, connection))
+
+        await self.rows_changed("parts", done)
+        return cart_checkout_results(upcs, done, holders)
+
+    async def cart_checkin(self, upcs):
+        """see Organizer.cart_checkin"""
+        rows = await self.fetch(cart_checkin_sql, {"cart": [int(upc) for upc in upcs], "location": get_location()})
+        found = {upc: (placement, returned) for upc, placement, returned in rows}
+
+        await self.rows_changed("parts", [upc for upc, (_, returned) in found.items() if returned])
+        return cart_checkin_results(upcs, found)
+
+    # ------ adding, updating, and deleting
+
+    async def find_or_add_mfr(self, mfr_name):
+        result = await self.fetch_prepared("find_or_add_mfr", mfr_name)
+
+        # another kiosk added the same manufacturer right in between the lookup and the insert
+        if not result:
+            result = await self.fetch_prepared("mfr_id_from_name", mfr_name)
+        return result[0][0]
+
+    async def allocate_upc(self, mfr_id):
+        """see Organizer.allocate_upc"""
+        item_number = (await self.fetch_prepared("next_upc_item", mfr_id))[0][0]
+        return make_upc(mfr_id, item_number)
+
+    async def add_part(self, desc, mfr_name, mfr_pn, placement="None", url="None"):
+        """add a part and return its upc, see Organizer.add_part"""
+        desc = "".join([char for char in desc if char.isalnum() or char in description_characters])
+        mfr_id = await self.find_or_add_mfr(mfr_name)
+
+        # make sure the webpage starts with https
+        if "." not in url: url = None
+        elif not url.startswith("https://"): url = "https://"+url
+
+        while True:
+            upc = await self.allocate_upc(mfr_id)
+            try:
+                await self.fetch("""
+INSERT INTO parts (part_upc, part_placement, mfr_pn, part_mfr, part_desc, url, date_added)
+VALUES (%s, %s, %s, %s, %s, %s, LOCALTIMESTAMP)""", (int(upc), placement, mfr_pn, mfr_id, desc, url))
+                break
+            except asyncpg.UniqueViolationError:
+                # parts from before the allocator used a different code pattern, so one of those can (rarely) be in the way
+                print(f"upc {upc} was already taken, getting the next one")
+
+        await self.rows_changed("parts", [upc])
+        return upc
+
+    async def update_part(self, part_number, mfr_pn, mfr, desc, url):
+        if url == "": url = None
+        elif not url.startswith("https://"): url = "https://"+url
+
+        # convert the mfr if a name is given instead of an id (adding the manufacturer if it isn't in the database)
+        if isinstance(mfr, str) and not mfr.isdecimal():
+            mfr = await self.find_or_add_mfr(mfr)
+
+        await self.fetch("UPDATE parts SET (mfr_pn, part_mfr, part_desc, url) = (%s, %s, %s, %s) WHERE part_upc = %s",
+                         (mfr_pn, int(mfr), desc, url, int(part_number)))
+        await self.rows_changed("parts", [part_number])
+
+    async def delete_generic(self, key, keyword):
+        """same results as Organizer.delete_generic"""
+        table, column = deletable_tables[keyword]
+        if column == "part_upc": key = int(key)
+
+        try:
+            await self.fetch(f"DELETE FROM {table} WHERE {column} = %s", (key,))
+        except asyncpg.ForeignKeyViolationError:
+            return "-PARTS_STILL_CHECKED_OUT-"
+
+        if table != "manufacturers":
+            await self.rows_changed(table, [key])
+        return "-SUCCESS-"
+
+    async def name_is_taken(self, fname, lname):
+        return bool(await self.fetch("SELECT 1 FROM users WHERE first_name = %s AND last_name = %s", (fname, lname)))
+
+    async def add_user(self, f_name, l_name, email):
+        """create a new user and return the user id, see Organizer.add_user"""
+        f_name = f_name.title()
+        l_name = l_name.title()
+
+        if await self.name_is_taken(f_name, l_name):
+            return "-NAME_ALREADY_TAKEN-"
+
+        # the ids go jdoe, jdoe2, jdoe3, ... so get all the ones that are taken at once and use the first free one
+        userid = (f_name[0] + l_name).lower()
+        while True:
+            taken = {row[0] for row in await self.fetch("SELECT user_id FROM users WHERE user_id LIKE %s", (like_escape(userid) + "%",))}
+            unique_id = 1
+            while userid + str(unique_id if unique_id > 1 else '') in taken:
+                unique_id += 1
+            full_id = userid + str(unique_id if unique_id > 1 else '')
+
+            try:
+                await self.fetch("INSERT INTO users (user_id, first_name, last_name, email) VALUES (%s, %s, %s, %s)", (full_id, f_name, l_name, email))
+                break
+            except asyncpg.UniqueViolationError:
+                # someone at another kiosk got the same id first
+                print(f"user id {full_id} was just taken, trying the next one")
+
+        await self.rows_changed("users", [full_id])
+        return full_id
+
+    async def update_user(self, old_id, fname, lname, email):
+        """same results as Organizer.update_user"""
+        fname = fname.title()
+        lname = lname.title()
+
+        # block existing emails and names
+        if await self.fetch("SELECT 1 FROM users WHERE email = %s AND user_id <> %s", (email, old_id)):
+            return "-EMAIL_ALREADY_TAKEN-"
+        if await self.fetch("SELECT 1 FROM users WHERE first_name = %s AND last_name = %s AND user_id <> %s", (fname, lname, old_id)):
+            return "-NAME_ALREADY_TAKEN-"
+
+        await self.fetch("UPDATE users SET (first_name, last_name, email) = (%s, %s, %s) WHERE user_id = %s", (fname, lname, email, old_id))
+
+        # the name also shows up in the status of every part they have checked out
+        await self.rows_changed("users", [old_id])
+        held = await self.fetch("SELECT checked_out_part FROM part_locations WHERE current_holder = %s", (old_id,))
+        await self.rows_changed("parts", [row[0] for row in held])
+
+        return old_id
+
+    async def rows_changed(self, table, row_keys):
+        """keep the shared search cache and upc index up to date after a write, see Organizer.rows_changed"""
+        if not rows_are_cached(self.search_cache, self.upc_index, table):
+            # there's nothing to update, but a search that's still running shouldn't get cached with the old rows
+            self.search_cache.clear(table)
+            return
+
+        if table == "parts": row_keys = [int(upc) for upc in row_keys]
+        query, args = numbered_params(changed_rows_sql[table], (list(row_keys),))
+        start = perf_counter_ns()
+        rows = [dict(row) for row in await self.pool.fetch(query, *args)]
+        record_query(sys._getframe(0), perf_counter_ns() - start, len(rows), query)
+        update_cached_rows(self.search_cache, self.upc_index, table, row_keys, rows)
+
+
+class TkBridge:
+    """
+    runs an asyncio event loop in a background thread next to tkinter's mainloop.
+    the gui hands it coroutines (usually AsyncOrganizer calls) and gets the results back on tkinter's thread
+    through window.after, so nothing ever waits on the database in a tkinter callback.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True, name="tk async bridge")
+        self.thread.start()
+
+    def submit(self, coroutine, callback=None, on_error=None):
+        """
+        start a coroutine on the bridge's loop without waiting for it.
+        :param callback: called with the result on tkinter's thread when it's done
+        :param on_error: called with the exception on tkinter's thread if it fails. Otherwise the error is just printed
+        :returns: a concurrent.futures.Future for the result
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(lambda done: self.window.after(0, self.deliver, done, callback, on_error))
+        return future
+
+    @staticmethod
+    def deliver(future, callback, on_error):
+        """hand a finished future's result to the gui (this runs on tkinter's thread)"""
+        if future.cancelled(): return
+
+        error = future.exception()
+        if error:
+            if on_error: on_error(error)
+            else: print(f"background database call failed: {error!r}")
+        elif callback:
+            callback(future.result())
+
+    def run(self, coroutine, timeout=None):
+        """run a coroutine on the bridge's loop and wait for the result, for the times that something has to wait anyway"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,64 @@
+"""
+per call latency of the kiosk scan lookups, prepared (what the Organizer does) vs parsed and planned every time.
+run it against a database that already has parts and users in it:
+    ORGANIZER_TEST_HOST=localhost ORGANIZER_TEST_PASSWORD=... python benchmarks/prepared_lookups.py [calls]
+"""
+import os
+import re
+import sys
+from time import perf_counter_ns
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_interactions
+from db_interactions import prepared_queries
+
+
+def unprepared_sql(name):
+    """the same sql as a prepared query, with %s style parameters so it's parsed and planned every time"""
+    return re.sub(r"\$(\d+)", r"%(\1)s", prepared_queries[name][1].replace("%", "%%"))
+
+
+def time_calls(call, keys, calls):
+    """mean microseconds per call, going round the keys"""
+    # once first so the prepare (and the connection's catalog lookups) aren't counted
+    call(keys[0])
+    start = perf_counter_ns()
+    for number in range(calls):
+        call(keys[number % len(keys)])
+    return (perf_counter_ns() - start) / calls / 1000
+
+
+def main(calls=2000):
+    conn_info = {"database": "blur_organizer_db", "user": os.getenv("ORGANIZER_TEST_USER", "postgres"),
+                 "password": os.getenv("ORGANIZER_TEST_PASSWORD", ""), "host": os.getenv("ORGANIZER_TEST_HOST", "localhost")}
+    organizer = db_interactions.Organizer(conn_info=conn_info)
+    upcs = [int(upc) for upc in organizer.part_search("", more_info=False)[:200]]
+    users = organizer.user_search("")[:200]
+    if not upcs or not users: sys.exit("there need to be some parts and users in the database for this")
+
+    def prepared(name):
+        def call(key):
+            organizer.execute_prepared(name, key)
+            organizer.cursor.fetchall()
+        return call
+
+    def unprepared(name):
+        query = unprepared_sql(name)
+
+        def call(key):
+            organizer.cursor.execute(query, {"1": key})
+            organizer.cursor.fetchall()
+        return call
+
+    print(f"{'query':<20}{'unprepared us':>16}{'prepared us':>14}{'speedup':>10}")
+    for name, keys in (("upc_exists", upcs), ("part_num_from_upc", upcs), ("part_data", upcs),
+                       ("userid_exists", users), ("user_data", users), ("part_holder", upcs)):
+        before = time_calls(unprepared(name), keys, calls)
+        after = time_calls(prepared(name), keys, calls)
+        print(f"{name:<20}{before:>16.1f}{after:>14.1f}{before / after:>9.2f}x")
+
+    organizer.release_connection()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -1,5 +1,10 @@
 # label printing
 import os
+import sys
+import json
+import atexit
+from dis import findlinestarts
+from inspect import CO_COROUTINE
 import random
 import pywintypes
 from textwrap import wrap
@@ -7,14 +12,26 @@ from zpl import Label
 from zebra import Zebra
 
 # database
-from psycopg2 import connect
-from psycopg2 import errors as db_err
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from datetime import date, datetime
+from psycopg2 import errors as db_err, sql, connect as db_connect
+from psycopg2.extensions import connection, cursor, ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import datetime, timedelta
 from socket import gethostname
+from threading import Lock, Thread, Event
+from select import select
+from collections import OrderedDict
+from uuid import uuid4
+from array import array
+from bisect import bisect_left
+from io import TextIOWrapper
+from zipfile import ZipFile, ZIP_DEFLATED
+from time import monotonic, perf_counter_ns
 
 # random generation (populate database)
+import csv
 import lorem
+from io import StringIO
+from multiprocessing import Pool, cpu_count
 from random import randint, choice
 from names import get_first_name, get_last_name
 
@@ -30,40 +47,861 @@ params = {
     'port': 5432
 }
 
+# connection pools, one for each set of connection info. See get_pool()
+max_pool_connections = 8
+# the pool closes anything given back past this many idle connections, so it's about how many get used at once:
+# the window's organizer, the change listener's, the upc index loader and a `with Organizer()` or two
+pool_idle_connections = 4
+ping_interval_sec = 30  # how long a connection can sit before the health check actually talks to the server
+connection_pools = {}
+pools_lock = Lock()
+
+# how long every statement takes, see TimedCursor and query_stats()
+# (id of the calling code, where in it): [round trips, total ns, rows, histogram, calling code, where in it, sql]
+query_timings = {}
+query_stats_file = file_location + "query_stats.json"
+# these only pass a query along for whatever called them, so the time goes to their caller
+timing_passthrough = {"execute_prepared", "search_general"}
+
+# cached search results, one cache for each database. See get_search_cache()
+search_caches = {}
+max_cached_searches = 256
+# searches without a page size can return a whole table, so the cache is also limited by how many rows are in it
+max_cached_rows = 20000
+
+# the kiosk's in memory upc lookup, one for each database. See get_upc_index()
+upc_indexes = {}
+
+# the threads that keep the caches up to date with changes from other kiosks, one for each database. See get_listener()
+change_listeners = {}
+
+# bumped whenever the tables change, so the connections know their column catalogs are out of date
+schema_generation = 0
+
+# how much random data populate_db makes. Sample is about what it always made, the bigger ones are for load testing
+populate_presets = {
+    "Sample": {"users": 30, "manufacturers": 15, "parts": 40, "checkouts": 10},
+    "Medium": {"users": 2000, "manufacturers": 300, "parts": 50000, "checkouts": 10000},
+    "Load Test": {"users": 50000, "manufacturers": 3000, "parts": 1000000, "checkouts": 200000},
+}
+populate_chunk_rows = 20000  # rows built by each worker process at a time
+
+# the base queries for the part and user searches. search_general adds the WHERE clause
+part_search_sql = """
+SELECT mfr_pn, mfr_name, part_upc, part_placement, part_desc, date_added,
+    CASE WHEN users.user_id IS NULL THEN 'Available'
+        ELSE 'Out (' || users.first_name || ' ' || users.last_name || ')' END AS status
+FROM parts 
+JOIN manufacturers ON parts.part_mfr = manufacturers.mfr_id
+LEFT JOIN part_locations ON part_locations.checked_out_part = parts.part_upc
+LEFT JOIN users ON part_locations.current_holder = users.user_id
+"""
+user_search_sql = """
+SELECT user_id, first_name, last_name, email FROM users
+"""
+# the full text version of the part search (see Organizer.part_search_ranked), best matches first
+part_ranked_search_sql = part_search_sql + """
+WHERE parts.search_vector @@ to_tsquery('simple', %(query)s)
+ORDER BY ts_rank(parts.search_vector, to_tsquery('simple', %(query)s)) DESC, part_upc
+LIMIT %(limit)s"""
+
+# the part search matches manufacturer names through a subquery instead of the join,
+# that way every word's OR group only looks at the parts table and the indexes can be combined.
+part_search_predicates = {
+    "mfr_name": "part_mfr = ANY(ARRAY(SELECT mfr_id FROM manufacturers WHERE {expression} LIKE %s))"
+}
+
+# manufacturer names with spaces, dots, dashes, etc. and capitalization removed. Same thing as strip_string()
+mfr_key_sql = "lower(translate({}, ' ,.-_', ''))"
+
+# queries that get run all the time, mostly from kiosk mode. name: (parameter types, sql)
+# these are prepared once on each connection and then run with EXECUTE, so postgres doesn't re-plan them every time
+prepared_queries = {
+    "userid_exists": (["varchar"], "SELECT user_id FROM users WHERE user_id = $1"),
+    "upc_exists": (["bigint"], "SELECT part_upc FROM parts WHERE part_upc = $1"),
+    "upc_index_rows": (["bigint[]"], """
+SELECT part_upc, mfr_pn, part_placement, checked_out_part IS NOT NULL
+FROM parts LEFT JOIN part_locations ON part_locations.checked_out_part = parts.part_upc
+WHERE part_upc = ANY($1)"""),
+    "part_num_from_upc": (["bigint"], "SELECT mfr_pn FROM parts WHERE part_upc = $1"),
+    "part_data": (["bigint"], """
+SELECT part_upc, part_placement, mfr_name, mfr_pn, part_desc, url, date_added,
+    current_holder, first_name, last_name, checkout_timestamp
+FROM parts 
+JOIN manufacturers ON parts.part_mfr = manufacturers.mfr_id
+LEFT JOIN part_locations ON part_locations.checked_out_part = parts.part_upc
+LEFT JOIN users ON part_locations.current_holder = users.user_id
+WHERE part_upc = $1"""),
+    "part_holder": (["bigint"], "SELECT current_holder FROM part_locations WHERE checked_out_part = $1"),
+    "user_name": (["varchar"], "SELECT first_name, last_name FROM users WHERE user_id = $1"),
+    "user_data": (["varchar"], """
+SELECT user_id, first_name, last_name, email, checked_out_part, checkout_timestamp FROM users
+LEFT JOIN part_locations ON part_locations.current_holder = users.user_id
+WHERE user_id = $1
+ORDER BY checkout_timestamp"""),
+    "checkout_insert": (["bigint", "varchar"], "INSERT INTO part_locations VALUES ($1, $2, CURRENT_TIMESTAMP)"),
+    "checkout_transfer": (["bigint", "varchar"], """
+UPDATE part_locations 
+SET current_holder = $2, checkout_timestamp = CURRENT_TIMESTAMP 
+WHERE checked_out_part = $1"""),
+    "update_location": (["bigint", "varchar"], "UPDATE parts SET part_placement = $2 WHERE part_upc = $1"),
+    "next_upc_item": (["integer"], "UPDATE manufacturers SET upc_counter = upc_counter + 1 WHERE mfr_id = $1 RETURNING upc_counter"),
+    "mfr_id_from_name": (["varchar"], f"SELECT mfr_id FROM manufacturers WHERE mfr_key = {mfr_key_sql.format('$1')}"),
+    "mfr_part_count": (["varchar"], f"SELECT number_of_parts FROM manufacturers WHERE mfr_key = {mfr_key_sql.format('$1')}"),
+    "find_or_add_mfr": (["varchar"], f"""
+WITH found AS (
+    SELECT mfr_id FROM manufacturers WHERE mfr_key = {mfr_key_sql.format('$1')}
+), added AS (
+    INSERT INTO manufacturers (mfr_name, number_of_parts)
+    SELECT $1, 0 WHERE NOT EXISTS (SELECT 1 FROM found)
+    ON CONFLICT DO NOTHING
+    RETURNING mfr_id
+)
+SELECT mfr_id FROM found UNION ALL SELECT mfr_id FROM added"""),
+    # history, newest first. The (time, id) pair is the keyset for the next page, same as the search paging
+    "part_history": (["bigint", "timestamp", "bigint", "integer"], """
+SELECT event_time, event_id, event, checkout_events.user_id, first_name || ' ' || last_name
+FROM checkout_events LEFT JOIN users ON users.user_id = checkout_events.user_id
+WHERE part_upc = $1 AND (event_time, event_id) < ($2, $3)
+ORDER BY event_time DESC, event_id DESC
+LIMIT $4"""),
+    "user_history": (["varchar", "timestamp", "bigint", "integer"], """
+SELECT event_time, event_id, event, checkout_events.part_upc, mfr_pn
+FROM checkout_events LEFT JOIN parts ON parts.part_upc = checkout_events.part_upc
+WHERE user_id = $1 AND (event_time, event_id) < ($2, $3)
+ORDER BY event_time DESC, event_id DESC
+LIMIT $4"""),
+}
+
+# checking out and returning a whole cart of parts at once (see Organizer.cart_checkout and cart_checkin).
+# parts the user already has count as checked out again
+cart_checkout_sql = """
+WITH checked_out AS (
+    INSERT INTO part_locations (checked_out_part, current_holder, checkout_timestamp)
+    SELECT part_upc, %(user_id)s, CURRENT_TIMESTAMP FROM parts WHERE part_upc = ANY(%(cart)s)
+    ON CONFLICT (checked_out_part) DO UPDATE SET current_holder = EXCLUDED.current_holder, checkout_timestamp = EXCLUDED.checkout_timestamp
+    WHERE %(force)s OR part_locations.current_holder = EXCLUDED.current_holder
+    RETURNING checked_out_part
+), moved AS (
+    UPDATE parts SET part_placement = %(location)s FROM checked_out WHERE parts.part_upc = checked_out.checked_out_part
+)
+SELECT checked_out_part FROM checked_out"""
+cart_holders_sql = """
+SELECT checked_out_part, first_name || ' ' || last_name
+FROM part_locations JOIN users ON part_locations.current_holder = users.user_id
+WHERE checked_out_part = ANY(%(cart)s)"""
+# the placement in the select is from before the update, which is where the part goes back to (like part_checkin)
+cart_checkin_sql = """
+WITH returned AS (
+    DELETE FROM part_locations WHERE checked_out_part = ANY(%(cart)s)
+    RETURNING checked_out_part
+), moved AS (
+    UPDATE parts SET part_placement = %(location)s FROM returned WHERE parts.part_upc = returned.checked_out_part
+)
+SELECT part_upc, part_placement, returned.checked_out_part IS NOT NULL
+FROM parts LEFT JOIN returned ON returned.checked_out_part = parts.part_upc
+WHERE part_upc = ANY(%(cart)s)"""
+
+# what the search cache and upc index need to know about rows that changed (see Organizer.rows_changed)
+changed_rows_sql = {
+    "parts": """
+SELECT part_upc, part_placement, mfr_pn, mfr_name, part_desc, url, checked_out_part IS NOT NULL AS checked_out
+FROM parts
+JOIN manufacturers ON parts.part_mfr = manufacturers.mfr_id
+LEFT JOIN part_locations ON part_locations.checked_out_part = parts.part_upc
+WHERE part_upc = ANY(%s)""",
+    "users": "SELECT user_id, first_name, last_name, email FROM users WHERE user_id = ANY(%s)",
+}
+
+# the characters other than letters and numbers that are allowed in part descriptions
+description_characters = " !\"#$%&'()*+,-./:;<=>?@[]{}\\^_`|~"
+
+# what delete_generic deletes for each keyword: (table, key column)
+deletable_tables = {
+    "user": ["users", "user_id"],
+    "part": ["parts", "part_upc"],
+    "manufacturer": ["manufacturers", "mfr_name"]
+}
+
+# which table get_rows reads a column from when more than one table has a column by that name. the first one wins,
+# and tables that aren't in here come after these ones, by name
+column_table_priority = ["users", "manufacturers", "parts", "part_locations"]
+
+# csv header names that import_parts understands, and the staging table columns they go into
+import_columns = {
+    "manufacturer": "mfr_name",
+    "part number": "mfr_pn",
+    "description": "part_desc",
+    "url": "url",
+    "placement": "part_placement",
+}
+
+# the tables (and the columns that aren't made by postgres) that go into a backup, in the order they have to be restored in
+backup_tables = {
+    "users": "user_id, first_name, last_name, email",
+    "manufacturers": "mfr_id, mfr_name, number_of_parts, upc_counter",
+    "parts": "part_upc, part_placement, mfr_pn, part_mfr, part_desc, url, date_added",
+    "part_locations": "checked_out_part, current_holder, checkout_timestamp",
+    "checkout_events": "event_id, event_time, part_upc, user_id, event",
+}
+backup_version = 1
+
+# the columns that the search box looks through. each one gets a trigram index on the same expression the search uses
+searched_columns = {
+    "parts": ["part_upc", "part_placement", "mfr_pn", "part_desc", "url"],
+    "manufacturers": ["mfr_name"],
+    "users": ["user_id", "first_name", "last_name", "email"]
+}
+
+# where parts end up when they're checked out or returned at this kiosk, see get_location()
+kiosk_location = None
+
 
 def get_location():
     """return the name that will show up as the location when a part is checked out from this device
-    If no location file exists the current hostname is set as the new locatoin. This can be changed in Danger Zone."""
-    try:
-        with open(kiosk_path, "r") as kiosk:
-            return kiosk.read()
-    except FileNotFoundError:
-        new_name = gethostname()
-        set_location(new_name)
-        return new_name
+    If no location file exists the current hostname is set as the new locatoin. This can be changed in Danger Zone.
+    The file is only read the first time, after that it comes from memory (set_location() changes both)"""
+    global kiosk_location
+    if kiosk_location is None:
+        try:
+            with open(kiosk_path, "r") as kiosk:
+                kiosk_location = kiosk.read()
+        except FileNotFoundError:
+            set_location(gethostname())
+
+    return kiosk_location
 
 
 def set_location(new_name):
     """Set a new name to appear when parts are checked out from this device"""
-    # make apostrophes (') safe
-    new_name = new_name.replace("'", "''")
-
+    global kiosk_location
+    # the location is passed to postgres as a parameter, so apostrophes (') don't need escaping here anymore
     with open(kiosk_path, "w") as kiosk:
         kiosk.write(new_name)
 
+    # every Organizer in this process reads it from here, so they all move at once
+    kiosk_location = new_name
+
+
+class TimedCursor(cursor):
+    """
+    a cursor that times everything it sends to the server. statements are counted under the method and line that ran
+    them instead of their sql, so there's a bounded number of them no matter what gets put into the queries
+    """
+    def execute(self, query, vars=None):
+        start = perf_counter_ns()
+        try:
+            return cursor.execute(self, query, vars)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, self.rowcount, query)
+
+    def executemany(self, query, vars_list):
+        start = perf_counter_ns()
+        try:
+            return cursor.executemany(self, query, vars_list)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, self.rowcount, query)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = perf_counter_ns()
+        try:
+            return cursor.copy_expert(self, sql, file, size)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, self.rowcount, sql)
+
+
+class NamedTimedCursor(TimedCursor):
+    """
+    a server side (named) cursor. execute only declares it, so the rows come back in the fetches, and those get timed
+    too. they're all recorded as "named cursor <name>: <sql>" so they're easy to pick out in query_stats()
+    """
+    declared = None
+
+    def execute(self, query, vars=None):
+        self.declared = f"named cursor {self.name}: {query.as_string(self) if isinstance(query, sql.Composable) else query}"
+        start = perf_counter_ns()
+        try:
+            return cursor.execute(self, query, vars)
+        finally:
+            record_query(sys._getframe(1), perf_counter_ns() - start, self.rowcount, self.declared)
+
+    def fetchone(self):
+        start = perf_counter_ns()
+        row = cursor.fetchone(self)
+        record_query(sys._getframe(1), perf_counter_ns() - start, row is not None, self.declared)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter_ns()
+        rows = cursor.fetchmany(self, self.arraysize if size is None else size)
+        record_query(sys._getframe(1), perf_counter_ns() - start, len(rows), self.declared)
+        return rows
+
+    def fetchall(self):
+        start = perf_counter_ns()
+        rows = cursor.fetchall(self)
+        record_query(sys._getframe(1), perf_counter_ns() - start, len(rows), self.declared)
+        return rows
+
+    def __iter__(self):
+        # the same itersize batches psycopg2 fetches in, one round trip each.
+        # the frame is whoever is looping over the cursor, since that's who a generator's frame goes back to
+        while True:
+            start = perf_counter_ns()
+            rows = cursor.fetchmany(self, self.itersize)
+            record_query(sys._getframe(1), perf_counter_ns() - start, len(rows), self.declared)
+            if not rows: return
+            yield from rows
+
+
+def record_query(frame, elapsed_ns, rows, query):
+    """
+    add one round trip to query_timings. frame is whoever called the cursor.
+    this runs on every query, so it has to stay cheap: f_lineno is slow to look up, so the line number is only worked
+    out in query_stats(), and there's no lock (a count getting lost now and then when two threads collide is fine here)
+    """
+    code = frame.f_code
+    if code.co_name in timing_passthrough:
+        frame = frame.f_back
+        code = frame.f_code
+    key = (id(code), frame.f_lasti)
+
+    timing = query_timings.get(key)
+    if timing is None:
+        # the sql is only kept so you can tell what the statement was
+        timing = query_timings.setdefault(key, [0, 0, 0, [0] * 64, code, frame.f_lasti, " ".join(str(query).split())[:200]])
+    timing[0] += 1
+    timing[1] += elapsed_ns
+    if rows > 0: timing[2] += rows
+    # bucket n is for round trips that took at least 2**(n-1) and under 2**n nanoseconds
+    timing[3][elapsed_ns.bit_length()] += 1
+
+
+def statement_line(code, offset):
+    """the line number of the bytecode at offset"""
+    line = code.co_firstlineno
+    for start, start_line in findlinestarts(code):
+        if start > offset: break
+        if start_line is not None: line = start_line
+    return line
+
+
+def query_stats():
+    """
+    everything TimedCursor (and the AsyncOrganizer) has recorded in this process, by statement ("method:line") and by method.
+    histograms are {upper bound in ns: round trips}
+    """
+    timings = {}
+    for round_trips, total_ns, rows, histogram, code, offset, query in list(query_timings.values()):
+        # a line with more than one cursor call in it shows up once for each call, so those get added together
+        # the AsyncOrganizer's methods have the same names as the Organizer's, so they get told apart
+        method = f"{code.co_name} (async)" if code.co_flags & CO_COROUTINE else code.co_name
+        key = (method, statement_line(code, offset))
+        totals = timings.setdefault(key, [0, 0, 0, [0] * 64, query])
+        totals[0] += round_trips
+        totals[1] += total_ns
+        totals[2] += rows
+        totals[3] = [a + b for a, b in zip(totals[3], histogram)]
+    timings = timings.items()
+
+    def summary(round_trips, total_ns, rows, histogram):
+        return {
+            "round_trips": round_trips,
+            "total_ms": total_ns / 1e6,
+            "mean_ms": total_ns / round_trips / 1e6,
+            "rows": rows,
+            "histogram": {2 ** bucket: count for bucket, count in enumerate(histogram) if count},
+        }
+
+    statements = {}
+    methods = {}
+    for (method, line), (round_trips, total_ns, rows, histogram, query) in sorted(timings, key=lambda item: -item[1][1]):
+        statements[f"{method}:{line}"] = {**summary(round_trips, total_ns, rows, histogram), "sql": query}
+
+        # methods add up all of their statements
+        totals = methods.setdefault(method, [0, 0, 0, [0] * 64])
+        totals[0] += round_trips
+        totals[1] += total_ns
+        totals[2] += rows
+        totals[3] = [a + b for a, b in zip(totals[3], histogram)]
+
+    methods = {method: summary(*totals) for method, totals in sorted(methods.items(), key=lambda item: -item[1][1])}
+    return {"methods": methods, "statements": statements}
+
+
+def reset_query_stats():
+    query_timings.clear()
+
+
+@atexit.register
+def dump_query_stats(path=None):
+    """write query_stats() to a json file, which happens on its own when the program exits"""
+    if not query_timings: return
+
+    try:
+        with open(path or query_stats_file, "w") as stats_file:
+            json.dump(query_stats(), stats_file, indent=2)
+    except OSError as er:
+        print(f"couldn't save the query stats: {er}")
+
+
+class PooledConnection(connection):
+    """a psycopg2 connection that remembers when it was last known to be working and what's been prepared on it"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_checked = monotonic()
+
+        # every cursor from a pooled connection is timed, see query_stats()
+        self.cursor_factory = TimedCursor
+
+        # names from prepared_queries that have been prepared in this connection's session
+        self.prepared = set()
+
+        # column name: table name, see Organizer.column_table(). loaded once for each schema_generation
+        self.columns = {}
+        self.columns_generation = None
+
+    def cursor(self, name=None, **kwargs):
+        # named cursors get their fetches timed as well, since that's where their rows actually come from
+        if name is not None and "cursor_factory" not in kwargs: kwargs["cursor_factory"] = NamedTimedCursor
+        return super().cursor(name, **kwargs)
+
+
+def invalidate_schema_cache():
+    """make every connection reload its column catalog the next time it's used, after tables have been made or changed"""
+    global schema_generation
+    schema_generation += 1
+
+
+def pool_key(conn_info):
+    """turn a connection info dictionary into something that can be used as a dictionary key"""
+    return tuple(sorted((key, str(value)) for key, value in conn_info.items()))
+
+
+def get_pool(conn_info):
+    """get the connection pool for this connection info, or make a new one if there isn't one yet"""
+    key = pool_key(conn_info)
+
+    with pools_lock:
+        if key not in connection_pools:
+            print(f"opening connection pool for {conn_info.get('database')}")
+            connection_pools[key] = ThreadedConnectionPool(pool_idle_connections, max_pool_connections, connection_factory=PooledConnection, **conn_info)
+
+        return connection_pools[key]
+
+
+def close_pools(db_name=None):
+    """close all the pooled connections, or only the ones connected to db_name if it's given"""
+    with pools_lock:
+        for key in list(connection_pools.keys()):
+            if db_name and dict(key).get("database") != db_name: continue
+            connection_pools.pop(key).closeall()
+
+
+def get_search_cache(conn_info):
+    """get the search cache for this connection info. Every Organizer on the same database shares it"""
+    key = pool_key(conn_info)
+
+    with pools_lock:
+        if key not in search_caches:
+            search_caches[key] = SearchCache(max_cached_searches, max_cached_rows)
+
+        return search_caches[key]
+
+
+class SearchCache:
+    """
+    least recently used cache of search results.
+    the keys are (table, search words, searched columns, other options...), and each entry remembers the keys
+    (upcs or user ids) of the rows in it, so a write to one row only throws out the entries it could have changed.
+
+    a search can read its rows before a write commits and only get put in after the write invalidated the cache.
+    so every invalidate or clear bumps the table's generation, and put() drops results that were searched for in an
+    older one. get the generation with generation() before running the query.
+
+    there can be max_entries searches and max_rows rows in the cache at once, a single search with more rows
+    than that isn't cached at all
+    """
+    def __init__(self, max_entries, max_rows):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()  # key: (row keys, results)
+        self.rows = 0  # the number of row keys in all the entries
+        self.lock = Lock()
+        self.generations = {}  # table: how many times it's been invalidated
+        self.cleared = 0  # how many times everything has been cleared at once
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """get the cached results for a search, or None if they aren't cached"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][1]
+
+    def generation(self, table):
+        with self.lock:
+            return self.cleared, self.generations.get(table, 0)
+
+    def put(self, key, row_keys, results, generation):
+        with self.lock:
+            # something changed while the search was running, so the results might be out of date already
+            if generation != (self.cleared, self.generations.get(key[0], 0)): return
+
+            row_keys = frozenset(row_keys)
+            if len(row_keys) > self.max_rows: return
+
+            if key in self.entries: self.forget(key)
+            self.entries[key] = (row_keys, results)
+            self.rows += len(row_keys)
+
+            # forget the least recently used searches
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                self.forget(next(iter(self.entries)))
+
+    def forget(self, key):
+        """take one search out of the cache. the lock has to be held already"""
+        row_keys, _ = self.entries.pop(key)
+        self.rows -= len(row_keys)
+
+    def has_table(self, table):
+        with self.lock:
+            return any(key[0] == table for key in self.entries)
+
+    def invalidate(self, table, row_keys=(), values=None):
+        """
+        throw out the searches for the table that a write could have changed. That's the ones that had the written
+        rows in them, and (if values is given) the ones that the new row {column: value} would match now.
+        """
+        with self.lock:
+            self.generations[table] = self.generations.get(table, 0) + 1
+            for key in list(self.entries):
+                if key[0] != table: continue
+
+                cached_keys = self.entries[key][0]
+                if any(row_key in cached_keys for row_key in row_keys) or (values and search_could_match(key, values)):
+                    self.forget(key)
+
+    def clear(self, table=None):
+        """throw out everything (or everything for one table), for when lots of rows change at once"""
+        with self.lock:
+            if table is None: self.cleared += 1
+            else: self.generations[table] = self.generations.get(table, 0) + 1
+            for key in list(self.entries):
+                if table is None or key[0] == table:
+                    self.forget(key)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "rows": self.rows}
+
+
+def active_filters(filters):
+    """the columns that are turned on in a search's filters, in a form that can go in a cache key"""
+    return tuple(column for column, state in filters.items() if state)
+
+
+def get_upc_index(conn_info):
+    """get the upc index for this connection info. Every Organizer on the same database shares it"""
+    key = pool_key(conn_info)
+
+    with pools_lock:
+        if key not in upc_indexes:
+            upc_indexes[key] = UpcIndex()
+
+        return upc_indexes[key]
+
+
+class UpcIndex:
+    """
+    every upc in the database with its part number, placement, and whether it's checked out, so the kiosk
+    can look up scans without going to the server.
+
+    everything is kept in flat arrays sorted by upc instead of a dict of tuples, which works out to about 30 bytes a
+    part, so a million parts is around 30MB. Changes go in a small dict on top (self.changes) and get merged into
+    the arrays once there are enough of them.
+    """
+    max_changes = 5000
+
+    def __init__(self):
+        self.lock = Lock()
+        self.merge_lock = Lock()
+        self.loaded = False
+        self.loading = False
+        self.wanted = False  # if this kiosk has ever loaded it, in which case it gets loaded again after a reset
+        self.generation = 0  # goes up every time the arrays are replaced, see set_rows()
+        self.set_rows([])
+
+        # upc: (part number, placement, checked out), or None if the part was deleted
+        self.changes = {}
+
+    def set_rows(self, rows, generation=None):
+        """
+        replace the arrays with (upc, part number, placement, checked out) rows, which have to be sorted by upc.
+        with a generation, this doesn't do anything (and returns False) if the arrays were replaced since then, so a
+        merge or load that was working from old rows can't overwrite newer ones
+        """
+        upcs = array("q")
+        part_number_ends = array("I")
+        part_numbers = bytearray()
+        placement_ids = array("I")
+        placements = {}  # there are only so many shelves, so each placement is only stored once
+        checked_out = bytearray()
+
+        for upc, part_number, placement, out in rows:
+            upcs.append(upc)
+            part_numbers += part_number.encode()
+            part_number_ends.append(len(part_numbers))
+            placement_ids.append(placements.setdefault(placement, len(placements)))
+            checked_out.append(out)
+
+        with self.lock:
+            if generation is not None and generation != self.generation: return False
+
+            self.generation += 1
+            self.upcs = upcs
+            self.part_number_ends = part_number_ends
+            self.part_numbers = bytes(part_numbers)
+            self.placements = list(placements)
+            self.placement_ids = placement_ids
+            self.checked_out = checked_out
+        return True
+
+    def snapshot(self):
+        """all the arrays, from the same set_rows(). only call this with self.lock held"""
+        return self.upcs, self.part_number_ends, self.part_numbers, self.placements, self.placement_ids, self.checked_out
+
+    @staticmethod
+    def base_row(arrays, position):
+        """the row at a position in a snapshot() of the arrays"""
+        upcs, part_number_ends, part_numbers, placements, placement_ids, checked_out = arrays
+        start = part_number_ends[position - 1] if position else 0
+        part_number = part_numbers[start:part_number_ends[position]].decode()
+        return part_number, placements[placement_ids[position]], bool(checked_out[position])
+
+    def lookup(self, upc):
+        """
+        get (part number, placement, checked out) for a upc.
+        :returns: None if the part isn't in the index
+        """
+        upc = int(upc)
+        with self.lock:
+            if upc in self.changes:
+                return self.changes[upc]
+
+            position = bisect_left(self.upcs, upc)
+            if position < len(self.upcs) and self.upcs[position] == upc:
+                return self.base_row(self.snapshot(), position)
 
-def find_common_elements(list_to_compare):
-    if not list_to_compare or list_to_compare == [[['No matching items', 'No matching items']]]:
         return None
 
-    # Start with the first list's elements as the base set
-    common_elements = set(list_to_compare[0])
+    def reset(self):
+        """empty the index after lots of parts changed at once. it has to be loaded again to be used"""
+        self.set_rows([])
+        with self.lock:
+            self.changes = {}
+            self.loaded = False
+
+    def update(self, upc, row):
+        """put in a new or changed part (part number, placement, checked out), or None to take it out"""
+        self.update_many({upc: row})
+
+    def update_many(self, rows):
+        """update() for a {upc: row} dict of parts, with at most one merge"""
+        with self.lock:
+            for upc, row in rows.items():
+                self.changes[int(upc)] = row
+            merge = len(self.changes) > self.max_changes
+
+        # merging a big index takes a second or two, so it doesn't hold up whoever made the change
+        if merge: Thread(target=self.merge, daemon=True).start()
+
+    def rows(self):
+        """all the rows in upc order, with the changes mixed in"""
+        with self.lock:
+            changes = dict(self.changes)
+            arrays = self.snapshot()
+
+        return self.merged_rows(arrays, changes)
+
+    def merged_rows(self, arrays, changes):
+        """the rows in a snapshot() of the arrays in upc order, with a copy of the changes mixed in"""
+        upcs = arrays[0]
+        changed_upcs = sorted(changes)
+        next_change = 0
+        for position, upc in enumerate(upcs):
+            # new and changed parts up to this one
+            while next_change < len(changed_upcs) and changed_upcs[next_change] <= upc:
+                changed_upc = changed_upcs[next_change]
+                if changes[changed_upc]: yield changed_upc, *changes[changed_upc]
+                next_change += 1
+
+            if upc not in changes:
+                yield upc, *self.base_row(arrays, position)
+
+        # new parts after the last one
+        for changed_upc in changed_upcs[next_change:]:
+            if changes[changed_upc]: yield changed_upc, *changes[changed_upc]
+
+    def merge(self):
+        """fold the changes into the arrays"""
+        # only one merge at a time, the other one can just skip it
+        if not self.merge_lock.acquire(blocking=False): return
+
+        try:
+            with self.lock:
+                merged_changes = dict(self.changes)
+                arrays = self.snapshot()
+                generation = self.generation
+
+            # if the index got reset or reloaded in the meantime, these rows are out of date, and so are the changes
+            if not self.set_rows(self.merged_rows(arrays, merged_changes), generation): return
 
-    # Intersect with the remaining lists
-    for lst in list_to_compare[1:]:
-        common_elements.intersection_update(lst)
+            # only forget the changes that made it in, more could have come in while merging
+            with self.lock:
+                for upc, row in merged_changes.items():
+                    if self.changes.get(upc, 0) == row:
+                        del self.changes[upc]
+        finally:
+            self.merge_lock.release()
 
-    return list(common_elements)
+
+def get_listener(conn_info):
+    """get the change listener for this connection info (it still has to be started)"""
+    key = pool_key(conn_info)
+
+    with pools_lock:
+        if key not in change_listeners:
+            change_listeners[key] = ChangeListener(conn_info)
+
+        return change_listeners[key]
+
+
+def stop_listeners(db_name=None):
+    """stop all the change listeners, or only the ones listening to db_name if it's given, and wait for them to let go of their connections"""
+    with pools_lock:
+        stopping = [change_listeners.pop(key) for key in list(change_listeners.keys()) if not db_name or dict(key).get("database") == db_name]
+
+    # not while holding the lock, a listener that's connecting right now needs it to get its organizer
+    for listener in stopping:
+        listener.stop()
+        if listener.thread: listener.thread.join()
+
+
+class ChangeListener:
+    """
+    listens for the notify_change notifications on its own connection in a background thread, and applies them
+    to the search cache and upc index for the database (see Organizer.apply_changes). That way a kiosk's caches
+    find out when another kiosk checks something in or out, without polling.
+    """
+    def __init__(self, conn_info):
+        self.conn_info = conn_info
+        self.thread = None
+        self.stopping = Event()
+
+    def start(self):
+        """start listening, if it isn't already"""
+        if self.thread and self.thread.is_alive():
+            if not self.stopping.is_set(): return
+
+            # it was stopped, but hasn't noticed yet
+            self.thread.join()
+
+        self.stopping.clear()
+        self.thread = Thread(target=self.run, daemon=True, name="change listener")
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        missed_changes = False
+        while not self.stopping.is_set():
+            try:
+                self.listen(missed_changes)
+            except (db_err.OperationalError, db_err.InterfaceError) as error:
+                print(f"the change listener lost its connection, trying again in {listener_retry_sec} seconds: {error}")
+                missed_changes = True
+                self.stopping.wait(listener_retry_sec)
+            except Exception as error:
+                # anything else (like the tables being gone in the middle of a format) can't be allowed to end the thread,
+                # or the caches would never hear about another change
+                print(f"the change listener ran into {type(error).__name__}, trying again in {listener_retry_sec} seconds: {error}")
+                missed_changes = True
+                self.stopping.wait(listener_retry_sec)
+
+    def listen(self, missed_changes):
+        # LISTEN sticks to the connection, so this one doesn't come from the pool
+        listen_conn = db_connect(**self.conn_info)
+        listen_conn.autocommit = True
+
+        try:
+            with listen_conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {change_channel}")
+
+            with Organizer(conn_info=self.conn_info) as organizer:
+                # anything could have changed while we weren't listening
+                if missed_changes: organizer.apply_changes({"*": set()})
+
+                while not self.stopping.is_set():
+                    # wake up every second to see if we've been stopped
+                    if not select([listen_conn], [], [], 1)[0]: continue
+                    listen_conn.poll()
+
+                    # group everything that came in together, so it's one query for each table
+                    changes = {}
+                    while listen_conn.notifies:
+                        table, _, key = listen_conn.notifies.pop(0).payload.partition(" ")
+                        changes.setdefault(table, set()).add(key)
+
+                    organizer.apply_changes(changes)
+        finally:
+            listen_conn.close()
+
+
+def search_could_match(cache_key, values):
+    """
+    would a row with these {column: value}s show up in the cached search? Same rules as build_search:
+    every word has to be in at least one of the searched columns.
+    """
+    table, words, columns, full_text = cache_key[:4]
+
+    # the full text ranking isn't worth redoing here, any new part could be one of the best matches
+    if full_text: return True
+
+    row_text = [str(values[column]).lower() for column in columns if values.get(column) is not None]
+    for word in words:
+        if not any(word in text for text in row_text): return False
+
+    return True
+
+
+def connection_is_alive(conn):
+    """
+    cheap health check for a pooled connection.
+    only does an actual round trip if the connection hasn't been used in a while
+    """
+    if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+        return False
+
+    # recently used connections are trusted without asking the server
+    if monotonic() - conn.last_checked < ping_interval_sec:
+        return True
+
+    try:
+        with conn.cursor() as ping:
+            ping.execute("SELECT 1")
+    except (db_err.OperationalError, db_err.InterfaceError):
+        return False
+
+    conn.last_checked = monotonic()
+    return True
 
 
 def render_upc(code, part_number, desc_text, printer="Zebra "):
@@ -77,7 +915,7 @@ def render_upc(code, part_number, desc_text, printer="Zebra "):
     # generate a zpl command
 
     # change the code to a number
-    if code.isnumeric():
+    if code.isdecimal():
         code = int(code)
     else:
         print(f"somehow, {code} was generated as a upc")
@@ -167,13 +1005,649 @@ def render_upc(code, part_number, desc_text, printer="Zebra "):
         return "Invalid printer type. This is most likely an issue with the program.", code, placement, desc_text, printer
 
 
+def search_words(search_term):
+    """split a search into the words that build_search looks for (lowercase, and scanned upcs without the leading zeros)"""
+    return tuple(str(int(word)) if word.isdecimal() else word.lower() for word in search_term.split())
+
+
+def trigram_index_name(table, column):
+    """the name of the trigram index for a searched column, see schema_upgrades"""
+    return f"{table}_{column}_trgm"
+
+
+def like_escape(text):
+    """escape the LIKE wildcards (% and _) in text, so they're searched for like any other character"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_expression(column):
+    """the expression that a column is searched with. The trigram indexes are built on this exact expression"""
+    return f"lower(cast({column} as varchar))"
+
+
+# LISTEN/NOTIFY channel for changes made by other kiosks, and the tables that send them: (trigger events, key column)
+change_channel = "organizer_changes"
+notified_tables = {
+    "parts": ("INSERT OR UPDATE OR DELETE", "part_upc"),
+    "users": ("INSERT OR UPDATE OR DELETE", "user_id"),
+    # the part counts change all the time and nobody caches them, so only the name matters
+    "manufacturers": ("INSERT OR UPDATE OF mfr_name OR DELETE", "mfr_id"),
+    "part_locations": ("INSERT OR UPDATE OR DELETE", "checked_out_part"),
+}
+listener_retry_sec = 5  # how long the listener waits before reconnecting
+
+# the changes to parts that number_of_parts gets updated for, and the transition tables the trigger needs to see them
+counted_part_events = {
+    "INSERT": "REFERENCING NEW TABLE AS new_parts",
+    "UPDATE": "REFERENCING OLD TABLE AS old_parts NEW TABLE AS new_parts",
+    "DELETE": "REFERENCING OLD TABLE AS old_parts",
+    "TRUNCATE": "",
+}
+
+# the changes to part_locations that go into the checkout_events log, and the transition tables the trigger needs to see them
+logged_checkout_events = {
+    "INSERT": "REFERENCING NEW TABLE AS new_locations",
+    "UPDATE": "REFERENCING OLD TABLE AS old_locations NEW TABLE AS new_locations",
+    "DELETE": "REFERENCING OLD TABLE AS old_locations",
+}
+
+# sets number_of_parts for every manufacturer from scratch. The parts_count triggers keep it right after that,
+# so this is only for fixing up old databases (see Organizer.recount_mfr_parts)
+recount_parts_sql = """
+UPDATE manufacturers SET number_of_parts = counts.parts
+FROM (
+    SELECT mfr_id, count(part_upc) AS parts
+    FROM manufacturers LEFT JOIN parts ON parts.part_mfr = manufacturers.mfr_id
+    GROUP BY mfr_id
+) AS counts
+WHERE manufacturers.mfr_id = counts.mfr_id AND manufacturers.number_of_parts IS DISTINCT FROM counts.parts"""
+
+# changes to the database after the original tables were made. These all have to be safe to run more than once,
+# as format_database runs them on new databases and upgrade_database runs them on databases that already exist.
+schema_upgrades = [
+    # substring search indexes (the search does LIKE '%word%', which only trigram indexes can help with)
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    *(
+        f"CREATE INDEX IF NOT EXISTS {trigram_index_name(table, column)} ON {table} USING gin ({search_expression(column)} gin_trgm_ops)"
+        for table, columns in searched_columns.items() for column in columns
+    ),
+    # for finding the parts made by a manufacturer
+    "CREATE INDEX IF NOT EXISTS parts_part_mfr ON parts (part_mfr)",
+
+    # full text search. search_vector is kept up to date by a trigger, as it needs the manufacturer name from the other table
+    "ALTER TABLE parts ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+CREATE OR REPLACE FUNCTION parts_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.mfr_pn, '') || ' ' || NEW.part_upc::text), 'A') ||
+        setweight(to_tsvector('simple', coalesce((SELECT mfr_name FROM manufacturers WHERE mfr_id = NEW.part_mfr), '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.part_desc, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.url, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS parts_search_vector ON parts",
+    """
+CREATE TRIGGER parts_search_vector BEFORE INSERT OR UPDATE OF part_upc, mfr_pn, part_mfr, part_desc, url ON parts
+FOR EACH ROW EXECUTE FUNCTION parts_search_vector_update()""",
+    # renaming a manufacturer has to redo the vectors of all its parts
+    """
+CREATE OR REPLACE FUNCTION manufacturers_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE parts SET part_mfr = part_mfr WHERE part_mfr = NEW.mfr_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS manufacturers_search_vector ON manufacturers",
+    """
+CREATE TRIGGER manufacturers_search_vector AFTER UPDATE OF mfr_name ON manufacturers
+FOR EACH ROW EXECUTE FUNCTION manufacturers_search_vector_update()""",
+    # fill in the vectors for parts that were added before the trigger existed
+    "UPDATE parts SET part_mfr = part_mfr WHERE search_vector IS NULL",
+    "CREATE INDEX IF NOT EXISTS parts_search_vector ON parts USING gin (search_vector)",
+
+    # upc item numbers for each manufacturer, see Organizer.allocate_upc()
+    "ALTER TABLE manufacturers ADD COLUMN IF NOT EXISTS upc_counter integer NOT NULL DEFAULT 0",
+    "UPDATE manufacturers SET upc_counter = (SELECT count(*) FROM parts WHERE part_mfr = mfr_id) WHERE upc_counter = 0",
+
+    # normalized manufacturer names, so that "Digi-Key" and "digikey" are the same manufacturer
+    f"ALTER TABLE manufacturers ADD COLUMN IF NOT EXISTS mfr_key varchar GENERATED ALWAYS AS ({mfr_key_sql.format('mfr_name')}) STORED",
+    # older databases could have duplicates, so move their parts to the first one and then delete the rest
+    """
+UPDATE parts SET part_mfr = duplicates.keep_id
+FROM (SELECT mfr_id, min(mfr_id) OVER (PARTITION BY mfr_key) AS keep_id FROM manufacturers) AS duplicates
+WHERE parts.part_mfr = duplicates.mfr_id AND duplicates.mfr_id <> duplicates.keep_id""",
+    "DELETE FROM manufacturers USING manufacturers AS keep WHERE manufacturers.mfr_key = keep.mfr_key AND manufacturers.mfr_id > keep.mfr_id",
+    "CREATE UNIQUE INDEX IF NOT EXISTS manufacturers_mfr_key ON manufacturers (mfr_key)",
+    # smallint isn't enough for the load test databases (see populate_presets). this does nothing if it's already an integer
+    "ALTER TABLE manufacturers ALTER COLUMN number_of_parts TYPE integer",
+
+    # the same things as upc_check_digit() and make_upc(), for making upcs in bulk (see Organizer.import_parts)
+    """
+CREATE OR REPLACE FUNCTION upc_check_digit(payload bigint) RETURNS integer
+LANGUAGE sql IMMUTABLE AS $$
+SELECT ((10 - sum(substr(lpad(payload::text, 11, '0'), digit, 1)::integer * CASE WHEN digit % 2 = 1 THEN 3 ELSE 1 END) % 10) % 10)::integer
+FROM generate_series(1, 11) AS digit
+$$""",
+    """
+CREATE OR REPLACE FUNCTION make_upc(mfr_id integer, item_number bigint) RETURNS bigint
+LANGUAGE sql IMMUTABLE AS $$
+SELECT (mfr_id * 10000000::bigint + item_number) * 10 + upc_check_digit(mfr_id * 10000000::bigint + item_number)
+$$""",
+    # fix the part counts for the manufacturers that got parts moved to them
+    recount_parts_sql,
+
+    # change notifications for the other kiosks (see ChangeListener). The payload is "table key", like "parts 1600000018".
+    # bulk changes set organizer.bulk to skip these and send one "* reload" instead
+    f"""
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+DECLARE
+    changed jsonb := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+BEGIN
+    IF current_setting('organizer.bulk', true) = 'on' THEN RETURN NULL; END IF;
+
+    PERFORM pg_notify('{change_channel}', TG_TABLE_NAME || ' ' || (changed ->> TG_ARGV[0]));
+    -- the old key too, if an update changed it
+    IF TG_OP = 'UPDATE' AND (to_jsonb(OLD) ->> TG_ARGV[0]) <> (changed ->> TG_ARGV[0]) THEN
+        PERFORM pg_notify('{change_channel}', TG_TABLE_NAME || ' ' || (to_jsonb(OLD) ->> TG_ARGV[0]));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql""",
+    *(
+        sql_command
+        for table, (events, key) in notified_tables.items()
+        for sql_command in (
+            f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table}",
+            f"CREATE TRIGGER {table}_notify_change AFTER {events} ON {table} FOR EACH ROW EXECUTE FUNCTION notify_change('{key}')"
+        )
+    ),
+
+    # number_of_parts is kept up to date by the database. These run once per statement, so an import or a COPY
+    # of a million parts is one UPDATE per manufacturer and not one per part
+    """
+CREATE OR REPLACE FUNCTION manufacturers_count_parts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE manufacturers SET number_of_parts = number_of_parts + changes.parts
+        FROM (SELECT part_mfr, count(*) AS parts FROM new_parts GROUP BY part_mfr) AS changes
+        WHERE manufacturers.mfr_id = changes.part_mfr;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE manufacturers SET number_of_parts = number_of_parts - changes.parts
+        FROM (SELECT part_mfr, count(*) AS parts FROM old_parts GROUP BY part_mfr) AS changes
+        WHERE manufacturers.mfr_id = changes.part_mfr;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- only parts that moved to a different manufacturer change anything
+        UPDATE manufacturers SET number_of_parts = number_of_parts + changes.parts
+        FROM (
+            SELECT part_mfr, sum(change) AS parts
+            FROM (
+                SELECT part_mfr, 1 AS change FROM new_parts
+                UNION ALL
+                SELECT part_mfr, -1 FROM old_parts
+            ) AS moved
+            GROUP BY part_mfr HAVING sum(change) <> 0
+        ) AS changes
+        WHERE manufacturers.mfr_id = changes.part_mfr;
+    ELSE
+        UPDATE manufacturers SET number_of_parts = 0 WHERE number_of_parts <> 0;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql""",
+    # transition tables only work with one kind of event per trigger, so there's one for each
+    *(
+        sql_command
+        for event, transition_tables in counted_part_events.items()
+        for sql_command in (
+            f"DROP TRIGGER IF EXISTS parts_count_{event.lower()} ON parts",
+            f"""
+CREATE TRIGGER parts_count_{event.lower()} AFTER {event} ON parts {transition_tables}
+FOR EACH STATEMENT EXECUTE FUNCTION manufacturers_count_parts()"""
+        )
+    ),
+    # and catch up on anything that was counted wrong before the triggers
+    recount_parts_sql,
+
+    # every checkout, return and handoff (somebody force checking out a part that someone else had), forever.
+    # There's a partition for each month so old months never slow down the new ones, and the history lookups
+    # only have to go through the part's (or user's) entries in each month's index
+    """
+CREATE TABLE IF NOT EXISTS checkout_events (
+    event_id bigserial NOT NULL,
+    event_time timestamp without time zone NOT NULL,
+    part_upc bigint NOT NULL,
+    user_id varchar(53) NOT NULL,
+    event varchar(8) NOT NULL
+) PARTITION BY RANGE (event_time)""",
+    # brin is tiny, and works well here because the events go in in time order
+    "CREATE INDEX IF NOT EXISTS checkout_events_time ON checkout_events USING brin (event_time)",
+    "CREATE INDEX IF NOT EXISTS checkout_events_part ON checkout_events (part_upc, event_time, event_id)",
+    "CREATE INDEX IF NOT EXISTS checkout_events_user ON checkout_events (user_id, event_time, event_id)",
+    # the kiosks can read the history, but only the triggers below can write to it, and nobody can change it.
+    # (old months can still be dropped a whole partition at a time)
+    "GRANT SELECT ON checkout_events TO PUBLIC",
+    """
+CREATE OR REPLACE FUNCTION checkout_events_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'the checkout history can''t be changed';
+END
+$$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS checkout_events_append_only ON checkout_events",
+    "CREATE TRIGGER checkout_events_append_only BEFORE UPDATE OR DELETE ON checkout_events FOR EACH ROW EXECUTE FUNCTION checkout_events_append_only()",
+    # makes the partition for a month the first time something happens in it. This runs as the owner of the table,
+    # because the kiosk accounts aren't allowed to make tables.
+    # Both of these functions run as the owner, so pg_temp goes last in the search path and every table is
+    # public.something. Otherwise a kiosk could make a temp table with the same name and have the owner use that instead
+    """
+CREATE OR REPLACE FUNCTION checkout_events_partition(month timestamp) RETURNS void
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+DECLARE
+    partition_name text := 'checkout_events_' || to_char(month, 'YYYY_MM');
+BEGIN
+    IF to_regclass('public.' || quote_ident(partition_name)) IS NOT NULL THEN RETURN; END IF;
+
+    -- two kiosks can both get here at the start of a month
+    PERFORM pg_advisory_xact_lock(hashtext('checkout_events_partition'));
+    EXECUTE format('CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.checkout_events FOR VALUES FROM (%L) TO (%L)',
+        partition_name, date_trunc('month', month), date_trunc('month', month) + interval '1 month');
+END
+$$""",
+    # only the owner (through log_checkout_events) gets to make partitions
+    "REVOKE EXECUTE ON FUNCTION checkout_events_partition(timestamp) FROM PUBLIC",
+    "GRANT EXECUTE ON FUNCTION checkout_events_partition(timestamp) TO CURRENT_USER",
+    # restore_database puts a whole history back at once, and might not be the owner either. The backup's events are
+    # copied into a temp table first, and this moves them in, making their months and moving the event ids past them.
+    # It only works while the history is still empty, so it can't be used to write to it any other time
+    """
+CREATE OR REPLACE FUNCTION restore_checkout_events() RETURNS bigint
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+DECLARE
+    restored bigint;
+BEGIN
+    IF EXISTS (SELECT 1 FROM public.checkout_events) THEN
+        RAISE EXCEPTION 'the checkout history can only be restored into an empty database';
+    END IF;
+
+    PERFORM public.checkout_events_partition(month) FROM (SELECT DISTINCT date_trunc('month', event_time) AS month FROM pg_temp.restored_events) AS months;
+    INSERT INTO public.checkout_events (event_id, event_time, part_upc, user_id, event)
+    SELECT event_id, event_time, part_upc, user_id, event FROM pg_temp.restored_events;
+    GET DIAGNOSTICS restored = ROW_COUNT;
+
+    PERFORM setval(pg_get_serial_sequence('public.checkout_events', 'event_id'), coalesce(max(event_id), 0) + 1, false) FROM public.checkout_events;
+    RETURN restored;
+END
+$$""",
+    "GRANT EXECUTE ON FUNCTION restore_checkout_events() TO PUBLIC",
+    # the events are written by triggers on part_locations, so they're always in the same transaction as the checkout.
+    # restore_database turns this off with organizer.log_events, as the events come from the backup then
+    """
+CREATE OR REPLACE FUNCTION log_checkout_events() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+    IF current_setting('organizer.log_events', true) = 'off' THEN RETURN NULL; END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.checkout_events_partition(month) FROM (SELECT DISTINCT date_trunc('month', checkout_timestamp) AS month FROM new_locations) AS months;
+        INSERT INTO public.checkout_events (event_time, part_upc, user_id, event)
+        SELECT checkout_timestamp, checked_out_part, current_holder, 'checkout' FROM new_locations;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM public.checkout_events_partition(LOCALTIMESTAMP);
+        INSERT INTO public.checkout_events (event_time, part_upc, user_id, event)
+        SELECT LOCALTIMESTAMP, checked_out_part, current_holder, 'return' FROM old_locations;
+    ELSE
+        -- a force checkout hands the part from the old holder to the new one. Updates that keep the holder don't count
+        PERFORM public.checkout_events_partition(month) FROM (
+            SELECT date_trunc('month', checkout_timestamp) AS month FROM new_locations UNION SELECT date_trunc('month', LOCALTIMESTAMP)
+        ) AS months;
+        INSERT INTO public.checkout_events (event_time, part_upc, user_id, event)
+        SELECT events.*
+        FROM old_locations JOIN new_locations USING (checked_out_part),
+        LATERAL (VALUES
+            (LOCALTIMESTAMP, checked_out_part, old_locations.current_holder, 'handoff'),
+            (new_locations.checkout_timestamp, checked_out_part, new_locations.current_holder, 'checkout')
+        ) AS events
+        WHERE old_locations.current_holder <> new_locations.current_holder;
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    *(
+        sql_command
+        for event, transition_tables in logged_checkout_events.items()
+        for sql_command in (
+            f"DROP TRIGGER IF EXISTS checkout_events_{event.lower()} ON part_locations",
+            f"""
+CREATE TRIGGER checkout_events_{event.lower()} AFTER {event} ON part_locations {transition_tables}
+FOR EACH STATEMENT EXECUTE FUNCTION log_checkout_events()"""
+        )
+    ),
+]
+
+
+def text_search_query(search_term):
+    """
+    turn a search term into a prefix matching tsquery, so "volt reg" becomes "volt:* & reg:*".
+    only letters and numbers are kept, that way nothing the user types can break the tsquery syntax.
+    :returns: the tsquery string, or None if there isn't anything to search for
+    """
+    tokens = []
+    for word in search_term.lower().split():
+        # scanned upcs are stored without the leading zeros
+        if word.isdecimal(): word = str(int(word))
+
+        clean_word = "".join(char if char.isalnum() else " " for char in word)
+        tokens += [token + ":*" for token in clean_word.split()]
+
+    if not tokens: return None
+    return " & ".join(tokens)
+
+
+def upc_check_digit(payload):
+    """the UPC-A check digit for the first 11 digits of a code"""
+    digits = [int(digit) for digit in "{0:011d}".format(payload)]
+
+    # odd positions count 3 times
+    total = 3 * sum(digits[0::2]) + sum(digits[1::2])
+    return (10 - total % 10) % 10
+
+
+def make_upc(mfr_id, item_number):
+    """
+    build a 12 digit UPC-A code: 4 digit manufacturer id, 7 digit item number, check digit.
+    the manufacturer id and item number pair is unique, so the code is too.
+    """
+    if mfr_id > 9999 or item_number > 9999999:
+        raise Exception(f"Can't make a upc for manufacturer {mfr_id} item {item_number}, the numbers are too big to fit.")
+
+    payload = mfr_id * 10**7 + item_number
+    return "{0:011d}".format(payload) + str(upc_check_digit(payload))
+
+
+def build_search(search_sql, search_term, filters, predicates=None, order_column=None, page_size=None, after=None):
+    """
+    add the WHERE clause for a search term to the search sql.
+
+    every word gets its own group of ORs, and the groups are ANDed together:
+    (col1 LIKE '%word1%' OR col2 LIKE '%word1%') AND (col1 LIKE '%word2%' OR col2 LIKE '%word2%')
+
+    :param predicates: optional {column: sql} for columns that shouldn't use the plain LIKE. {expression} in the sql
+        is filled in with the search expression, and %s with the word.
+    :param order_column: an indexed, unique column to sort by. needed for paging
+    :param page_size: only get this many results
+    :param after: the order_column value of the last result on the previous page (keyset paging, so
+        page 1000 is just as quick as page 1)
+    :returns: (sql, values), or None if none of the filters are on
+    """
+
+    # the filter columns that we're actually searching in
+    # filters in order: "DESC", "MFR", "MFR_PN", "LOC"
+    active_columns = [filter_name for filter_name, state in filters.items() if state]
+    if not active_columns: return None
+
+    if not predicates: predicates = {}
+    column_predicates = [
+        predicates.get(column, "{expression} LIKE %s").format(expression=search_expression(column))
+        for column in active_columns
+    ]
+
+    word_clauses = []
+    search_values = []
+    # I didn't event think of scanning into the search box, but search_words will let you do it now ig
+    for word in search_words(search_term):
+
+        word_clauses.append("(" + " OR ".join(column_predicates) + ")")
+        search_values += [f"%{like_escape(word)}%"] * len(active_columns)
+
+    # start the page after the last result of the previous one
+    if after is not None:
+        word_clauses.append(f"{order_column} > %s")
+        search_values.append(after)
+
+    # if there is no search term, return everything
+    if word_clauses:
+        search_sql += "WHERE " + "\nAND ".join(word_clauses) + "\n"
+
+    if order_column:
+        search_sql += f"ORDER BY {order_column}\n"
+    if page_size:
+        search_sql += "LIMIT %s\n"
+        search_values.append(page_size)
+
+    return search_sql, search_values
+
+
+def search_rows(search_results, raw_table=False):
+    """the rows from a search_general query, or the "No matching items" placeholders if there aren't any"""
+    # change the table into a list of matching upcs
+    if (not search_results) or len(search_results[0]) > 1:
+        formatted_results = search_results
+    else:
+        formatted_results = [row[0] for row in search_results]
+
+    # if there are no results
+    if len(formatted_results) <= 0:
+        formatted_results = ["No matching items"]
+        search_results = [["No matching items", "No matching items"]]
+
+    if raw_table: return search_results
+    return formatted_results
+
+
+def part_results(results, more_info=True):
+    """
+    turn the rows from a part search into what the gui shows: a list of upcs, or if more_info is set,
+    [part number, manufacturer, upc, date added, placement, description, status] for each part
+    """
+    if not more_info:
+        return [str(item[2]).zfill(12) for item in results]
+    else:
+        if (not results) or results[0] == "No matching items": return [[' ', ' ', "No Results", *(" " for _ in range(3))]]
+        return [[row[0], row[1], str(row[2]).zfill(12), row[5].strftime("%m/%d/%Y"), row[3], row[4], row[6]] for row in results]
+
+
+def user_results(results_table, use_full_names=False):
+    """
+    turn the rows from a user search into what the gui shows.
+    :returns a dict {user_id: First Name, Last Name, Email} if use_full_names is True.
+        otherwise it returns a list of user ids
+    """
+    if (not results_table) or (not results_table[0]):
+        return {"No Results": ("No Results", *(" " for _ in range(2)))}
+
+    if len(results_table[0]) > 2:
+        results_dict = {row[0]: (row[0], " ".join(row[1:3]), row[3]) for row in results_table}
+    else:
+        results_dict = {"No Results": ("No Results", *(" " for _ in range(2)))}
+
+    if list(results_dict.keys())[0] == " ":
+        return {"No matching items": "No matching items"}
+    elif use_full_names: return results_dict
+    else: return list(results_dict.keys())
+
+
+def part_details(search_results, raw=False):
+    """turn the rows from the part_data query into the info panel's {label: value}, or (description, placement) if raw"""
+    # take the first row
+    if search_results:
+        search_results = search_results[0]
+    else:
+        return {"No results": ""}
+
+    # if someone has the part checked out
+    holder_id, holder_first, holder_last, checkout_time = search_results[7:11]
+    if holder_id:
+        checkout_holder = f"{holder_first} {holder_last} ({holder_id})"
+
+    # if nobody has the part checked out
+    else:
+        checkout_holder = "Not checked out"
+
+    # the mfr pn
+    mfr_pn = search_results[3]
+    mfr_pn = mfr_pn if mfr_pn else "Unknown"
+
+    # change the table into a dictionary
+    formatted_results = {
+        "UPC code": str(search_results[0]).zfill(12),
+        "Placement location": search_results[1],
+        "Manufacturer": search_results[2],
+        "Part number": mfr_pn,
+        "Currently checked out by": checkout_holder,
+        "Description": search_results[4],
+        "Link to original part": search_results[5],
+        "Date added": search_results[6].strftime("%b %d, %Y - %I:%M %p")
+    }
+
+    # only show when it was checked out if it actually is
+    if checkout_time:
+        formatted_results["Checked out on"] = checkout_time.strftime("%b %d, %Y - %I:%M %p")
+
+    # return raw results if requested
+    if raw: return search_results[4], search_results[1]
+
+    return formatted_results
+
+
+def user_details(user_rows, raw=False):
+    """turn the rows from the user_data query into the info panel's {label: value}, or [first, last, email] if raw"""
+    # take the first row
+    if user_rows:
+        search_results = user_rows[0]
+    else:
+        return {"No results": ""}
+
+    # get the parts checked out by the user
+    parts_out = [str(part) + time.strftime("\non %b %d, %Y - %I:%M %p") for *_, part, time in user_rows if part]
+
+    # if the program wants raw data and not a nice table
+    if raw:
+        return [search_results[i + 1] for i in range(3)]
+    else:
+        # change the table into a dictionary
+        formatted_results = {
+            "User ID": search_results[0],
+            "First name": search_results[1],
+            "Last name": search_results[2],
+            "Email": search_results[3],
+            "Parts checked out": parts_out
+        }
+        return formatted_results
+
+
+def cart_checkout_results(upcs, done, holders):
+    """{upc: result} for cart_checkout, from the upcs that got checked out and {upc: name} of who has the others"""
+    results = {}
+    for upc in upcs:
+        if int(upc) in done: results[upc] = "-CHECKOUT_SUCCESS-"
+        elif int(upc) in holders: results[upc] = "-PART_HOLDER-;;"+holders[int(upc)]
+        else: results[upc] = "-NOT_FOUND-"
+    return results
+
+
+def cart_checkin_results(upcs, found):
+    """{upc: result} for cart_checkin, from {upc: (placement, was returned)} for the parts that exist"""
+    results = {}
+    for upc in upcs:
+        if int(upc) not in found: results[upc] = "-NOT_FOUND-"
+        elif found[int(upc)][1]: results[upc] = "-CHECKIN_SUCCESS-;;"+found[int(upc)][0]
+        else: results[upc] = "-NOT_CHECKED_OUT-"
+    return results
+
+
+def rows_are_cached(search_cache, upc_index, table):
+    """if anything is holding onto rows from the table, so rows_changed has to look them up again"""
+    return (table == "parts" and (upc_index.loaded or upc_index.loading)) or search_cache.has_table(table)
+
+
+def update_cached_rows(search_cache, upc_index, table, row_keys, rows):
+    """
+    put changed rows into the search cache and upc index.
+    :param rows: {column: value} for each row from changed_rows_sql, anything in row_keys that isn't there was deleted
+    """
+    # throw out the cached searches that had the rows in them or would have them now
+    search_cache.invalidate(table, row_keys)
+    for values in rows:
+        search_cache.invalidate(table, values=values)
+
+    if table == "parts" and (upc_index.loaded or upc_index.loading):
+        deleted = set(row_keys)
+        for values in rows:
+            upc_index.update(values["part_upc"], (values["mfr_pn"], values["part_placement"], values["checked_out"]))
+            deleted.discard(values["part_upc"])
+
+        for upc in deleted:
+            upc_index.update(upc, None)
+
+
 def random_word():
     """generate a single randon word"""
     return lorem.sentence().split(" ")[0].lower()
 
 
+def build_rows(job):
+    """run one chunk of populate_db's row building. this happens in a worker process, so it has to be out here"""
+    make_rows, args = job
+    return make_rows(*args)
+
+
+def make_user_rows(first_number, count, seed):
+    """make csv rows for the users table. the number at the end of the user id keeps them unique between workers"""
+    random.seed(seed)
+    rows = StringIO()
+    writer = csv.writer(rows)
+
+    # the names module reads through its whole list for every name, so only get a few hundred and mix them up
+    first_names = [get_first_name() for _ in range(min(count, 300))]
+    last_names = [get_last_name() for _ in range(min(count, 300))]
+
+    for user_number in range(first_number, first_number + count):
+        f_name = choice(first_names)
+        l_name = choice(last_names)
+        user_id = (f_name[0] + l_name).lower() + str(user_number)
+
+        email = choice([user_id, f_name, f_name + l_name[0], f_name + "_" + l_name])
+        email += "@"
+        email += choice(["gmail.com", "hotmail.com", "blurpd.com", "wcpss.net", "yahoo.com"])
+
+        writer.writerow((user_id, f_name, l_name, email))
+
+    return rows.getvalue()
+
+
+def make_part_rows(first_item, count, mfr_ids, shelves, seed):
+    """
+    make csv rows for the parts table.
+    every part gets its own item number, so the upcs are unique no matter which manufacturer gets picked
+    """
+    random.seed(seed)
+    rows = StringIO()
+    writer = csv.writer(rows)
+    now = datetime.now()
+
+    for item_number in range(first_item, first_item + count):
+        # a handful of manufacturers make most of the parts, same as the real thing
+        mfr_id = mfr_ids[int(len(mfr_ids) * random.random() ** 3)]
+
+        placement = str(randint(1, shelves)) + choice(["A", "B", "C", "D", "E", "F", "G", "H", "I"])
+        mfr_pn = "".join(str(randint(0, 9)) for _ in range(randint(4, 18)))
+        desc = lorem.sentence()
+        url = "https://"+random_word()+random.choice((".org", ".com", ".net"))+"/"+hex(randint(1000000000, 999999999999999999)) if random.randint(1, 3) > 1 else None
+
+        # most parts were added recently
+        added_date = now - timedelta(days=random.expovariate(1 / 365))
+
+        writer.writerow((make_upc(mfr_id, item_number), placement, mfr_pn, mfr_id, desc, url, added_date))
+
+    return rows.getvalue()
+
+
 def strip_string(string_text):
-    """Remove special characters and stuff from searches so that you don't miss something because of a dot"""
+    """
+    Remove special characters and stuff from searches so that you don't miss something because of a dot
+    The mfr_key column in the manufacturers table (mfr_key_sql) is this same thing done in postgres.
+    """
     return string_text.translate(
         {ord(filter_char): None
          for filter_char in list(" ,.-_")
@@ -190,9 +1664,12 @@ class Organizer:
         # define some variables
         self.db_name = conn_info["database"]
         self.conn_type = conn_type
-        self.conn_info = conn_info
-        self.postgres_info = self.conn_info
-        self.postgres_info["database"] = "postgres"
+        self.conn_info = dict(conn_info)
+        # making and dropping databases happens from the postgres database (you can't drop the one you're connected to)
+        self.postgres_info = self.database_info("postgres")
+        self.pool = None
+        self.search_cache = None
+        self.upc_index = None
         self.conn = None
         self.cursor = None
 
@@ -201,45 +1678,89 @@ class Organizer:
 
         # self.cursor.execute("\\set autocommit on")
 
+    def database_info(self, db_name):
+        """this organizer's connection info, but for another database on the same server"""
+        return {**self.conn_info, "database": db_name}
+
     def __enter__(self, user=None):
         # This is here for the purpose of being able o say "with Organizer()" instead of creating a new Organizer.
         # if not user: user = f"customer_{self.db_name}"
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        try:
-            if self.conn:
-                self.conn.commit()
-                self.cursor.close()
-                self.conn.close()
-        except db_err.InterfaceError:
-            print("Connection already closed")
+        self.release_connection()
 
     def db_connect(self, new_connection_info=None):
-        """privilege will either be "customer" or "postgres" """
+        """
+        get a connection out of the pool for the connection info.
+        privilege will either be "customer" or "postgres"
+        """
 
         if not new_connection_info: new_connection_info = self.conn_info
 
+        # give back whatever connection we had before
+        self.release_connection()
+
         # if this is local database
         print(f"about to invoke postgres. conn info: {new_connection_info}")
 
-        self.conn = connect(**new_connection_info)
+        self.pool = get_pool(new_connection_info)
+        self.search_cache = get_search_cache(new_connection_info)
+        self.upc_index = get_upc_index(new_connection_info)
+        self.conn = self.pool.getconn()
+
+        # throw out any connections that have gone bad while sitting in the pool
+        while not connection_is_alive(self.conn):
+            print("dropping dead pooled connection")
+            self.pool.putconn(self.conn, close=True)
+            self.conn = self.pool.getconn()
+
         print("connection established. Starting cursor")
         self.cursor = self.conn.cursor()
         self.conn.autocommit = True
         self.conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        self.conn.last_checked = monotonic()
         print("cursor established.")
 
+    def release_connection(self):
+        """hand the connection back to the pool so that it can be used again"""
+        if not self.conn: return
+
+        try:
+            self.cursor.close()
+            self.conn.commit()
+        except db_err.InterfaceError:
+            print("Connection already closed")
+
+        # pools that were closed (like after dropping the database) don't take connections back
+        if not self.pool.closed:
+            self.pool.putconn(self.conn, close=bool(self.conn.closed))
+
+        self.conn = None
+        self.cursor = None
+
+    def connection_alive(self):
+        """see if this organizer still has a working connection"""
+        return bool(self.conn) and connection_is_alive(self.conn)
+
+    def execute_prepared(self, name, *values):
+        """run one of the prepared_queries, preparing it first if this connection hasn't done that yet"""
+        if name not in self.conn.prepared:
+            param_types, query_sql = prepared_queries[name]
+            self.cursor.execute(f"PREPARE {name} ({', '.join(param_types)}) AS {query_sql}")
+            self.conn.prepared.add(name)
+
+        self.cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(values))})", values)
+
     def userid_exists(self, userid):
         """check if the userid specified exists in the database"""
-        search_sql = f"SELECT user_id FROM users WHERE user_id = '{userid}'"
-        self.cursor.execute(search_sql)
-        if self.cursor.fetchall()[0][0] == userid: return True
+        self.execute_prepared("userid_exists", userid)
+        result = self.cursor.fetchall()
+        if result and result[0][0] == userid: return True
         else: return False
 
     def part_num_from_upc(self, upc):
-        search_sql = f"SELECT mfr_pn FROM parts WHERE part_upc = {upc}"
-        self.cursor.execute(search_sql)
+        self.execute_prepared("part_num_from_upc", upc)
         result = self.cursor.fetchall()[0][0]
         return result
 
@@ -264,11 +1785,20 @@ class Organizer:
 
     def upc_exists(self, upc):
         """check a upc to see if it exists in the database"""
-        self.cursor.execute(f"SELECT * FROM parts WHERE part_upc = {upc}")
+        self.execute_prepared("upc_exists", upc)
         return self.cursor.fetchall()
 
     def drop_db(self, db_name):
         """disconnect from the selected database and then drop it"""
+        self.db_connect(new_connection_info=self.postgres_info)
+
+        # get rid of our own pooled connections to the database first
+        stop_listeners(db_name)
+        close_pools(db_name)
+        invalidate_schema_cache()
+        self.search_cache.clear()
+        self.upc_index.reset()
+
         # disconnect from db
         terminate_conn = f"""
             SELECT pg_terminate_backend(pid) 
@@ -293,9 +1823,6 @@ class Organizer:
     def format_database(self, db_name):
         """set up all the tables of the database"""
         print("format called")
-        self.cursor.close()
-        self.conn.commit()
-        self.conn.close()
 
         self.db_connect(new_connection_info=self.postgres_info)
         print("established as postgres")
@@ -319,9 +1846,10 @@ class Organizer:
         self.cursor.execute(new_db_sql)
 
         # first thing before switching to the new db, drop anything from the customer role in postgres
-        self.disconnect_customer()
+        self.disconnect_customer(db_name)
 
         # ----- now that the right database exists, let's connect to it
+        self.db_connect(new_connection_info=self.database_info(db_name))
 
         # i swear if I have to do anything else with this table i'm going to turn it into a spreadsheet
         tables_setup = {
@@ -339,7 +1867,7 @@ class Organizer:
                     # name                  data type            len     primary key references extra tags
                     ["mfr_id", "serial", None, True, None, "NOT NULL"],
                     ["mfr_name", "varchar", "255", False, None, "NOT NULL UNIQUE"],
-                    ["number_of_parts", "smallint", None, False, None, "NOT NULL"]
+                    ["number_of_parts", "integer", None, False, None, "NOT NULL"]
                 ],
 
             "parts":
@@ -423,12 +1951,53 @@ CREATE TABLE public.{table}
             self.new_user(db_name)
             self.conn.commit()
 
-            # recreate the
+        # the tables from schema_upgrades start over too
+        self.cursor.execute("DROP TABLE IF EXISTS public.checkout_events CASCADE")
+
+        # indexes and everything else that was added after the original tables
+        self.upgrade_database(db_name)
+
+    def upgrade_database(self, db_name):
+        """bring an existing database up to date with the newest indexes, without touching any of the data"""
+        print(f"upgrading {db_name}")
+        for upgrade_sql in schema_upgrades:
+            self.cursor.execute(upgrade_sql)
+
+        self.conn.commit()
+        invalidate_schema_cache()
+        self.search_cache.clear()
+        self.upc_index.reset()
+
+    def search_index_check(self):
+        """
+        make sure that the part and user searches are able to use the trigram indexes.
+        sequential scans are turned off for the check, otherwise postgres would rather scan a small table.
+        :returns: {"part": bool, "user": bool}, True meaning the search plan used the trigram index of every searched column
+        """
+        searches = {
+            "part": (part_search_sql, {column: True for column in searched_columns["parts"] + ["mfr_name"]}, part_search_predicates, ("parts", "manufacturers")),
+            "user": (user_search_sql, {column: True for column in searched_columns["users"]}, None, ("users",))
+        }
+
+        results = {}
+        self.cursor.execute("SET enable_seqscan = off")
+        try:
+            for search_mode, (search_sql, filters, predicates, tables) in searches.items():
+                explain_sql, search_values = build_search(search_sql, "index check", filters, predicates)
+                self.cursor.execute("EXPLAIN " + explain_sql, search_values)
+                plan = "\n".join(row[0] for row in self.cursor.fetchall())
+
+                # one index (like the manufacturer name's) being used doesn't help if the rest of the columns get scanned
+                expected = [trigram_index_name(table, column) for table in tables for column in searched_columns[table]]
+                results[search_mode] = all(index_name in plan for index_name in expected)
+        finally:
+            self.cursor.execute("RESET enable_seqscan")
+
+        return results
 
     def mfr_id_from_name(self, mfr_name):
         """get return the mfr id given the mfr name"""
-        mfr_id_sql = f"SELECT mfr_id FROM manufacturers WHERE lower(mfr_name) = '{mfr_name.lower()}'"
-        self.cursor.execute(mfr_id_sql)
+        self.execute_prepared("mfr_id_from_name", mfr_name)
         mfr_id = self.cursor.fetchall()
 
         # return the id if it's found, otherwise don't return anything
@@ -457,6 +2026,11 @@ CREATE TABLE public.{table}
         self.cursor.execute(update_sql)
         self.conn.commit()
 
+        # the name also shows up in the status of every part they have checked out
+        self.rows_changed("users", [old_id])
+        self.cursor.execute("SELECT checked_out_part FROM part_locations WHERE current_holder = %s", (old_id,))
+        self.rows_changed("parts", [row[0] for row in self.cursor.fetchall()])
+
         return old_id
 
     def upc_create(self, code):
@@ -466,30 +2040,28 @@ CREATE TABLE public.{table}
 
         render_upc(code, pn, desc)
 
-    def disconnect_customer(self):
-        """drop all dependencies on the customer role"""
+    def disconnect_customer(self, db_name=None):
+        """drop all dependencies on the customer role (in the database this is connected to)"""
+        db_name = db_name or self.db_name
 
         # see if the customer role exists
-        self.cursor.execute(f"SELECT pg_roles.rolname FROM pg_roles WHERE pg_roles.rolname = 'customer_{self.db_name}'")
+        self.cursor.execute(f"SELECT pg_roles.rolname FROM pg_roles WHERE pg_roles.rolname = 'customer_{db_name}'")
 
         # if it does:
         if self.cursor.fetchall():
             disconnect_role = f"""
-            REASSIGN OWNED BY customer_{self.db_name} TO postgres;
-            DROP OWNED BY customer_{self.db_name};"""
+            REASSIGN OWNED BY customer_{db_name} TO postgres;
+            DROP OWNED BY customer_{db_name};"""
             self.cursor.execute(disconnect_role)
             self.refresh_cursor()
 
     def new_user(self, db_name):
         """dumb function that creates a user because it gets mad when it's in the other one"""
-        # first off, get rid of role dependencies of they exist
-        self.disconnect_customer()
+        # the grants are for the tables in the new database, so this has to happen connected to it
+        self.db_connect(new_connection_info=self.database_info(db_name))
 
-        # connect to the database
-        self.cursor.close()
-        self.conn.commit()
-        self.conn.close()
-        self.db_connect(new_connection_info=self.postgres_info)
+        # first off, get rid of role dependencies of they exist
+        self.disconnect_customer(db_name)
 
         drop_old_use = f"""
         REASSIGN OWNED BY customer_{db_name} TO postgres ;
@@ -510,6 +2082,7 @@ CREATE TABLE public.{table}
         GRANT DELETE ON ALL TABLES IN SCHEMA public TO customer_{db_name};
         GRANT UPDATE ON ALL TABLES IN SCHEMA public TO customer_{db_name};
         GRANT USAGE ON ALL SEQUENCES IN SCHEMA public TO customer_{db_name};
+        GRANT UPDATE ON ALL SEQUENCES IN SCHEMA public TO customer_{db_name};
         
         GRANT CONNECT ON DATABASE {db_name} TO postgres;
         GRANT SELECT ON ALL TABLES IN SCHEMA public TO postgres;
@@ -527,21 +2100,47 @@ CREATE TABLE public.{table}
         self.cursor.execute(user_create)
         self.conn.commit()
 
-    def get_rows(self, column_name):
-        """get all the values for a specified column"""
-        # get the table that the column is in
-        self.cursor.execute(f"SELECT table_name from information_schema.columns WHERE column_name = '{column_name}'  ")
-        table = self.cursor.fetchall()[0][0]
+    def column_table(self, column_name):
+        """get the name of the table that a column is in, using the catalog cached on the connection"""
+        if self.conn.columns_generation != schema_generation:
+            # only plain tables (not the checkout_events log or its partitions). when a column name is in more than one
+            # table it goes to the first one in column_table_priority
+            self.cursor.execute("""
+SELECT attname, relname
+FROM pg_attribute JOIN pg_class ON pg_class.oid = pg_attribute.attrelid
+WHERE relnamespace = 'public'::regnamespace AND relkind = 'r' AND NOT relispartition AND attnum > 0 AND NOT attisdropped
+ORDER BY array_position(%s, relname::text) NULLS LAST, relname, attnum""", (column_table_priority,))
 
-        # get the rows of the column
-        self.cursor.execute(f"SELECT {column_name} FROM {table}")
-        values = self.cursor.fetchall()
+            columns = {}
+            for column, table in self.cursor.fetchall():
+                columns.setdefault(column, table)
 
-        rows = []
-        for value in values:
-            rows.append(value[0])
+            self.conn.columns = columns
+            self.conn.columns_generation = schema_generation
 
-        return rows
+        return self.conn.columns[column_name]
+
+    def get_rows(self, column_name):
+        """
+        get all the values for a specified column.
+        the values are streamed from a server side cursor, so wrap it in list() if you need all of them at once
+        """
+        select_column = sql.SQL("SELECT {column} FROM {table}").format(
+            column=sql.Identifier(column_name),
+            table=sql.Identifier(self.column_table(column_name))
+        )
+
+        # withhold keeps the cursor open if the caller commits partway through. that also means it stays open on the
+        # pooled connection until it's closed, so every call gets its own name and it's closed even if the caller stops early
+        rows = self.conn.cursor(name=f"rows_{column_name}_{uuid4().hex}", withhold=True)
+        try:
+            rows.itersize = 2000
+            rows.execute(select_column)
+
+            for value in rows:
+                yield value[0]
+        finally:
+            rows.close()
 
     def refresh_cursor(self):
         """close and reopen the cursor and connection"""
@@ -550,55 +2149,157 @@ CREATE TABLE public.{table}
 
         self.cursor = self.conn.cursor()
 
-    def populate_db(self, db_name):
-        """fill the desired table with sample data"""
+    def export_database(self, archive_path):
+        """
+        back up all the tables into a zip file, one csv for each table and a manifest.json.
+        each table is streamed from COPY straight into the zip, so it doesn't matter how big the database is
+        """
+        manifest = {"version": backup_version, "created": datetime.now().isoformat(), "tables": {}}
+
+        # read everything from the same snapshot, so parts checked out in the middle of the export still match up
+        self.cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        try:
+            with ZipFile(archive_path, "w", compression=ZIP_DEFLATED) as archive:
+                for table, columns in backup_tables.items():
+                    with TextIOWrapper(archive.open(f"{table}.csv", "w", force_zip64=True), encoding="utf-8", newline="") as table_file:
+                        # (a select, because COPY can't read from partitioned tables like checkout_events)
+                        self.cursor.copy_expert(f"COPY (SELECT {columns} FROM {table}) TO STDOUT WITH (FORMAT csv, HEADER true)", table_file)
 
-        # get the current tables
-        # get_tables_sql = "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
-        # self.cursor.execute(get_tables_sql)
-        # print(self.cursor.fetchall())
+                    manifest["tables"][table] = self.cursor.rowcount
+                    print(f"exported {self.cursor.rowcount} rows from {table}")
+
+                archive.writestr("manifest.json", json.dumps(manifest, indent=4))
+        finally:
+            self.cursor.execute("COMMIT")
+
+        return manifest
+
+    def restore_database(self, archive_path):
+        """
+        load a backup from export_database into a freshly formatted database.
+        it all goes in with COPY in one transaction, so either the whole backup is restored or none of it is
+        """
+        with ZipFile(archive_path) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+            if manifest.get("version") != backup_version:
+                raise Exception(f"This backup is from a different version ({manifest.get('version')}) and can't be restored")
+
+            # don't mix the backup in with parts that are already there
+            self.cursor.execute("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM manufacturers)")
+            if self.cursor.fetchall()[0][0]:
+                raise Exception("The database already has stuff in it. Format it before restoring a backup")
+
+            self.cursor.execute("BEGIN")
+            try:
+                self.bulk_changes()
+
+                # the checkout history is in the backup, so restoring part_locations shouldn't log the checkouts again.
+                # backups from before the history existed don't have it, and start it off with the checkouts instead
+                if "checkout_events" in manifest["tables"]:
+                    self.cursor.execute("SET LOCAL organizer.log_events = 'off'")
+
+                for table, columns in backup_tables.items():
+                    if table not in manifest["tables"]: continue
+
+                    with TextIOWrapper(archive.open(f"{table}.csv"), encoding="utf-8", newline="") as table_file:
+                        if table == "checkout_events":
+                            # only the history's owner can write to it and make its months, so restore_checkout_events
+                            # (see schema_upgrades) moves the events in from a temp table
+                            self.cursor.execute("CREATE TEMP TABLE restored_events (LIKE checkout_events) ON COMMIT DROP")
+                            self.cursor.copy_expert(f"COPY restored_events ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", table_file)
+                            self.cursor.execute("SELECT restore_checkout_events()")
+                            restored = self.cursor.fetchall()[0][0]
+                        else:
+                            self.cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", table_file)
+                            restored = self.cursor.rowcount
+
+                    # a backup that got cut off would otherwise restore without complaining
+                    if restored != manifest["tables"][table]:
+                        raise Exception(f"The backup is damaged: {table} should have {manifest['tables'][table]} rows but has {restored}")
+                    print(f"restored {restored} rows into {table}")
+
+                # the parts_count triggers counted the parts again on top of the counts in the backup
+                self.cursor.execute(recount_parts_sql)
+
+                # the manufacturer ids came from the backup, so move the serial past them (restore_checkout_events does the event ids)
+                self.cursor.execute("SELECT setval(pg_get_serial_sequence('manufacturers', 'mfr_id'), coalesce(max(mfr_id), 0) + 1, false) FROM manufacturers")
+            except Exception:
+                self.cursor.execute("ROLLBACK")
+                raise
+
+            self.cursor.execute("COMMIT")
+        self.search_cache.clear()
+        self.upc_index.reset()
+
+        # let the planner know how big everything is now
+        self.cursor.execute(f"ANALYZE {', '.join(backup_tables)}")
+
+        return manifest
+
+    def populate_db(self, db_name, preset="Sample", sizes=None):
+        """
+        fill the database with random data for testing.
+        sizes looks like {"users": 50, "manufacturers": 10, "parts": 100, "checkouts": 20}, or pick one of populate_presets.
+        the users and parts are built in worker processes and loaded with COPY, so the big load test sizes are fine
+        :returns: how many of each were actually added, in the same format as sizes
+        """
+        sizes = sizes or populate_presets[preset]
 
         # first off, this does not need superuser
-        self.cursor.close()
-        self.conn.commit()
-        self.conn.close()
         self.db_connect()
 
-        # ----- fill out all the databases
-
-        # the users table
-        for _ in range(randint(8, 37)):
-            # first and last name
-            f_name = get_first_name()
-            l_name = get_last_name()
-
-            # get the user id
-            user_id = (f_name[0] + l_name).lower()  # add the last name to the first letter of the first name
-            counter = 0  # the number after the userid for duplicates
-            taken = True  # current number is taken
-            while taken:
-                # add extension if counter exists
-                ext = ""
-                if counter:
-                    ext = str(counter)
-
-                self.cursor.execute(f"SELECT * FROM users WHERE user_id = '{user_id + ext}'")
-                if self.cursor.fetchall():
-                    counter += 1
-                else:
-                    taken = False
-
-            if counter > 0:  # if an identifier is necessary
-                user_id += str(counter)
-
-            # define the email
-            email = choice([user_id, f_name, f_name + l_name[0], f_name + "_" + l_name])
-            email += "@"
-            email += choice(["gmail.com", "hotmail.com", "blurpd.com", "wcpss.net", "yahoo.com"])
-
-            self.cursor.execute(f"INSERT INTO users VALUES ('{user_id}', '{f_name}', '{l_name}', '{email}')")
-        # the manufacturers table
-        for _ in range(randint(6, 21)):
+        # everything goes in at once or not at all (the connection is in autocommit otherwise)
+        self.cursor.execute("BEGIN")
+        try:
+            self.bulk_changes()
+            added = self.populate_tables(sizes)
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+
+        self.cursor.execute("COMMIT")
+        self.search_cache.clear()
+        self.upc_index.reset()
+
+        # let the planner know how big everything is now
+        self.cursor.execute("ANALYZE users, manufacturers, parts, part_locations, checkout_events")
+
+        return added
+
+    def populate_tables(self, sizes):
+        """the part of populate_db that happens inside the transaction"""
+        added = {}
+
+        # ----- the users table
+        # the new user ids end in numbers past the biggest number at the end of any user id, so they can't be taken.
+        # (counting the users doesn't work, there are gaps once some are deleted)
+        # they still go through a temporary table first, just in case
+        self.cursor.execute("SELECT coalesce(max(substring(user_id FROM '[0-9]{1,18}$')::bigint), 0) + 1 FROM users")
+        first_user = self.cursor.fetchall()[0][0]
+
+        self.cursor.execute("CREATE TEMP TABLE new_users (LIKE users) ON COMMIT DROP")
+        user_jobs = [
+            (make_user_rows, (first_user + start, min(populate_chunk_rows, sizes["users"] - start), random.getrandbits(64)))
+            for start in range(0, sizes["users"], populate_chunk_rows)
+        ]
+        self.copy_generated("COPY new_users FROM STDIN WITH (FORMAT csv)", user_jobs)
+        self.cursor.execute("INSERT INTO users SELECT * FROM new_users ON CONFLICT DO NOTHING")
+        added["users"] = self.cursor.rowcount
+        print(f"added {added['users']} users")
+
+        # ----- the manufacturers table
+        # there's only ever a few thousand of these, so they're made right here
+        self.cursor.execute("SELECT coalesce(max(mfr_id), 0), array_agg(mfr_key) FROM manufacturers")
+        last_mfr_id, taken_keys = self.cursor.fetchall()[0]
+        taken_keys = set(taken_keys or [])
+
+        if last_mfr_id + sizes["manufacturers"] > 9999:
+            raise Exception(f"There's only room for {9999 - last_mfr_id} more manufacturers in the upc codes")
+
+        mfr_rows = StringIO()
+        writer = csv.writer(mfr_rows)
+        mfr_id = last_mfr_id
+        while mfr_id < last_mfr_id + sizes["manufacturers"]:
             # pick a random name for the mfr
             mfr_name = choice([
                 get_last_name(),
@@ -608,82 +2309,89 @@ CREATE TABLE public.{table}
                 random_word().title()
             ])
 
-            # insert into tabel if it doesn't already exist
-            if mfr_name not in self.get_rows("mfr_name"):
-                # the other two columns are mfr id, serial; and number of kits, 0 to start
-                self.cursor.execute(f"INSERT INTO manufacturers VALUES (default, '{mfr_name}', 0)")
-        # parts table
-
-        # get a list of all the upcs already used
-        used_codes_sql = "SELECT checked_out_part FROM part_locations"
-        self.cursor.execute(used_codes_sql)
-        used_codes = [elem[0] for elem in self.cursor.fetchall()]
-        for _ in range(randint(16, 47)):
-            # pick a location
-            placement = "A1"
-            placement_search = f"SELECT * FROM parts WHERE part_placement = '"
-            while True:
-                self.cursor.execute(placement_search + placement + "'")
-                if self.cursor.fetchall():
-                    placement = str(randint(1, 22)) + choice(
-                        ["A", "B", "C", "D", "E", "F", "G", "H", "I"])
-                else:
-                    break
-            # pick a manufacturing part number
-            mfr_pn = ""
-            for i in range(randint(4, 18)):
-                mfr_pn += str(randint(0, 9))
-            # pick a manufacturer
-            mfr = choice(self.get_rows("mfr_id"))
-            # come up with a description
-            desc = lorem.sentence()
-            # make a url
-            url = "https://"+random_word()+random.choice((".org", ".com", ".net"))+"/"+hex(randint(1000000000, 999999999999999999)) if random.randint(1, 3) > 1 else None
-
-            # create the appropriate upc code
-            other_mfrs = self.get_rows("part_mfr")
-            unique_id = 1
-            for other_instance in other_mfrs:
-                if other_instance == mfr:
-                    unique_id += 1
-
-            # zero padded mfr id
-            upc = "{0:03d}".format(mfr)
-            # padded pn
-            upc += "{0:04d}".format(unique_id)
-            # current date
-            upc += date.today().strftime("%m%d%y")
-
-            added_date = datetime.fromtimestamp(randint(0, 1826244364))
-            added_str = added_date.strftime("%Y-%m-%d %H:%M:") + str(randint(0, 59999999) / 1000000)
-
-            sql = f"INSERT INTO parts VALUES ({upc}, '{placement}', '{mfr_pn}', '{mfr}', '{desc}', '{url}', '{added_str}')"
-            self.cursor.execute(sql)
-
-            # change the mfr table to display the number of parts
-            update_mfrs_table = f"""
-UPDATE manufacturers SET number_of_parts = {unique_id} WHERE mfr_id = {mfr}"""
-            self.cursor.execute(update_mfrs_table)
-        # the table that holds the locations of all the checked out parts
-        for _ in range(randint(2, 16)):
-            # the timestamp that the part was checked out
-            # just use CURRENT_TIMESTAMP for the real one
-            time_now = datetime.fromtimestamp(randint(0, 1826244364))
-            time_string = time_now.strftime("%Y-%m-%d %H:%M:") + str(randint(0, 59999999) / 1000000)
-
-            # the part that is checked out
-            part = choice(self.get_rows("part_upc"))
-            # the person who checked out the kit
-            holder = choice(self.get_rows("user_id"))
-
-            # the insert command
-            if part not in used_codes:
-                sql = f"INSERT INTO part_locations VALUES ({part}, '{holder}', '{time_string}')"
-                self.cursor.execute(sql)
+            # the names have to be different after stripping out the spaces and stuff (see mfr_key)
+            if strip_string(mfr_name) in taken_keys: continue
+            taken_keys.add(strip_string(mfr_name))
+
+            mfr_id += 1
+            writer.writerow((mfr_id, mfr_name, 0))
+
+        mfr_rows.seek(0)
+        self.cursor.copy_expert("COPY manufacturers (mfr_id, mfr_name, number_of_parts) FROM STDIN WITH (FORMAT csv)", mfr_rows)
+        added["manufacturers"] = self.cursor.rowcount
+        # the ids were picked here instead of by the serial, so move it past them
+        self.cursor.execute("SELECT setval(pg_get_serial_sequence('manufacturers', 'mfr_id'), max(mfr_id)) FROM manufacturers")
+
+        # ----- parts table
+        added["parts"] = 0
+        if sizes["parts"]:
+            self.cursor.execute("SELECT mfr_id FROM manufacturers ORDER BY mfr_id")
+            mfr_ids = [row[0] for row in self.cursor.fetchall()]
+            if not mfr_ids: raise Exception("There have to be some manufacturers to make parts")
+
+            # start the item numbers after everything that's been used, so the new upcs can't run into any old ones
+            self.cursor.execute("""
+SELECT greatest((SELECT max(part_upc / 10 % 10000000) FROM parts), (SELECT max(upc_counter) FROM manufacturers), 0) + 1""")
+            first_item = self.cursor.fetchall()[0][0]
+
+            # about 200 parts to a shelf
+            shelves = max(22, sizes["parts"] // 200)
+
+            part_jobs = [
+                (make_part_rows, (first_item + start, min(populate_chunk_rows, sizes["parts"] - start), mfr_ids, shelves, random.getrandbits(64)))
+                for start in range(0, sizes["parts"], populate_chunk_rows)
+            ]
+            added["parts"] = self.copy_generated("""
+COPY parts (part_upc, part_placement, mfr_pn, part_mfr, part_desc, url, date_added) FROM STDIN WITH (FORMAT csv)""", part_jobs)
+
+            # move the upc counters past the new item numbers (the part counts are done by the parts_count triggers)
+            self.cursor.execute("""
+UPDATE manufacturers SET upc_counter = greatest(upc_counter, counts.last_item)
+FROM (
+    SELECT part_mfr, max(part_upc / 10 %% 10000000) AS last_item
+    FROM parts WHERE part_upc / 10 %% 10000000 >= %s GROUP BY part_mfr
+) AS counts
+WHERE manufacturers.mfr_id = counts.part_mfr""", (first_item,))
+            print(f"added {added['parts']} parts")
+
+        # ----- the table that holds the locations of all the checked out parts
+        # a few people check out way more than everyone else, and most checkouts are recent
+        self.cursor.execute("""
+INSERT INTO part_locations (checked_out_part, current_holder, checkout_timestamp)
+SELECT available.part_upc,
+    holders.user_ids[1 + floor(random() ^ 3 * holders.total)::integer],
+    LOCALTIMESTAMP - random() ^ 2 * interval '180 days'
+FROM (
+    SELECT part_upc FROM parts
+    WHERE NOT EXISTS (SELECT 1 FROM part_locations WHERE checked_out_part = part_upc)
+    ORDER BY random() LIMIT %s
+) AS available,
+(SELECT array_agg(user_id) AS user_ids, count(*) AS total FROM users) AS holders
+WHERE holders.total > 0""", (sizes["checkouts"],))
+        added["checkouts"] = self.cursor.rowcount
+        print(f"checked out {added['checkouts']} parts")
+
+        return added
+
+    def copy_generated(self, copy_sql, jobs):
+        """
+        build the csv rows for each (make rows function, arguments) job and COPY them into the database.
+        if there's more than one job they're built in worker processes while the finished ones are being copied in
+        :returns: the number of rows copied
+        """
+        copied = 0
+        if len(jobs) <= 1:
+            for rows in map(build_rows, jobs):
+                self.cursor.copy_expert(copy_sql, StringIO(rows))
+                copied += self.cursor.rowcount
+            return copied
+
+        with Pool(min(cpu_count(), len(jobs))) as workers:
+            for rows in workers.imap(build_rows, jobs):
+                self.cursor.copy_expert(copy_sql, StringIO(rows))
+                copied += self.cursor.rowcount
 
-            # because this is never going to be used, we're doing it the dumb way
-            # just have a list of the codes that I've inserted
-            used_codes.append(part)
+        return copied
 
     def name_is_taken(self, fname, lname):
         """see if a user exists that has the same first and last name"""
@@ -705,30 +2413,36 @@ UPDATE manufacturers SET number_of_parts = {unique_id} WHERE mfr_id = {mfr}"""
         """
         check in all the parts that the user depends on
         that line sounds like a supervillain
+        (or just the one part, if it's a upc)
         """
 
         # column that we want to search in
         search_col = "checked_out_part" if usr_part_id.isnumeric() else "current_holder"
 
-        # get the parts that the user has checked out
-        self.cursor.execute(f"SELECT checked_out_part FROM part_locations WHERE {search_col} = '{usr_part_id}'")
-        parts_out = self.cursor.fetchall()
+        # return them all and move them to this kiosk in one go. old is the parts from before the update, for where they go back to
+        self.cursor.execute(f"""
+WITH returned AS (
+    DELETE FROM part_locations WHERE {search_col} = %s
+    RETURNING checked_out_part
+)
+UPDATE parts SET part_placement = %s
+FROM returned, parts AS old
+WHERE parts.part_upc = returned.checked_out_part AND old.part_upc = parts.part_upc
+RETURNING parts.part_upc, parts.mfr_pn, old.part_placement""", (usr_part_id, get_location()))
+        returned = self.cursor.fetchall()
 
-        for part in parts_out:
-            self.part_checkin(part[0])
+        self.rows_changed("parts", [row[0] for row in returned])
+        print(f"returned {len(returned)} parts")
 
-        self.conn.commit()
+        # (upc, part number, where it goes back to) for each part
+        return returned
 
     def delete_generic(self, key, keyword):
         """delete the selected item on the list"""
         self.refresh_cursor()  # still don't know if this was actually the fix
 
         # get the table from the keyword
-        location = {
-            "user": ["users", "user_id"],
-            "part": ["parts", "part_upc"],
-            "manufacturer": ["manufacturers", "mfr_name"]
-        }[keyword]
+        location = deletable_tables[keyword]
 
         # try to delete
         try:
@@ -737,77 +2451,21 @@ UPDATE manufacturers SET number_of_parts = {unique_id} WHERE mfr_id = {mfr}"""
             return "-PARTS_STILL_CHECKED_OUT-"
 
         self.conn.commit()
+
+        if location[0] != "manufacturers":
+            self.rows_changed(location[0], [key])
         return "-SUCCESS-"
 
     def add_part(self, desc, mfr_name, mfr_pn, placement="None", url="None"):
         """inset a row into the parts database"""
         # ----- get rid of special characters in the description
 
-        desc = "".join([char for char in desc if char.isalnum() or char in " !\"#$%&'()*+,-./:;<=>?@[]{}\\^_`|~"])
+        desc = "".join([char for char in desc if char.isalnum() or char in description_characters])
 
         # ----- manufacturer stuff
 
-        # find if the input mfr already exists
-        all_mfrs = self.get_rows("mfr_name")
-
-        # if there is already some manufacturers to sort through
-        mfr_id = None
-        if len(all_mfrs) > 0:
-            # remove spaces, dots, dashes, capitalization, etc. in the name
-            mfr_formatted = strip_string(mfr_name)
-
-            # search for other manufacturers that have the same name
-            for other_mfr_name in all_mfrs:
-                other_formatted = strip_string(other_mfr_name)
-
-                # if the input mfr is in the table
-                if other_formatted == mfr_formatted:
-                    # get the id of the mfr that has the matching name
-                    sql = f"SELECT mfr_id FROM manufacturers WHERE mfr_name = '{other_mfr_name}'"
-                    self.cursor.execute(sql)
-                    raw_table = self.cursor.fetchall()
-                    mfr_id = raw_table[0][0]
-                    break
-
-            # I don't think this does anything, but I'm afraid to remove it.
-            self.conn.commit()
-
-        # if we weren't able to find an existing mfr with the same id
-        if not mfr_id:
-            # create a new mfr
-
-            mfr_id = self.add_mfr(mfr_name)
-
-        # ----- upc code stuff
-
-        # generate the unique id
-        other_part_mfrs = self.get_rows("part_mfr")
-        unique_id = 1
-        for other_instance in other_part_mfrs:
-            if other_instance == mfr_id:
-                unique_id += 1
-
-        # zero padded mfr id
-        upc = "{0:03d}".format(mfr_id)
-        # padded pn
-        upc += "{0:03d}".format(unique_id)
-        # current date
-        upc += date.today().strftime("%m%d%y")
-
-        # make sure that the upc is actually available
-        upc_check_base = "SELECT * FROM parts WHERE part_upc = "
-        while True:
-            # find matching parts
-            self.cursor.execute(upc_check_base + str(upc))
-            matching_upcs = self.cursor.fetchall()
-
-            # check if the current upc is taken or is too long
-            if len(upc) > 12 or matching_upcs:
-                # if there is a match just start guess and check
-                upc_int = randint(0, 999999999999)
-                upc = "{0:012d}".format(upc_int)
-            else:
-                break
+        # find the manufacturer with the same name (ignoring spaces, dots, dashes, capitalization, etc.) or make a new one
+        mfr_id = self.find_or_add_mfr(mfr_name)
 
         # make apostrophes safe
         safe_desc = desc.replace("'", "''")
@@ -820,23 +2478,207 @@ UPDATE manufacturers SET number_of_parts = {unique_id} WHERE mfr_id = {mfr}"""
 
         date_added = datetime.today().strftime("%Y-%m-%d %H:%M:")
 
-        # ----- perform the insertion 😈
-        sql = f"INSERT INTO parts VALUES ({upc}, '{safe_placement}', '{safe_mfr_pn}', '{mfr_id}', '{safe_desc}', '{url}', '{date_added}')"
-        self.cursor.execute(sql)
+        # ----- upc code and the insertion 😈
+        while True:
+            upc = self.allocate_upc(mfr_id)
+
+            try:
+                sql = f"INSERT INTO parts VALUES ({upc}, '{safe_placement}', '{safe_mfr_pn}', '{mfr_id}', '{safe_desc}', '{url}', '{date_added}')"
+                self.cursor.execute(sql)
+                break
+            except db_err.UniqueViolation:
+                # parts from before the allocator used a different code pattern, so one of those can (rarely) be in the way
+                print(f"upc {upc} was already taken, getting the next one")
 
-        # change the mfr table to display the number of parts
-        update_mfrs_table = f"""
-UPDATE manufacturers SET number_of_parts = {unique_id} WHERE mfr_id = {mfr_id}"""
-        self.cursor.execute(update_mfrs_table)
+        self.rows_changed("parts", [upc])
 
         # return render_upc(upc, safe_placement, desc, printer="Zebra ")
         return upc
 
-    def add_mfr(self, mfr_name):
-        self.cursor.execute(f"INSERT INTO manufacturers VALUES (default, '{mfr_name}', 0) RETURNING mfr_id")
-        self.conn.commit()
+    def allocate_upc(self, mfr_id):
+        """
+        get a new upc code for a part made by the manufacturer.
+        the item number comes from the manufacturer's counter in the database, which is bumped and read in
+        one statement, so kiosks adding parts at the same time never get the same number.
+        """
+        self.execute_prepared("next_upc_item", mfr_id)
+        item_number = self.cursor.fetchall()[0][0]
+
+        return make_upc(mfr_id, item_number)
 
-        return self.cursor.fetchall()[0][0]
+    def import_parts(self, csv_file):
+        """
+        add all the parts in a csv file at once. the first line has to be a header with the names in import_columns,
+        manufacturer and part number are required and the rest can be left out.
+
+        the file is streamed into a temporary table with COPY, then the manufacturers, upcs, and parts are all
+        done with a handful of queries in one transaction. rows that can't be added are skipped.
+        :returns: (number of parts added, [(line the row starts on, what was wrong with it), ...])
+        """
+        # figure out which columns the file has
+        header = next(csv.reader([csv_file.readline()]), [])
+        columns = []
+        for name in header:
+            name = name.strip().lower()
+            if name not in import_columns:
+                raise Exception(f"Unknown column \"{name}\" in the csv file. The columns can be: {', '.join(import_columns)}")
+            columns.append(import_columns[name])
+
+        if "mfr_name" not in columns or "mfr_pn" not in columns:
+            raise Exception("The csv file needs a manufacturer and a part number column")
+
+        # the connection is in autocommit, so everything after this goes in at once or not at all
+        self.cursor.execute("BEGIN")
+        try:
+            self.bulk_changes()
+            added, problems = self.import_staged_parts(csv_file, columns)
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+
+        self.cursor.execute("COMMIT")
+        print(f"imported {len(added)} parts, {len(problems)} rows skipped")
+
+        self.search_cache.clear("parts")
+
+        # the new parts aren't checked out by anyone
+        if self.upc_index.loaded or self.upc_index.loading:
+            self.upc_index.update_many({upc: (part_number, placement, False) for upc, part_number, placement in added})
+
+        return len(added), problems
+
+    def import_staged_parts(self, csv_file, columns):
+        """the part of import_parts that happens inside the transaction"""
+        self.cursor.execute("""
+CREATE TEMP TABLE part_import (
+    row_number bigint PRIMARY KEY,
+    mfr_name text, mfr_pn text, part_desc text, url text, part_placement text,
+    mfr_id integer, item_number bigint, problem text
+) ON COMMIT DROP""")
+
+        # one bad line would make COPY throw out the whole file, so the file goes through the csv module first and
+        # only rows that COPY can take are sent. the row number is the line the row starts on, quoted fields can have
+        # line breaks in them so that isn't the same as counting rows
+        copy_sql = f"COPY part_import (row_number, {', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        bad_rows = []
+        rows = StringIO()
+        row_writer = csv.writer(rows)
+        written = 0
+
+        reader = csv.reader(csv_file, strict=True)
+        while True:
+            row_number = reader.line_num + 2  # the header was already read, so the reader starts counting at line 2
+            try:
+                record = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as error:
+                bad_rows.append((row_number, f"isn't valid csv ({error})"))
+                continue
+
+            if not record: continue  # blank line
+            if len(record) != len(columns):
+                bad_rows.append((row_number, f"has {len(record)} columns but the header has {len(columns)}"))
+                continue
+            if any("\x00" in field for field in record):
+                bad_rows.append((row_number, "has a null character in it"))
+                continue
+
+            row_writer.writerow([row_number, *record])
+            written += 1
+            if written % populate_chunk_rows == 0:
+                self.cursor.copy_expert(copy_sql, StringIO(rows.getvalue()))
+                rows.seek(0)
+                rows.truncate()
+
+        if rows.tell():
+            self.cursor.copy_expert(copy_sql, StringIO(rows.getvalue()))
+
+        # clean everything up the same way add_part does, and mark the rows that can't go in
+        self.cursor.execute("""
+UPDATE part_import SET
+    mfr_name = trim(mfr_name),
+    mfr_pn = trim(mfr_pn),
+    part_desc = regexp_replace(part_desc, '[^[:alnum:][:punct:] ]', '', 'g'),
+    url = CASE WHEN url NOT LIKE '%.%' THEN NULL WHEN url LIKE 'https://%' THEN url ELSE 'https://' || url END,
+    part_placement = coalesce(nullif(trim(part_placement), ''), 'None'),
+    problem = CASE
+        WHEN coalesce(trim(mfr_name), '') = '' THEN 'missing the manufacturer'
+        WHEN coalesce(trim(mfr_pn), '') = '' THEN 'missing the part number'
+        WHEN length(trim(mfr_name)) > 255 THEN 'the manufacturer is longer than 255 characters'
+        WHEN length(trim(mfr_pn)) > 26 THEN 'the part number is longer than 26 characters'
+        WHEN length(trim(part_placement)) > 26 THEN 'the placement is longer than 26 characters'
+    END""")
+
+        # add all the new manufacturers at once. names that are the same apart from spaces and stuff are one manufacturer
+        self.cursor.execute(f"""
+INSERT INTO manufacturers (mfr_name, number_of_parts)
+SELECT DISTINCT ON ({mfr_key_sql.format('mfr_name')}) mfr_name, 0
+FROM part_import
+WHERE problem IS NULL
+AND NOT EXISTS (SELECT 1 FROM manufacturers WHERE mfr_key = {mfr_key_sql.format('part_import.mfr_name')})
+ORDER BY {mfr_key_sql.format('mfr_name')}, row_number
+ON CONFLICT DO NOTHING""")
+
+        self.cursor.execute(f"""
+UPDATE part_import SET
+    mfr_id = manufacturers.mfr_id,
+    problem = CASE WHEN manufacturers.mfr_id > 9999 THEN 'too many manufacturers to make a upc code' END
+FROM manufacturers
+WHERE problem IS NULL AND manufacturers.mfr_key = {mfr_key_sql.format('part_import.mfr_name')}""")
+
+        # bump each manufacturer's upc counter once for all of its new parts (see allocate_upc) and hand out the numbers in order
+        self.cursor.execute("""
+WITH new_parts AS (
+    SELECT mfr_id, count(*) AS parts FROM part_import WHERE problem IS NULL GROUP BY mfr_id
+), counters AS (
+    UPDATE manufacturers SET upc_counter = upc_counter + new_parts.parts
+    FROM new_parts
+    WHERE manufacturers.mfr_id = new_parts.mfr_id
+    RETURNING manufacturers.mfr_id, manufacturers.upc_counter - new_parts.parts AS last_used
+), numbered AS (
+    SELECT row_number, row_number() OVER (PARTITION BY mfr_id ORDER BY row_number) AS position
+    FROM part_import WHERE problem IS NULL
+)
+UPDATE part_import SET item_number = counters.last_used + numbered.position
+FROM counters, numbered
+WHERE part_import.mfr_id = counters.mfr_id AND part_import.row_number = numbered.row_number""")
+
+        # parts from before the allocator used a different code pattern, so one of those can (rarely) be in the way
+        self.cursor.execute("""
+UPDATE part_import SET problem = CASE
+    WHEN item_number > 9999999 THEN 'the manufacturer has too many parts to make a upc code'
+    ELSE 'the upc code was already taken, try importing this one again' END
+WHERE problem IS NULL AND (
+    item_number > 9999999
+    OR EXISTS (SELECT 1 FROM parts WHERE part_upc = make_upc(mfr_id, item_number))
+)""")
+
+        self.cursor.execute("""
+INSERT INTO parts (part_upc, part_placement, mfr_pn, part_mfr, part_desc, url, date_added)
+SELECT make_upc(mfr_id, item_number), part_placement, mfr_pn, mfr_id, part_desc, url, LOCALTIMESTAMP
+FROM part_import WHERE problem IS NULL
+RETURNING part_upc, mfr_pn, part_placement""")
+        added = self.cursor.fetchall()
+
+        self.cursor.execute("SELECT row_number, problem FROM part_import WHERE problem IS NOT NULL ORDER BY row_number")
+        problems = sorted(self.cursor.fetchall() + bad_rows)
+
+        return added, problems
+
+    def find_or_add_mfr(self, mfr_name):
+        """
+        get the id of the manufacturer with the same normalized name (see strip_string), adding it if there isn't one.
+        this is a single lookup on the mfr_key index, or an insert if the manufacturer is new.
+        """
+        self.execute_prepared("find_or_add_mfr", mfr_name)
+        result = self.cursor.fetchall()
+
+        # another kiosk added the same manufacturer right in between the lookup and the insert
+        if not result:
+            return self.mfr_id_from_name(mfr_name)
+
+        return result[0][0]
 
     def part_checkin(self, upc):
         """check a part back in"""
@@ -880,38 +2722,28 @@ Please click "Add part" to add a part for the first time"""
         if url == "": url = None
         elif not url.startswith("https://"): url = "https://"+url
 
-        # convert the mfr if a name is given instead of an id
+        # convert the mfr if a name is given instead of an id (adding the manufacturer if it isn't in the database)
         if isinstance(mfr, str) and not mfr.isnumeric():
-
-            new_mfr = self.mfr_id_from_name(mfr)
-            # if the new manufacturer isn't in the database
-            if not new_mfr:
-                mfr = self.add_mfr(mfr)
-            else:
-                mfr = new_mfr
+            mfr = self.find_or_add_mfr(mfr)
 
         # do the update
         update_sql = f"UPDATE parts SET (mfr_pn, part_mfr, part_desc, url) = ('{mfr_pn}', {mfr}, '{desc}', '{url}') WHERE part_upc = {part_number}"
         self.cursor.execute(update_sql)
         self.conn.commit()
 
+        self.rows_changed("parts", [part_number])
+
     def part_checkout(self, part_upc, user_id, force=False):
         """add the part to the currently checked out parts table"""
 
-        # first: check if there is a matching part
-        find_part_sql = f"SELECT * FROM parts where part_upc = {part_upc}"
-        self.cursor.execute(find_part_sql)
-
         # check if the value already exists
-        search_sql = f"SELECT current_holder FROM part_locations WHERE checked_out_part = {part_upc}"
-        self.cursor.execute(search_sql)
+        self.execute_prepared("part_holder", part_upc)
         results_table = self.cursor.fetchall()
 
         # if the part is already checked out
         if len(results_table) > 0:
             # find the old userid in the users table
-            old_user_sql = f"SELECT first_name, last_name FROM users WHERE user_id = '{results_table[0][0]}'"
-            self.cursor.execute(old_user_sql)
+            self.execute_prepared("user_name", results_table[0][0])
             user_results = self.cursor.fetchall()
             old_holder = " ".join([user_results[0][0], user_results[0][1]])
 
@@ -922,11 +2754,7 @@ Please click "Add part" to add a part for the first time"""
             # if the user has already gotten the prompt and confirmed that they would like to force check out
             else:
                 # update the original row
-                update_sql = f"""
-UPDATE part_locations 
-SET current_holder = '{user_id}', checkout_timestamp = CURRENT_TIMESTAMP 
-WHERE checked_out_part = {part_upc}"""
-                self.cursor.execute(update_sql)
+                self.execute_prepared("checkout_transfer", part_upc, user_id)
 
                 # have a nice day
                 self.update_location(part_upc)
@@ -934,17 +2762,59 @@ WHERE checked_out_part = {part_upc}"""
 
         # if the part isn't checked out already
         else:
-            # sql to add the row
-            insert_sql = f"INSERT INTO part_locations VALUES ({part_upc}, '{user_id}', CURRENT_TIMESTAMP)"
-            self.cursor.execute(insert_sql)
+            # add the row
+            self.execute_prepared("checkout_insert", part_upc, user_id)
 
             self.update_location(part_upc)
             return "-CHECKOUT_SUCCESS-"
 
+    def cart_checkout(self, upcs, user_id, force=False):
+        """
+        check out a whole cart of parts to one user, for the kiosk's cart mode. It's one transaction, and the checkouts
+        are done in one statement no matter how many parts are in the cart.
+        :returns: {upc: result} in the same order as upcs. The results are the same as part_checkout, or "-NOT_FOUND-".
+            parts that somebody else has are left alone unless force is set
+        """
+        cart = [int(upc) for upc in upcs]
+
+        self.cursor.execute("BEGIN")
+        try:
+            self.cursor.execute(cart_checkout_sql, {"cart": cart, "user_id": user_id, "force": force, "location": get_location()})
+            done = {row[0] for row in self.cursor.fetchall()}
+
+            # the names of whoever has the rest of them
+            holders = {}
+            if len(done) < len(set(cart)):
+                self.cursor.execute(cart_holders_sql, {"cart": [upc for upc in cart if upc not in done]})
+                holders = dict(self.cursor.fetchall())
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
+
+        self.rows_changed("parts", done)
+        return cart_checkout_results(upcs, done, holders)
+
+    def cart_checkin(self, upcs):
+        """
+        check a whole cart of parts back in at once, in one statement.
+        :returns: {upc: result} in the same order as upcs. The results are "-CHECKIN_SUCCESS-;;[where it goes back to]",
+            "-NOT_CHECKED_OUT-" or "-NOT_FOUND-"
+        """
+        cart = [int(upc) for upc in upcs]
+
+        self.cursor.execute(cart_checkin_sql, {"cart": cart, "location": get_location()})
+        found = {upc: (placement, returned) for upc, placement, returned in self.cursor.fetchall()}
+
+        self.rows_changed("parts", [upc for upc, (_, returned) in found.items() if returned])
+        return cart_checkin_results(upcs, found)
+
     def update_location(self, upc_to_update):
         """update the part location to the current kiosk location of this kiosk"""
-        update_sql = f"UPDATE parts SET part_placement = '{get_location()}' WHERE parts.part_upc = {upc_to_update}"
-        self.cursor.execute(update_sql)
+        self.execute_prepared("update_location", upc_to_update, get_location())
+
+        # the placement and checked out status both show up in the search results
+        self.rows_changed("parts", [upc_to_update])
 
     def add_user(self, f_name, l_name, email):
         """create a new user and return the userid"""
@@ -982,99 +2852,185 @@ WHERE checked_out_part = {part_upc}"""
         self.cursor.execute(add_user_sql)
         self.conn.commit()
 
+        self.rows_changed("users", [full_id])
+
         # return the userid
         return full_id
 
-    def search_general(self, search_sql, search_term, filters, raw_table=False):
+    def search_general(self, search_sql, search_term, filters, raw_table=False, predicates=None, order_column=None, page_size=None, after=None):
         """
         general search function that all the other search functions are built off of
 
-        splits the input into individual words and uses search_general_word to get
-        the results for each section. If a result in found in every section, that's a match.
+        splits the input into individual words, and every word has to show up in at least one of
+        the filter columns for a row to match. This is all done in one query, so searching something
+        like "John Doe" finds John in first_name and Doe in last_name without a query for each word.
         """
 
-        # if there is no search term, return everything
-        if search_term.isspace() or search_term == "":
-            return self.search_general_word(search_sql, search_term, filters, raw_table)
+        search = build_search(search_sql, search_term, filters, predicates, order_column, page_size, after)
 
-        search_results = []
-        for word in search_term.split():
-            search_results.append(self.search_general_word(search_sql, word, filters, raw_table))
+        # if no filters are on, nothing can match
+        if not search:
+            if raw_table: return [["No matching items", "No matching items"]]
+            return ["No matching items"]
 
-        return find_common_elements(search_results)
+        self.cursor.execute(*search)
+        return search_rows(self.cursor.fetchall(), raw_table)
 
-    def search_general_word(self, search_sql, search_term, filters, raw_table):
+    def rows_changed(self, table, row_keys):
         """
-        The original search_general; handles the input as a single string.
-        This made it so that searching something like "John Doe" would have no
-        results, as "John" is the first_name column and "Doe" is the last_name
-        column.
+        keep the search cache and upc index up to date after rows were written (upcs in parts, user ids in users).
+        call it after the write, so the rows can be looked up again to see what they are now
         """
+        if not rows_are_cached(self.search_cache, self.upc_index, table):
+            # there's nothing to update, but a search that's still running shouldn't get cached with the old rows
+            self.search_cache.clear(table)
+            return
 
-        # add each filter if it exists
-        # filters in order: "DESC", "MFR", "MFR_PN", "LOC"
-        connector = "WHERE"
+        if table == "parts": row_keys = [int(upc) for upc in row_keys]
+        self.cursor.execute(changed_rows_sql[table], (list(row_keys),))
 
-        # I didn't event think of scanning into the search box, but this will let you do it now ig
-        if search_term.isnumeric(): search_term = str(int(search_term))
-        print("search_term:", search_term)
+        columns = [column.name for column in self.cursor.description]
+        rows = [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        update_cached_rows(self.search_cache, self.upc_index, table, row_keys, rows)
 
-        # remove white space
-        search_term = search_term.replace("'", "''")
-        for filter_name, state in filters.items():
-            # if the filter is active (do search in that area, so not much of a filter is it?)
-            if state:
-                # add "where" or change the next clause to "or"
-                search_sql += connector + " lower(cast("
-                connector = "OR"
-
-                # add the filter table
-                search_sql += filter_name  # .split('-')[2]
-
-                # finish off the line
-                search_sql += f" as varchar)) LIKE '%{search_term.lower()}%'\n"
+    def apply_changes(self, changes):
+        """
+        update the search cache and upc index with changes from the notify_change notifications.
+        :param changes: {table: {keys}}. "*" means lots of things changed at once, so everything gets thrown out
+        """
+        if "*" in changes:
+            print("lots of changes at once, clearing the caches")
+            self.search_cache.clear()
+            self.upc_index.reset()
+
+            # scans would go to the server until the index is loaded again, so don't leave it empty. (this kiosk's own
+            # imports, restores and populates come through here too)
+            if self.upc_index.wanted: self.load_upc_index()
+            return
+
+        # checking something in or out changes the part's status
+        part_keys = changes.get("parts", set()) | changes.get("part_locations", set())
+
+        # a user's name also shows up in the status of every part they have checked out
+        user_keys = changes.get("users", set())
+        if user_keys:
+            self.rows_changed("users", user_keys)
+            self.cursor.execute("SELECT checked_out_part FROM part_locations WHERE current_holder = ANY(%s)", (list(user_keys),))
+            part_keys |= {row[0] for row in self.cursor.fetchall()}
+
+        # renaming a manufacturer touches all of its parts (manufacturers_search_vector), so those come in as part changes
+        if part_keys:
+            self.rows_changed("parts", part_keys)
+
+    def listen_for_changes(self):
+        """start keeping the caches up to date with changes from other kiosks (see ChangeListener)"""
+        get_listener(self.conn_info).start()
+
+    def bulk_changes(self):
+        """
+        for big changes inside a transaction: skip the notification for every row, and send one that says
+        to throw out everything instead. it's sent when the transaction commits
+        """
+        self.cursor.execute("SET LOCAL organizer.bulk = 'on'")
+        self.cursor.execute("SELECT pg_notify(%s, '* reload')", (change_channel,))
 
-        self.cursor.execute(search_sql)
-        search_results = self.cursor.fetchall()
+    def load_upc_index(self):
+        """
+        fill in the upc index (see UpcIndex) with every part in the database.
+        it's streamed from a server side cursor, so it's fine with a million parts. Nothing happens if it's already loaded
+        """
+        index = self.upc_index
+        with index.lock:
+            index.wanted = True
+            if index.loaded or index.loading: return
+            index.loading = True
 
-        # change the table into a list of matching upcs
-        if (not search_results) or len(search_results[0]) > 1:
-            formatted_results = search_results
-        else:
-            formatted_results = [row[0] for row in search_results]
+        try:
+            # no merging while the whole thing is being replaced anyway
+            with index.merge_lock:
+                while not index.loaded:
+                    with index.lock:
+                        generation = index.generation
+
+                    with self.conn.cursor(name="upc_index", withhold=True) as rows:
+                        rows.itersize = 10000
+                        rows.execute("""
+SELECT part_upc, mfr_pn, part_placement, checked_out_part IS NOT NULL
+FROM parts LEFT JOIN part_locations ON part_locations.checked_out_part = parts.part_upc
+ORDER BY part_upc""")
+                        replaced = index.set_rows(rows, generation)
+
+                    # if it was reset while the rows were coming in, they're out of date already, so go get them again
+                    with index.lock:
+                        index.loaded = replaced and index.generation == generation + 1
+                    if not index.loaded: print("the upc index was reset while it was loading, starting over")
+
+            print(f"loaded {len(index.upcs)} parts into the upc index")
+        finally:
+            index.loading = False
+
+    def lookup_upc(self, upc):
+        """
+        get (part number, placement, checked out) for a upc. This doesn't go to the server if the upc index is loaded,
+        except for full 12 digit codes that aren't in it (parts that another kiosk just added)
+        :returns: None if there's no part with the upc
+        """
+        if self.upc_index.loaded:
+            part = self.upc_index.lookup(upc)
+            if part or len(str(upc)) < 12: return part
 
-        # if there are no results
-        if len(formatted_results) <= 0 or connector == "WHERE":
-            formatted_results = ["No matching items"]
-            search_results = [["No matching items", "No matching items"]]
+        self.execute_prepared("upc_index_rows", [int(upc)])
+        rows = self.cursor.fetchall()
+        if not rows: return None
 
-        if raw_table: return search_results
-        return formatted_results
+        part = tuple(rows[0][1:])
+        if self.upc_index.loaded: self.upc_index.update(upc, part)
+        return part
 
-    def update_mfr_part_count(self, mfr_name):
-        """update the number of parts for the mfr"""
+    def mfr_part_count(self, mfr_name):
+        """get the number of parts the mfr has. The parts_count triggers keep it up to date, so this doesn't count anything"""
+        self.execute_prepared("mfr_part_count", mfr_name)
+        count = self.cursor.fetchall()
 
-        # get the mfr_id
-        mfr_id = self.mfr_id_from_name(mfr_name)
-        if not mfr_id: return
+        # same as mfr_id_from_name, nothing if the mfr isn't there
+        if count: return count[0][0]
 
-        # get the number of parts that have the mfr
-        search_sql = f"SELECT * FROM parts WHERE part_mfr = {mfr_id}"
-        self.cursor.execute(search_sql)
-        parts_count = len(self.cursor.fetchall())
+    def recount_mfr_parts(self):
+        """
+        count the parts for every manufacturer from scratch, for databases where number_of_parts got off.
+        parts is locked against changes while this runs, otherwise a part added halfway through could get counted twice
+        """
+        self.cursor.execute("BEGIN")
+        try:
+            self.cursor.execute("LOCK TABLE parts IN SHARE MODE")
+            self.cursor.execute(recount_parts_sql)
+            fixed = self.cursor.rowcount
+        except Exception:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
 
-        # update the mfr data
-        update_sql = f"UPDATE manufacturers SET number_of_parts = {parts_count}"
-        self.cursor.execute(update_sql)
-        self.conn.commit()
+        print(f"fixed the part count for {fixed} manufacturers")
+        return fixed
 
     # ------ functions unique to each search area
     # the [part/user]_search makes the list that you see and can pick from
     # the [part/user]_data generates that right hand column with all the info
 
     # parts
-    def part_search(self, search_term, search_columns=None, more_info=True):
-        """get the matching upc codes to a search term"""
+    def part_search(self, search_term, search_columns=None, more_info=True, full_text=False, limit=50, page_size=None, after=None):
+        """
+        get the matching upc codes to a search term
+        :param full_text: use the full text search instead, which gives the best `limit` matches ordered by relevance.
+            search_columns and paging don't do anything in this mode.
+        :param page_size: only get this many parts, ordered by upc. leave it out to get everything
+        :param after: the upc of the last part on the previous page
+        """
+        # best matches first
+        text_query = text_search_query(search_term) if full_text else None
+        if text_query:
+            return self.part_search_ranked(text_query, more_info, limit)
+
         # sql to search for search term
 
         if search_columns is None:
@@ -1087,89 +3043,47 @@ WHERE checked_out_part = {part_upc}"""
                 "url": True
             }
 
-        search_sql = f"""
-SELECT mfr_pn, mfr_name, part_upc, part_placement, part_desc, date_added FROM parts 
-JOIN manufacturers ON parts.part_mfr = manufacturers.mfr_id
-"""
-        results = self.search_general(search_sql, search_term, search_columns)
-        if not more_info:
-            return [str(item[2]).zfill(12) for item in results]
-        else:
-            if (not results) or results[0] == "No matching items": return [[' ', ' ', "No Results", *(" " for _ in range(3))]]
-            unscrambled = [[str(row[2]).zfill(12), row[0], row[1], row[5].strftime("%m/%d/%Y"), row[3], row[4]] for row in results]
-            why_another_stage = []
-
-            for row in unscrambled:
-                self.cursor.execute(f"SELECT first_name, last_name FROM part_locations JOIN users ON part_locations.current_holder = users.user_id WHERE checked_out_part = {row[0]}")
-                result = self.cursor.fetchall()
-                if result: result = " ".join(result[0])
-                why_another_stage.append([*row, f"Out ({result})" if result else "Available"])
-
-            return [[u[1], u[2], u[0], u[3], u[4], u[5], u[6]] for u in why_another_stage]
+        # the holder and status come back in the same query, so this is one round trip no matter how many parts match
+        if after is not None: after = int(after)
+        cache_key = ("parts", search_words(search_term), active_filters(search_columns), False, page_size, after)
+        generation = self.search_cache.generation("parts")
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            results = self.search_general(part_search_sql, search_term, search_columns, predicates=part_search_predicates,
+                                          order_column="parts.part_upc", page_size=page_size, after=after)
+            self.search_cache.put(cache_key, (row[2] for row in results if isinstance(row, tuple)), results, generation)
+
+        return part_results(results, more_info)
+
+    def part_search_ranked(self, text_query, more_info=True, limit=50):
+        """full text version of part_search. Takes a tsquery from text_search_query()"""
+        cache_key = ("parts", (text_query,), (), True, limit)
+        generation = self.search_cache.generation("parts")
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            self.cursor.execute(part_ranked_search_sql, {"query": text_query, "limit": limit})
+            results = self.cursor.fetchall()
+            self.search_cache.put(cache_key, (row[2] for row in results), results, generation)
+
+        return part_results(results, more_info)
 
     def part_data(self, target_upc, raw=False):
         """get the part information for a upc code"""
 
-        if not target_upc or (isinstance(target_upc, str) and not target_upc.isnumeric()):
+        if not target_upc or (isinstance(target_upc, str) and not target_upc.isdecimal()):
             return {"Invalid Search": ""}
 
-        # sql to search for search term
-        search_sql = f"""
-SELECT part_upc, part_placement, mfr_name, mfr_pn, part_desc, url, date_added FROM parts 
-JOIN manufacturers ON parts.part_mfr = manufacturers.mfr_id
-WHERE cast(part_upc as varchar) = '{int(target_upc)}'"""
-        self.cursor.execute(search_sql)
+        # the part, its manufacturer, and whoever has it checked out all come back in one row
+        self.execute_prepared("part_data", int(target_upc))
         search_results = self.cursor.fetchall()
 
-        # get if the part is checked out
-        check_checkout_sql = f"SELECT current_holder FROM part_locations WHERE checked_out_part = {int(target_upc)}"
-        self.cursor.execute(check_checkout_sql)
-        holder_id_table = self.cursor.fetchall()
-
-        # if someone has the part checked out
-        if holder_id_table:
-            holder_id = holder_id_table[0][0]
-
-            get_user_name_sql = f"SELECT first_name, last_name FROM users WHERE user_id = '{holder_id}'"
-            self.cursor.execute(get_user_name_sql)
-            holder_row = self.cursor.fetchall()[0]
-            checkout_holder = f"{holder_row[0]} {holder_row[1]} ({holder_id})"
-
-        # if nobody has the part checked out
-        else:
-            checkout_holder = "Not checked out"
-
-        # take the first row
-        if search_results:
-            search_results = search_results[0]
-        else:
-            return {"No results": ""}
-
-        # the mfr pn
-        mfr_pn = search_results[3]
-        mfr_pn = mfr_pn if mfr_pn else "Unknown"
-
-        print("search_results??", search_results)
-        # change the table into a dictionary
-        formatted_results = {
-            "UPC code": str(search_results[0]).zfill(12),
-            "Placement location": search_results[1],
-            "Manufacturer": search_results[2],
-            "Part number": mfr_pn,
-            "Currently checked out by": checkout_holder,
-            "Description": search_results[4],
-            "Link to original part": search_results[5],
-            "Date added": search_results[6].strftime("%b %d, %Y - %I:%M %p")
-        }
-
-        # return raw results if requested
-        if raw: return search_results[4], search_results[1]
-
-        return formatted_results
+        return part_details(search_results, raw)
 
     # users
-    def user_search(self, search_term, columns=None, use_full_names=False):
+    def user_search(self, search_term, columns=None, use_full_names=False, page_size=None, after=None):
         """get the matching user ids to a search term
+        :param page_size: only get this many users, ordered by user id. leave it out to get everyone
+        :param after: the user id of the last user on the previous page
         :returns a dict {user_id: First Name, Last Name, Email} if use_full_names is True.
             otherwise it returns a list of user ids"""
 
@@ -1183,59 +3097,44 @@ WHERE cast(part_upc as varchar) = '{int(target_upc)}'"""
             }
 
         # sql to search for search term
-        search_sql = f"""
-SELECT user_id, first_name, last_name, email FROM users
-"""
-        results_table = self.search_general(search_sql, search_term, columns, raw_table=True)
-
-        if (not results_table) or (not results_table[0]):
-            return {"No Results": ("No Results", *(" " for _ in range(2)))}
-
-        print(results_table[0])
-        print(len(results_table[0]))
-        if len(results_table[0]) > 2:
-            results_dict = {row[0]: (row[0], " ".join(row[1:3]), row[3]) for row in results_table}
-        else:
-            results_dict = {"No Results": ("No Results", *(" " for _ in range(2)))}
+        cache_key = ("users", search_words(search_term), active_filters(columns), False, page_size, after)
+        generation = self.search_cache.generation("users")
+        results_table = self.search_cache.get(cache_key)
+        if results_table is None:
+            results_table = self.search_general(user_search_sql, search_term, columns, raw_table=True,
+                                                order_column="users.user_id", page_size=page_size, after=after)
+            self.search_cache.put(cache_key, (row[0] for row in results_table if isinstance(row, tuple)), results_table, generation)
 
-        if list(results_dict.keys())[0] == " ":
-            return {"No matching items": "No matching items"}
-        elif use_full_names: return results_dict
-        else: return list(results_dict.keys())
+        return user_results(results_table, use_full_names)
 
     def user_data(self, target_id, raw=False):
         """get the user information for a user id"""
-        # sql to search for search term
-        search_sql = f"""
-SELECT user_id, first_name, last_name, email FROM users
-WHERE user_id = '{target_id}'"""
-        self.cursor.execute(search_sql)
-        search_results = self.cursor.fetchall()
+        # search for the user. there's a row for every part they have checked out (or just one if they don't have any)
+        self.execute_prepared("user_data", target_id)
+        user_rows = self.cursor.fetchall()
 
-        # take the first row
-        if search_results:
-            search_results = search_results[0]
-        else:
-            return {"No results": ""}
+        return user_details(user_rows, raw)
 
-        # get the number of parts checked out by the user
-        checkout_search = f"SELECT checked_out_part, checkout_timestamp FROM part_locations WHERE current_holder = '{target_id}'"
-        self.cursor.execute(checkout_search)
-        parts_out = [str(part) + time.strftime("\non %b %d, %Y - %I:%M %p") for part, time in self.cursor.fetchall()]
+    # history from the checkout_events log
+    # both are newest first, one page at a time. Pass the first two things in the last row as before to get the next page
 
-        # if the program wants raw data and not a nice table
-        if raw:
-            return [search_results[i + 1] for i in range(3)]
-        else:
-            # change the table into a dictionary
-            formatted_results = {
-                "User ID": search_results[0],
-                "First name": search_results[1],
-                "Last name": search_results[2],
-                "Email": search_results[3],
-                "Parts checked out": parts_out
-            }
-            return formatted_results
+    def part_history(self, upc, limit=50, before=None):
+        """
+        who's had the part.
+        :returns: [(time, event id, "checkout"/"return"/"handoff", user id, user name), ...]
+        """
+        before_time, before_id = before or ("infinity", 0)
+        self.execute_prepared("part_history", int(upc), before_time, before_id, limit)
+        return self.cursor.fetchall()
+
+    def user_history(self, user_id, limit=50, before=None):
+        """
+        what parts the user has had.
+        :returns: [(time, event id, "checkout"/"return"/"handoff", upc, part number), ...]
+        """
+        before_time, before_id = before or ("infinity", 0)
+        self.execute_prepared("user_history", user_id, before_time, before_id, limit)
+        return self.cursor.fetchall()
 
     def cursor_exists(self):
         return self.cursor
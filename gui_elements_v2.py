@@ -2,11 +2,16 @@ import math
 import os
 import warnings
 import tkinter as tk
+import asyncio
+from threading import Thread
+from tkinter import filedialog
 import customtkinter as ctk
 from sys import exit
 import requests
 from PIL import ImageFont, Image
-from db_interactions import Organizer, set_location, db_err
+from db_interactions import Organizer, set_location, populate_presets, pool_key
+from async_db_interactions import AsyncOrganizer, TkBridge
+from asyncpg import UndefinedTableError
 import psycopg2.errors as p2er
 from re import compile, split as re_split
 from webbrowser import open as web_open
@@ -92,9 +97,9 @@ def _int(string):
     """turns a string into an int if the string can become an int"""
     if not string or (isinstance(string, str) and string.isspace()): return
 
-    if string.isnumeric():
+    if string.isdecimal():
         return int(string)
-    elif string.split()[0].isnumeric():
+    elif string.split()[0].isdecimal():
         return int(string.split()[0])
     else:
         return string
@@ -115,6 +120,30 @@ def margin(master):
     ctk.CTkLabel(master, text=" ", font=("Ariel", 1)).pack()
 
 
+class PagedScrollableFrame(ctk.CTkScrollableFrame):
+    """
+    a CTkScrollableFrame that runs on_bottom whenever it's scrolled (or filled) most of the way to the bottom,
+    for loading more results. CTk doesn't have a hook for that, so this goes through its private canvas and scrollbar.
+    if a CTk upgrade renames those, this fails when the window is built instead of paging just quietly stopping
+    """
+    def __init__(self, master, on_bottom, **kwargs):
+        super().__init__(master, **kwargs)
+
+        canvas = getattr(self, "_parent_canvas", None)
+        scrollbar = getattr(self, "_scrollbar", None)
+        if canvas is None or not hasattr(scrollbar, "set"):
+            raise RuntimeError(f"customtkinter {getattr(ctk, '__version__', '')} changed CTkScrollableFrame, so the results can't load more when scrolled down")
+
+        self.on_bottom = on_bottom
+        self.scrollbar_set = scrollbar.set
+        canvas.configure(yscrollcommand=self.scrolled)
+
+    def scrolled(self, first, last):
+        self.scrollbar_set(first, last)
+        if float(last) > 0.9:
+            self.after_idle(self.on_bottom)
+
+
 def stackable_frame(master, text, desc, button_text, command):
     """A stackable frame that has a title and description on the left, and a button on the right"""
     frame_house = ctk.CTkFrame(master, height=80)
@@ -167,6 +196,71 @@ class ButtonWithVar(ctk.CTkButton):
         return self.var.get()
 
 
+class QueryWorker:
+    """
+    runs the search box queries as AsyncOrganizer coroutines on a TkBridge, so typing never waits on the database.
+    queries are debounced per box, and a newer query for a box cancels the one that's still running for it
+    (cancelling the task cancels the query on the server too), so only the results for what's in the box right now get shown
+    """
+    def __init__(self, window, typing_delay_ms=150):
+        self.window = window
+        self.typing_delay_ms = typing_delay_ms
+        self.bridge = TkBridge(window)
+        # these three are only used on the bridge's loop
+        self.organizer = None
+        self.conn_key = None
+        self.connecting = None  # the organizer's connect(), which every query waits on
+        self.running = {}  # box name: future for the query that box is waiting on
+        self.waiting = {}  # box name: after() id of the query that's waiting for the typing to stop
+
+    def submit(self, box, conn_info, query, callback, on_error, typing=False):
+        """
+        run await query(async_organizer) on the bridge, then callback(result) on the tk thread, unless something newer
+        for the same box came in first. with typing=True it waits until there haven't been any keystrokes for a bit.
+        errors go to on_error(error) instead. only call this from the tk thread
+        """
+        if box in self.waiting: self.window.after_cancel(self.waiting.pop(box))
+
+        # whatever is still running for this box is out of date now
+        if box in self.running: self.running.pop(box).cancel()
+
+        job = (box, conn_info, query, callback, on_error)
+        if typing:
+            self.waiting[box] = self.window.after(self.typing_delay_ms, self.start, *job)
+        else:
+            self.start(*job)
+
+    def start(self, box, conn_info, query, callback, on_error):
+        self.waiting.pop(box, None)
+
+        # these get called through window.after, so future is always set by then
+        future = self.bridge.submit(self.run(conn_info, query),
+                                    lambda result: self.deliver(box, future, callback, result),
+                                    lambda error: self.deliver(box, future, on_error, error))
+        self.running[box] = future
+
+    def deliver(self, box, future, handler, value):
+        """runs on the tk thread. a newer query might have come in while this one was on its way over"""
+        if self.running.get(box) is not future: return
+        del self.running[box]
+        handler(value)
+
+    async def run(self, conn_info, query):
+        """runs on the bridge's loop. the AsyncOrganizer gets replaced if the window moved to another database"""
+        # (or if it couldn't connect last time)
+        failed = self.connecting is not None and self.connecting.done() and self.connecting.exception()
+        if self.organizer is None or self.conn_key != pool_key(conn_info) or failed:
+            if self.organizer: asyncio.ensure_future(self.organizer.close())
+            self.organizer = AsyncOrganizer(conn_info)
+            self.conn_key = pool_key(conn_info)
+            self.connecting = asyncio.ensure_future(self.organizer.connect())
+
+        # shielded, so a query getting cancelled doesn't cancel the connect the others are waiting on too
+        organizer = self.organizer
+        await asyncio.shield(self.connecting)
+        return await query(organizer)
+
+
 class MainWindow:
     """The whole window that does all of everything"""
     def __init__(self, conn_info):
@@ -178,6 +272,8 @@ class MainWindow:
         self.customer_info = conn_info
         self.customer_info["user"] = f"customer_{self.db_name}"
         self.customer_info["password"] = "blur4321"
+        # formatting and dropping happen from here, since the database itself might not exist (yet, or anymore)
+        self.postgres_info = {**self.conn_info, "database": "postgres"}
         print("self.conn_info after assignment:", self.conn_info)
 
         # start the window (I know that your animations don't exist)
@@ -199,9 +295,12 @@ class MainWindow:
         self.previous_screen = ""
         self.checkout_user = ""
         self.back_to_checkout = True
+        self.checkout_cart = False  # checking out the kiosk cart instead of the selected part
+        self.cart = {}  # upc: part number, for the kiosk's cart mode
 
         # for interactions with the database
         self.controller = None
+        self.query_worker = QueryWorker(self.window)  # the search boxes run their queries on this
         self.postgres_exists = False
         self.connection = False
         self.db_connect()
@@ -305,7 +404,10 @@ class MainWindow:
 
         data = [  # Title, Description, Button text, command
             ("Format Database", "Resets the database with all default tables", "Format", self.format_database),
-            ("Populate Database", "Fills the database up with random data. Useful for testing", "Populate", self.populate_database),
+            ("Upgrade Database", "Adds the newest indexes and tables to an existing database without deleting anything", "Upgrade", self.upgrade_database),
+            ("Export Database", "Saves all of the parts, users, and checkouts to a backup file", "Export", self.export_database),
+            ("Restore Database", "Replaces everything in the database with a backup file. Useful for moving to a new server", "Restore", self.restore_database),
+            ("Populate Database", "Fills the database up with random data. Useful for testing, the bigger sizes are for load testing", "Populate", self.populate_database),
             ("Drop Database", "Completely delete the database. This window might no longer function as expected until the database is reformatted.", "Drop", self.drop_db),
             ("Change Location", "Change where this machine thinks that it is. Returned parts will show as being in the new location.", "Change", self.change_location)
         ]
@@ -340,7 +442,10 @@ class MainWindow:
         self.search_labels = ctk.CTkLabel(self.top_frame, fg_color="#454547", font=listbutton_font)
         self.search_labels.pack(side="top", fill="x", expand=True)
 
-        self.result_parts = ctk.CTkScrollableFrame(self.find_part, width=800)
+        # the results come in a page at a time, and the next page gets loaded when you scroll down to the end
+        self.search_page_size = 100
+        self.search_paging = {"after": None, "done": True}
+        self.result_parts = PagedScrollableFrame(self.find_part, self.load_search_page, width=800)
         self.result_parts.grid(row=1, column=0, sticky="nsew", padx=40, pady=0)
         self.part_widgets = []
         self.selected_part = None
@@ -357,6 +462,10 @@ class MainWindow:
             self.check_in_out_buttons.append(new_button)
             new_button.pack(side="left", padx=15, pady=20)
 
+        # ranked full text search instead of matching every part that contains the text
+        self.best_matches_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(self.check_in_out_frame, text="Best matches", variable=self.best_matches_var, command=self.update_search).pack(side="left", padx=15, pady=20)
+
         # right side (display part info)
         part_info_display_frame = ctk.CTkFrame(self.find_part, fg_color="transparent", width=350)
         part_info_display_frame.grid(row=0, column=1, rowspan=2, sticky="nsew")
@@ -403,6 +512,23 @@ class MainWindow:
             for event, new_image in (("<Enter>", hover_image), ("<Leave>", image)):
                 image_button.bind(event, lambda _=_, btn=image_button, img=new_image: btn.configure(image=img))
 
+        # cart mode: scan a bunch of parts, then check them all out (or return them) at once
+        self.cart_mode_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(self.kiosk_frame, text="Cart mode", variable=self.cart_mode_var, command=self.toggle_cart_mode).place(relx=0.5, rely=0.26, anchor=ctk.CENTER)
+
+        self.cart_frame = ctk.CTkFrame(self.kiosk_frame, fg_color="transparent")
+        self.cart_title = ctk.CTkLabel(self.cart_frame, text="The cart is empty", font=subtitle)
+        self.cart_title.pack(pady=10)
+        self.cart_list = ctk.CTkScrollableFrame(self.cart_frame, width=500, height=250)
+        self.cart_list.pack()
+        self.cart_widgets = []
+
+        cart_buttons = ctk.CTkFrame(self.cart_frame, fg_color="transparent")
+        cart_buttons.pack(pady=20)
+        ctk.CTkButton(cart_buttons, text="Check Out Cart", **color_green, command=lambda: self.checkout_continue(cart=True)).pack(side="left", padx=8)
+        ctk.CTkButton(cart_buttons, text="Return Cart", command=self.cart_checkin).pack(side="left", padx=8)
+        ctk.CTkButton(cart_buttons, text="Empty Cart", **color_red, command=self.empty_cart).pack(side="left", padx=8)
+
         #######################
         # add new part form
         #######################
@@ -479,7 +605,8 @@ class MainWindow:
         self.manage_finder_entry.bind("<KeyRelease>", self.manage_finder_update)
 
         self.manage_finder_scrollbox_key = ctk.CTkLabel(manage_part_finder_frame, width=width, fg_color="#454547", anchor="w", font=manage_finder_font)
-        self.manage_finder_scrollbox = ctk.CTkScrollableFrame(manage_part_finder_frame, width=width, height=500)
+        self.manage_finder_paging = {"after": None, "done": True}
+        self.manage_finder_scrollbox = PagedScrollableFrame(manage_part_finder_frame, self.load_manage_finder_page, width=width, height=500)
 
         search_label.pack(side="left", fill="y")
         manage_finder_thin_frame.pack(fill="x", expand="true")
@@ -512,6 +639,10 @@ class MainWindow:
         self.add_part_button = ctk.CTkButton(self.manage_parts_frame, text="+ Add a part", command=self.add_part, height=32)
         self.add_part_button.pack()
 
+        # or a whole spreadsheet of parts (parts only)
+        self.import_parts_button = ctk.CTkButton(self.manage_parts_frame, text="Import CSV", command=self.import_parts, height=32)
+        self.import_parts_button.pack(pady=10)
+
         #####################
         # Home / README
         #####################
@@ -677,10 +808,18 @@ class MainWindow:
         self.back_to_checkout = True
         self.add_part()
 
-    def checkout_update_search(self, *_):
-        """update the data in the checkout user search box."""
+    def checkout_update_search(self, event=None, then=None):
+        """update the data in the checkout user search box. then() runs once the new users are showing"""
         search_text = self.checkout_user_search.get()
 
+        async def search_users(organizer): return await organizer.user_search(search_text, use_full_names=True)
+        def show_users(users): self.show_checkout_users(users, then)
+
+        self.query_worker.submit("checkout", self.controller.conn_info, search_users, show_users, self.search_failed, typing=event is not None)
+
+    @handle_exceptions
+    def show_checkout_users(self, users, then=None):
+        """put the users from checkout_update_search in the checkout user select frame"""
         # clear the old list
         for thing in self.checkout_search_options:
             thing.pack_forget()
@@ -690,7 +829,6 @@ class MainWindow:
         self.checkout_scrolling_frame.parent_canvas.yview_moveto(0)
 
         # make a button for each result
-        users = self.controller.user_search(search_text, use_full_names=True)
         for user_id, values in users.items():
             # decide what to put on the button
             if values[0] == "No Results": button_text = "No Results"
@@ -701,6 +839,8 @@ class MainWindow:
             new_button.pack()
             self.checkout_search_options.append(new_button)
 
+        if then: then()
+
     def checkout_user_select(self, user_name):
         """select the user in the checkout user select frame with the specified username"""
 
@@ -738,23 +878,104 @@ class MainWindow:
         good_string = ""
 
         for char in raw_string:
-            if char.isnumeric():
+            if char.isdecimal():
                 good_string += char
 
         self.kiosk_entry_var.set(good_string)
         if not good_string: return
 
-        if self.controller.upc_exists(good_string):
+        # in cart mode each full code goes into the cart, so the scanner can just keep going
+        if self.cart_mode_var.get():
+            if len(good_string) < 12: return
+
+            part = self.controller.lookup_upc(good_string)
+            self.kiosk_entry_var.set("")
+            if not part: return self.popup_msg("UPC code not found in database")
+
+            self.cart[good_string] = part[0]
+            self.update_cart()
+            return
+
+        # this runs on every keystroke, so it's looked up in the upc index instead of asking the server every time
+        part = self.controller.lookup_upc(good_string)
+        if part:
             self.selected_part_key = good_string
             self.kiosk_next_step.place(relx=0.5, rely=0.5, anchor=ctk.CENTER)
             self.kiosk_message.place(relx=0.5, rely=0.3, anchor=ctk.CENTER)
 
-            part_num = self.controller.part_num_from_upc(good_string)
+            part_num = part[0]
             self.kiosk_message.configure(text="Part found: "+part_num)
         else:
             self.kiosk_next_step.place_forget()
             self.kiosk_message.place_forget()
 
+    def toggle_cart_mode(self):
+        """show the cart instead of the check out/return buttons, or the other way around"""
+        self.kiosk_entry_var.set("")
+        self.kiosk_next_step.place_forget()
+        self.kiosk_message.place_forget()
+
+        if self.cart_mode_var.get():
+            self.update_cart()
+            self.cart_frame.place(relx=0.5, rely=0.62, anchor=ctk.CENTER)
+        else:
+            self.cart_frame.place_forget()
+        self.kiosk_entry.focus()
+
+    def update_cart(self):
+        """redraw the list of parts in the cart"""
+        for widget in self.cart_widgets:
+            widget.pack_forget()
+        self.cart_widgets = []
+
+        for upc, part_num in self.cart.items():
+            row = ctk.CTkFrame(self.cart_list, fg_color="transparent")
+            ctk.CTkLabel(row, text=f"{part_num}    ({upc})", anchor="w").pack(side="left", fill="x", expand=True, padx=10)
+            ctk.CTkButton(row, text="✕", width=30, fg_color="transparent", command=lambda u=upc: self.remove_from_cart(u)).pack(side="right")
+            row.pack(fill="x")
+            self.cart_widgets.append(row)
+
+        self.cart_title.configure(text=f"{len(self.cart)} part{'s' if len(self.cart) != 1 else ''} in the cart" if self.cart else "The cart is empty")
+
+    def remove_from_cart(self, upc):
+        self.cart.pop(upc, None)
+        self.update_cart()
+
+    def empty_cart(self):
+        self.cart = {}
+        self.update_cart()
+        self.kiosk_entry.focus()
+
+    @handle_exceptions
+    def cart_checkin(self):
+        """return everything in the cart at once"""
+        if not self.cart: return self.popup_msg("Scan some parts into the cart first!")
+        if not self.check_db_connection(): return
+
+        popup = CTkMessagebox(message=f"Return {len(self.cart)} parts?", title="Are you sure?", options=["Yes", "Cancel"], icon="question")
+        if popup.get() != "Yes": return
+
+        results = self.controller.cart_checkin(list(self.cart))
+
+        # say where all the parts go back to, and which ones didn't work
+        placements = []
+        problems = []
+        for upc, result in results.items():
+            if result.startswith("-CHECKIN_SUCCESS-"):
+                placement = result.split(";;")[1]
+                if placement not in placements: placements.append(placement)
+            elif result == "-NOT_CHECKED_OUT-":
+                problems.append(f"{self.cart[upc]} was never checked out.")
+            else:
+                problems.append(f"{self.cart[upc]} isn't in the database anymore.")
+
+        returned = len(results) - len(problems)
+        self.empty_cart()
+        if problems:
+            self.popup_msg(f"Returned {returned} parts. " + " ".join(problems))
+        else:
+            self.popup_msg(f"Returned {returned} parts. Please return them to " + ", ".join(placements), "success", 5)
+
     def raise_previous(self):
         print("we were here")
         if self.previous_screen == "user" or self.previous_screen == "part":
@@ -765,35 +986,74 @@ class MainWindow:
             warnings.warn("Invalid previous!")
 
     @handle_exceptions
-    def manage_finder_update(self, *_):
+    def manage_finder_update(self, event=None):
         """Updates the search results for the search panel in the manage parts frame. Works the same as update_search"""
-        search_term = self.manage_finder_entry.get()
-
-        # scroll back to the top
-        self.manage_finder_scrollbox.parent_canvas.yview_moveto(0)
-
         if self.search_mode == "part":
             self.manage_finder_scrollbox_key.configure(text="  "+list_button_format(("Part Number", "Manufacturer", "UPC", "Date Added", "Location", "Description", "Status"), "part"))
-            result = self.controller.part_search(search_term)
         else:
             self.manage_finder_scrollbox_key.configure(text="  "+list_button_format(("User ID", "Name", "Email"), "user"))
-            result = self.controller.user_search(search_term, use_full_names=True)
+
+        # switching between parts and users shouldn't leave the other kind up while the new results load
+        if event is None:
+            for old_widget in self.manage_finder_widgets: old_widget.pack_forget()
+            self.manage_finder_widgets = []
+
+        # start over from the first page
+        self.manage_finder_paging = {"after": None, "done": False}
+        self.load_manage_finder_page(typing=event is not None)
+
+    @handle_exceptions
+    def load_manage_finder_page(self, typing=False):
+        """add the next page of results to the manage finder. Works the same as load_search_page"""
+        paging = self.manage_finder_paging
+        if paging["done"]: return
+        paging["done"] = True  # so scrolling doesn't load the same page again while this one is loading
+
+        search_term = self.manage_finder_entry.get()
+        search_mode = self.search_mode
+        after = paging["after"]
+        page_size = self.search_page_size
+
+        # this part runs on the query worker's event loop
+        async def search_page(organizer):
+            if search_mode == "part":
+                return await organizer.part_search(search_term, page_size=page_size, after=after)
+            return await organizer.user_search(search_term, use_full_names=True, page_size=page_size, after=after)
+
+        def show_page(result): self.show_manage_finder_page(result, paging, search_mode)
+
+        self.query_worker.submit("manage", self.controller.conn_info, search_page, show_page, self.search_failed, typing=typing)
+
+    @handle_exceptions
+    def show_manage_finder_page(self, result, paging, search_mode):
+        """put a page of results from load_manage_finder_page in the manage finder. Works the same as show_search_page"""
+        first_page = paging["after"] is None
 
         if isinstance(result, dict):
             result = list(result.values())
 
-        for old_widget in self.manage_finder_widgets: old_widget.pack_forget()
+        if first_page:
+            for old_widget in self.manage_finder_widgets: old_widget.pack_forget()
+            self.manage_finder_widgets = []
+
+            # scroll back to the top
+            self.manage_finder_scrollbox.parent_canvas.yview_moveto(0)
 
         for val in result:
+            no_results = (not val) or len(val) == 6 or val[0] == "No Results"
+
+            # an empty page after the first one just means we're at the end
+            if no_results and not first_page: return
+
             new_label = ctk.CTkLabel(master=self.manage_finder_scrollbox, font=manage_finder_font, fg_color="transparent", cursor="hand2", anchor="w")
             new_label.pack(expand=True, fill="x")
             self.manage_finder_widgets.append(new_label)
 
-            if not val or len(val) == 6:
+            if no_results:
                 new_label.configure(text=" No Results")
-                continue
+                return
 
-            widget_text = " "+list_button_format(val, self.search_mode).strip(" ")
+            widget_text = " "+list_button_format(val, search_mode).strip(" ")
 
             if len(val) == 3:
                 identifier = val[0]
@@ -807,12 +1067,15 @@ class MainWindow:
 
             # new_label.insert("0.0", widget_text)
             new_label.configure(state="disabled")
-            new_label.bind("<Button-1>", lambda event=_, u=identifier: self.manage_finder_select(event, upc=u))
+            new_label.bind("<Button-1>", lambda event, u=identifier: self.manage_finder_select(event, upc=u))
+
+        # keep going from the last one, unless that was the last page
+        paging["after"] = identifier
+        paging["done"] = len(result) < self.search_page_size
 
     @handle_exceptions
     def raise_and_select(self):
-        self.raise_search(self.search_mode)
-        self.window.after(20, self.list_button_select)
+        self.raise_search(self.search_mode, then=self.list_button_select)
 
     @handle_exceptions
     def manage_finder_select(self, *_, upc):
@@ -885,8 +1148,15 @@ class MainWindow:
 
     @handle_exceptions
     def db_connect(self):
+        # the controller keeps its pooled connection, so only go get a new one if that one went bad
         if self.controller:
-            warnings.warn("this should not be here!")
+            if self.controller.connection_alive():
+                self.connection = True
+                self.keep_caches_updated()
+                return
+
+            self.controller.release_connection()
+            self.controller = None
         self.connection = False
 
         print("trying to connect")
@@ -904,6 +1174,30 @@ class MainWindow:
             except p2er.OperationalError as err:
                 print(f"layer 2 conn fail: {str(err)}")
 
+                # if postgres is there, the database just needs formatting
+                try:
+                    with Organizer(conn_info=self.postgres_info): self.postgres_exists = True
+                except p2er.OperationalError as err:
+                    print(f"layer 3 conn fail: {str(err)}")
+
+        if self.connection: self.keep_caches_updated()
+
+    def keep_caches_updated(self):
+        """
+        listen for changes from the other kiosks, and load the kiosk's upc index in the background if it isn't already.
+        scans go to the server until it's done
+        """
+        self.controller.listen_for_changes()
+
+        index = self.controller.upc_index
+        if index.loaded or index.loading: return
+
+        def load(conn_info):
+            with Organizer(conn_info=conn_info) as loader:
+                loader.load_upc_index()
+
+        Thread(target=load, args=(self.controller.conn_info,), daemon=True).start()
+
     @handle_exceptions
     def print_label(self, upc=None):
         """print a label from a upc code"""
@@ -944,6 +1238,8 @@ class MainWindow:
             self.popup_msg("please select a valid user.")
             return
 
+        if self.checkout_cart: return self.cart_checkout_finalize(force)
+
         upc = self.selected_part_key
 
         result = self.controller.part_checkout(upc, self.checkout_user, force)
@@ -953,10 +1249,7 @@ class MainWindow:
             tmp_key = self.selected_part_key
             if self.previous_screen == "part":
                 # if the user was on the part search frame when they checked out
-                self.raise_search("part")
-                def reselect(): self.list_button_select(database_key=tmp_key)
-
-                self.window.after(10, reselect)
+                self.raise_search("part", then=lambda: self.list_button_select(database_key=tmp_key))
             else:
                 # if the user was on the kiosk screen when they checked out
                 self.raise_kiosk()
@@ -982,6 +1275,40 @@ class MainWindow:
             if popup.get() == "Yes":
                 self.checkout_finalize(force=True)
 
+    def cart_checkout_finalize(self, force=False):
+        """check out everything in the cart to the selected user. Parts that somebody else has stay in the cart"""
+        results = self.controller.cart_checkout(list(self.cart), self.checkout_user, force)
+
+        holders = []
+        missing = []
+        for upc, result in results.items():
+            if result == "-CHECKOUT_SUCCESS-":
+                del self.cart[upc]
+            elif result.startswith("-PART_HOLDER-"):
+                holders.append(f"{self.cart[upc]} ({result.split(';;')[1]})")
+            else:
+                missing.append(self.cart.pop(upc))
+        checked_out = len(results) - len(holders) - len(missing)
+        self.update_cart()
+
+        # ask about all the parts that are already checked out at once
+        if holders:
+            popup = CTkMessagebox(
+                title="Are you sure?",
+                message=f"Checked out {checked_out} parts, but these are already checked out by someone else: {', '.join(holders)}. Check them out anyways?",
+                options=["Yes", "Cancel"],
+                icon="warning"
+            )
+
+            if popup.get() == "Yes":
+                return self.cart_checkout_finalize(force=True)
+
+        self.raise_kiosk()
+        if missing:
+            self.popup_msg(f"Checked out {checked_out} parts. These aren't in the database anymore: {', '.join(missing)}")
+        elif not holders:
+            self.popup_msg(f"Checked out {checked_out} parts successfully", "success")
+
     @handle_exceptions
     def make_new_form(self, search_mode):
         """makes a new form from a question dictionary"""
@@ -1039,6 +1366,29 @@ class MainWindow:
             entry.delete(0, "end")
             entry.configure(border_color="#565b5e")
 
+    @handle_exceptions
+    def import_parts(self):
+        """add all the parts from a csv file"""
+        if not self.check_db_connection(): return
+
+        csv_path = filedialog.askopenfilename(title="Import parts", filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not csv_path: return
+
+        # utf-8-sig gets rid of the weird character that excel puts at the start of the file
+        with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+            added, problems = self.controller.import_parts(csv_file)
+
+        self.manage_finder_update()
+
+        if not problems:
+            self.popup_msg(f"Imported {added} parts", "success", 5)
+            return
+
+        # only show the first few problems, there could be thousands
+        problem_lines = "\n".join(f"row {row}: {problem}" for row, problem in problems[:8])
+        if len(problems) > 8: problem_lines += f"\n...and {len(problems) - 8} more"
+        self.popup_msg(f"Imported {added} parts, but {len(problems)} rows were skipped:\n{problem_lines}")
+
     @handle_exceptions
     def edit_part_form(self):
         """edit the information on the selected part or user"""
@@ -1117,16 +1467,19 @@ class MainWindow:
             popup = CTkMessagebox(title="Warning!", message=f"{warning_msg}\nWould you like to return checked out part(s)?", options=["Yes", "Cancel"], icon="warning")
             result = popup.get()
             if result.lower() == "yes":
-                self.controller.clear_checkout(id_upc)
+                returned = self.controller.clear_checkout(id_upc)
                 self.controller.delete_generic(id_upc, self.search_mode)
             else:
                 return
+        else:
+            returned = []
 
         # things from before the manage users/parts were separated from the search
         # self.list_button_select()
         # self.update_search()
 
-        self.popup_msg(f"Deleted {self.search_mode} {id_upc}", popup_type="success")
+        returned_message = f" and returned {len(returned)} part{'s' if len(returned) != 1 else ''}" if returned else ""
+        self.popup_msg(f"Deleted {self.search_mode} {id_upc}{returned_message}", popup_type="success")
         self.manage_search_box.configure(f"No {self.search_mode.title()} Selected")
         self.manage_finder_update()
 
@@ -1257,7 +1610,7 @@ class MainWindow:
 
     @handle_exceptions
     def check_db_connection(self, accept_postgres=False):
-        # try to connect to the database again
+        # make sure the pooled connection is still good (this only reconnects if it isn't)
         self.db_connect()
 
         if self.connection:
@@ -1286,7 +1639,7 @@ class MainWindow:
         if not self.check_db_connection(accept_postgres=True): return
 
         # try to format the database as postgres
-        with Organizer(conn_info=self.conn_info) as postgres:
+        with Organizer(conn_info=self.postgres_info) as postgres:
             postgres.drop_db(self.db_name)
         self.popup_msg("Database dropped successfully", "success")
 
@@ -1309,7 +1662,7 @@ class MainWindow:
 
         # try to format the database as postgres
         try:
-            with Organizer(conn_info=self.conn_info) as postgres:
+            with Organizer(conn_info=self.postgres_info) as postgres:
                 print("context established")
                 postgres.format_database(self.db_name)
                 print("database formated")
@@ -1322,22 +1675,99 @@ class MainWindow:
             print('reconnecting')
             self.db_connect()
 
+    @handle_exceptions
+    def upgrade_database(self):
+        """add anything new to the database without formatting it"""
+
+        # make sure that we are able to connect to the database
+        if not self.check_db_connection(accept_postgres=True): return
+
+        # upgrading needs the postgres user, same as formatting
+        with Organizer(conn_info=self.conn_info) as postgres:
+            postgres.upgrade_database(self.db_name)
+            index_check = postgres.search_index_check()
+
+        # the upgrade worked, but the search isn't going to be any faster
+        if not all(index_check.values()):
+            self.popup_msg(f"The database was upgraded, but the search isn't using its indexes: {index_check}")
+            return
+
+        self.popup_msg("Database upgraded successfully", "success")
+
+    @handle_exceptions
+    def export_database(self):
+        """save a backup of the database to a zip file"""
+        if not self.check_db_connection(): return
+
+        archive_path = filedialog.asksaveasfilename(title="Export database", defaultextension=".zip", initialfile=f"{self.db_name}_backup.zip", filetypes=[("Backup files", "*.zip")])
+        if not archive_path: return
+
+        manifest = self.controller.export_database(archive_path)
+        self.popup_msg(f"Exported {manifest['tables']['parts']} parts and {manifest['tables']['users']} users", "success", 5)
+
+    @handle_exceptions
+    def restore_database(self):
+        """format the database and then load a backup into it"""
+        archive_path = filedialog.askopenfilename(title="Restore database", filetypes=[("Backup files", "*.zip"), ("All files", "*.*")])
+        if not archive_path: return
+
+        # same as formatting, anything other than a yes is a no
+        popup = CTkMessagebox(title="Are you sure?", message="This will delete everything in the database and replace it with the backup.", icon="warning", options=["Restore", "Cancel"])
+        result = popup.get()
+        if result.lower() != "restore": return
+
+        # make sure that we are able to connect to the database
+        if not self.check_db_connection(accept_postgres=True): return
+
+        # formatting needs the postgres user
+        with Organizer(conn_info=self.postgres_info) as postgres:
+            postgres.format_database(self.db_name)
+
+        with Organizer(conn_info=self.conn_info) as restorer:
+            manifest = restorer.restore_database(archive_path)
+
+        self.popup_msg(f"Restored {manifest['tables']['parts']} parts and {manifest['tables']['users']} users", "success", 5)
+
     @handle_exceptions
     def populate_database(self):
         """fill the database with sample data"""
 
-        # confirmation
-        popup = CTkMessagebox(title="Are you sure?", message="This will fill the database with junk data for testing.", icon="warning", options=["Populate", "Cancel"])
-        result = popup.get()
-        if result.lower() != "populate": return
+        # confirmation, and how much junk to make
+        preset = self.pick_populate_preset()
+        if preset not in populate_presets: return
 
         # make sure that we are able to connect to the database
         if not self.check_db_connection(accept_postgres=True): return
 
         # try to format the database as postgres
         with Organizer(conn_info=self.conn_info) as postgres:
-            postgres.populate_db(self.db_name)
-            self.popup_msg("Database populated successfully", "success")
+            added = postgres.populate_db(self.db_name, preset)
+            self.popup_msg(f"Added {added['parts']:,} parts, {added['users']:,} users and {added['checkouts']:,} checkouts", "success")
+
+    def pick_populate_preset(self):
+        """
+        ask which of the populate_presets to use. CTkMessagebox only has room for three buttons and there's
+        a cancel on top of the presets, so this is its own little window.
+        :returns: the name of the preset, or "Cancel"
+        """
+        picker = ctk.CTkToplevel(self.window)
+        picker.title("Are you sure?")
+        picker.resizable(False, False)
+        picker.transient(self.window)
+
+        sizes_text = "\n".join(f"{name}: {sizes['parts']:,} parts, {sizes['users']:,} users" for name, sizes in populate_presets.items())
+        ctk.CTkLabel(picker, text=f"This will fill the database with junk data for testing.\n\n{sizes_text}", justify="left").pack(padx=20, pady=(20, 10))
+
+        # closing the window is the same as cancel
+        picked = tk.StringVar(self.window, "Cancel")
+        buttons = ctk.CTkFrame(picker, fg_color="transparent")
+        buttons.pack(padx=20, pady=(0, 20))
+        for option in [*populate_presets, "Cancel"]:
+            ctk.CTkButton(buttons, text=option, width=90, command=lambda option=option: (picked.set(option), picker.destroy())).pack(side="left", padx=5)
+
+        picker.grab_set()
+        self.window.wait_window(picker)
+        return picked.get()
 
     @handle_exceptions
     def checkin_continue(self, *_):
@@ -1361,30 +1791,32 @@ class MainWindow:
         else:
             self.popup_msg(result)
 
-        self.update_search()
-        self.window.after(20, self.list_button_select)
+        self.update_search(then=self.list_button_select)
 
     @handle_exceptions
-    def checkout_continue(self, *_, auto_select=None):
-        """check out a part. Was originally the second step after scanning the part code"""
+    def checkout_continue(self, *_, auto_select=None, cart=False):
+        """check out a part (or the whole cart). Was originally the second step after scanning the part code"""
         print("checkout continue!")
 
         # if a part is not selected, you can't check out
-        if not self.selected_part_key:
+        if cart and not self.cart:
+            self.popup_msg("Scan some parts into the cart first!")
+            return
+        if not cart and not self.selected_part_key:
             self.popup_msg("You need to select a part first!")
             return
 
         # check for database connection
         if not self.check_db_connection(): return
 
-        # get the upc from the entry and make sure it's in the database
+        # get the upc from the entry and make sure it's in the database (the cart was checked when the parts were scanned)
         upc = self.selected_part_key
-        if not self.controller.upc_exists(upc):
+        if not cart and not self.controller.upc_exists(upc):
             self.popup_msg("UPC code not found in database")
             return
+        self.checkout_cart = cart
 
         # clear out whatever old stuff might be in this or the next panel
-        self.checkout_update_search()
         self.force_prompt.pack_forget()
         self.checkout_user_search.delete("0", "end")
 
@@ -1392,7 +1824,8 @@ class MainWindow:
         self.checkout_finalize_button.configure(**button_disable)
         self.checkout_message.configure(text="No account selected.")
 
-        if auto_select: self.checkout_user_select(auto_select)
+        # the user buttons have to be there before one of them can be selected
+        self.checkout_update_search(then=(lambda: self.checkout_user_select(auto_select)) if auto_select else None)
 
         # move on to the user selection page
         self.checkout_user_frame.tkraise()
@@ -1403,6 +1836,7 @@ class MainWindow:
         for pwidget in self.part_widgets:
             pwidget.pack_forget()
         self.part_widgets = []
+        self.search_paging = {"after": None, "done": True}
 
     @handle_exceptions
     def raise_kiosk(self):
@@ -1440,9 +1874,11 @@ class MainWindow:
         # show/hide the print button
         if search_type == "user":
             self.print_button.pack_forget()
+            self.import_parts_button.pack_forget()
             self.manage_title.configure(text="Mange Users")
         else:
             self.print_button.pack(side="left", padx=10)
+            self.import_parts_button.pack(pady=10)
             self.manage_title.configure(text="Mange Parts")
 
         # update the manage finder
@@ -1453,8 +1889,11 @@ class MainWindow:
         self.manage_parts_frame.tkraise()
 
     @handle_exceptions
-    def raise_search(self, search_type):
-        """clear the search box and raise either 'part search' or 'user search' depending on the search_type"""
+    def raise_search(self, search_type, then=None):
+        """
+        clear the search box and raise either 'part search' or 'user search' depending on the search_type.
+        then() runs once the results are showing
+        """
 
         self.back_to_checkout = False  # don't go back to the kiosk screen
         self.previous_screen = search_type
@@ -1485,43 +1924,85 @@ class MainWindow:
         # clear leftover data
         self.search_box.delete("0", "end")
         self.clear_output_box()
-        self.update_search()
+        self.clear_part_results()
+        self.update_search(then=then)
 
         # raise the search window
         self.find_part.tkraise()
         self.search_box.focus()
 
     @handle_exceptions
-    def update_search(self, *_):
-        """update the search scrollable frame to show new results"""
+    def update_search(self, event=None, then=None):
+        """
+        update the search scrollable frame to show new results. the old results stay up until the new ones come back.
+        then() runs once the first page is showing
+        """
         active = self.check_db_connection()
-        self.clear_part_results()
-        if not active: return
+        if not active:
+            self.clear_part_results()
+            return
 
         if not self.connection: self.db_connect()
 
-        # scroll back to the top
-        self.result_parts._parent_canvas.yview_moveto(0)
+        # start over from the first page. keystrokes wait for the typing to stop
+        self.search_paging = {"after": None, "done": False}
+        self.load_search_page(typing=event is not None, then=then)
 
+    @handle_exceptions
+    def load_search_page(self, typing=False, then=None):
+        """add the next page of search results to the scrolling frame. this gets called again when it's scrolled to the bottom"""
+        paging = self.search_paging
+        if paging["done"]: return
+        paging["done"] = True  # so scrolling doesn't load the same page again while this one is loading
+
+        best_matches = self.best_matches_var.get()
         search = self.search_box.get()
-        if self.search_mode == "part":
+        search_mode = self.search_mode
+        after = paging["after"]
+        page_size = self.search_page_size
+
+        if search_mode not in ("part", "user"): raise Exception("the search mode is not set to either part or user.")
+
+        # this part runs on the query worker's event loop
+        async def search_page(organizer):
+            if search_mode == "user":
+                return await organizer.user_search(search, use_full_names=True, page_size=page_size, after=after)
             try:
-                parts = self.controller.part_search(search)
-                names_dict = {part[2]: tuple(part) for part in parts}
-                parts = [part[2] for part in parts]
-            except db_err.UndefinedTable:
+                return await organizer.part_search(search, full_text=best_matches, page_size=page_size, after=after)
+            except UndefinedTableError:
                 raise Exception("The database doesn't look like how we expected.\nIf the database hasn't been formatted try hitting \"Format\" in the Danger Zone tab.")
-        elif self.search_mode == "user":
-            names_dict = self.controller.user_search(search, use_full_names=True)
-            parts = list(names_dict.keys())
+
+        def show_page(result): self.show_search_page(result, paging, search_mode, best_matches, then)
+
+        self.query_worker.submit("search", self.controller.conn_info, search_page, show_page, self.search_failed, typing=typing)
+
+    @handle_exceptions
+    def show_search_page(self, result, paging, search_mode, best_matches, then=None):
+        """put a page of search results from load_search_page in the scrolling frame"""
+        first_page = paging["after"] is None
+
+        if search_mode == "part":
+            names_dict = {part[2]: tuple(part) for part in result}
+            parts = [part[2] for part in result]
         else:
-            raise Exception("the search mode is not set to either part or user.")
+            names_dict = result
+            parts = list(names_dict.keys())
+
+        if first_page:
+            for pwidget in self.part_widgets: pwidget.pack_forget()
+            self.part_widgets = []
+
+            # scroll back to the top
+            self.result_parts._parent_canvas.yview_moveto(0)
+
+        # an empty page after the first one just means we're at the end
+        if parts[0] in ("No Results", "No matching items") and not first_page: return
 
         # add the parts into the scrolling frame
-        for index, part in enumerate(parts):
+        for index, part in enumerate(parts, start=len(self.part_widgets)):
             if part.isnumeric():  # parts
                 button_text = names_dict[part]
-                name_text = list_button_format(button_text, self.search_mode) if list(part)[0] != "No matching items" else "No matching items"
+                name_text = list_button_format(button_text, search_mode) if list(part)[0] != "No matching items" else "No matching items"
             else:  # users
                 name_text = list_button_format(names_dict[part], "user")
 
@@ -1540,6 +2021,20 @@ class MainWindow:
             part_widget.pack(fill="x", expand=True)
             self.part_widgets.append(part_widget)
 
+        # keep going from the last one, unless that was the last page (the best matches are only ever one page)
+        paging["after"] = parts[-1]
+        paging["done"] = best_matches or len(parts) < self.search_page_size
+
+        if then: then()
+
+    def search_failed(self, error):
+        """
+        errors from the query worker end up here instead of in handle_exceptions.
+        the failed page's paging stays done, otherwise every scroll would ask for it again and pop up the same error.
+        searching again starts over
+        """
+        self.popup_msg(str(error))
+
     @handle_exceptions
     def clear_output_box(self):
         for item in self.output_frames:
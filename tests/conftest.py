@@ -0,0 +1,75 @@
+import os
+import sys
+import types
+import tempfile
+import pytest
+
+# db_interactions keeps its files under %APPDATA%, which isn't there off windows
+os.environ.setdefault("APPDATA", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the label printer modules only install on windows. nothing here prints labels, so stand-ins are enough to import
+for module_name, stand_ins in (("pywintypes", {"error": OSError}), ("zpl", {"Label": object}), ("zebra", {"Zebra": object})):
+    try:
+        __import__(module_name)
+    except ImportError:
+        sys.modules[module_name] = types.SimpleNamespace(**stand_ins)
+
+import db_interactions
+
+
+@pytest.fixture(scope="session")
+def conn_info():
+    """connection info for a scratch postgres server. the tests format it, so they only run when it's set on purpose"""
+    host = os.getenv("ORGANIZER_TEST_HOST")
+    if not host: pytest.skip("set ORGANIZER_TEST_HOST (and ORGANIZER_TEST_USER/ORGANIZER_TEST_PASSWORD) to run the database tests")
+    return {"database": "blur_test", "user": os.getenv("ORGANIZER_TEST_USER", "postgres"),
+            "password": os.getenv("ORGANIZER_TEST_PASSWORD", ""), "host": host}
+
+
+@pytest.fixture(scope="session")
+def organizer(conn_info):
+    """a freshly formatted database with a few users and parts in it, and some of the parts checked out"""
+    # formatting happens from the postgres database, since blur_test might not be there yet
+    with db_interactions.Organizer(conn_info={**conn_info, "database": "postgres"}) as postgres:
+        postgres.format_database("blur_test")
+    organizer = db_interactions.Organizer(conn_info=dict(conn_info))
+
+    cursor = organizer.cursor
+    cursor.executemany("INSERT INTO users (user_id, first_name, last_name, email) VALUES (%s, %s, %s, %s)",
+                       [(f"user{number}", f"First{number}", f"Last{number}", f"user{number}@example.com") for number in range(1, 31)])
+    cursor.execute("INSERT INTO manufacturers (mfr_name, number_of_parts) VALUES ('Acme', 0), ('Globex', 0)")
+    cursor.executemany("""
+INSERT INTO parts (part_upc, part_placement, mfr_pn, part_mfr, part_desc, url, date_added)
+VALUES (%s, %s, %s, (SELECT mfr_id FROM manufacturers WHERE mfr_name = %s), %s, %s, CURRENT_TIMESTAMP)""",
+                       [(100000000000 + number, f"Bin {number % 7}", f"PN-{number}", ("Acme", "Globex")[number % 2],
+                         ("resistor", "capacitor", "diode")[number % 3], "None") for number in range(1, 41)])
+    cursor.execute("UPDATE manufacturers SET number_of_parts = (SELECT count(*) FROM parts WHERE part_mfr = mfr_id)")
+    cursor.executemany("INSERT INTO part_locations (checked_out_part, current_holder, checkout_timestamp) VALUES (%s, %s, CURRENT_TIMESTAMP)",
+                       [(100000000000 + number, f"user{number}") for number in range(1, 11)])
+
+    yield organizer
+    organizer.release_connection()
+
+
+class CountingCursor:
+    """stands in for an Organizer's cursor and keeps a list of the statements it sends to the server"""
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+
+    def execute(self, query, *args, **kwargs):
+        self.statements.append(str(query))
+        return self.cursor.execute(query, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+@pytest.fixture
+def round_trips(organizer):
+    """records the organizer's statements for the length of a test"""
+    counting = CountingCursor(organizer.cursor)
+    organizer.cursor = counting
+    yield counting
+    organizer.cursor = counting.cursor
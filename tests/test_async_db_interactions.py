@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from db_interactions import prepared_queries, part_search_sql, build_search, query_stats, reset_query_stats
+from async_db_interactions import AsyncOrganizer, numbered_params
+
+
+def test_positional_placeholders():
+    assert numbered_params("SELECT * FROM parts WHERE part_upc = %s AND mfr_pn = %s", (1, "a")) == \
+        ("SELECT * FROM parts WHERE part_upc = $1 AND mfr_pn = $2", [1, "a"])
+
+
+def test_named_placeholders_reuse_their_number():
+    query, args = numbered_params("SELECT %(a)s, %(b)s, %(a)s, %(b)s", {"b": 2, "a": 1, "unused": 3})
+    assert query == "SELECT $1, $2, $1, $2"
+    assert args == [1, 2]
+
+
+def test_percent_signs_in_like():
+    query, args = numbered_params("SELECT 1 WHERE mfr_pn LIKE '%%' || %s || '%%' ESCAPE '\\'", ("10%",))
+    assert query == "SELECT 1 WHERE mfr_pn LIKE '%' || $1 || '%' ESCAPE '\\'"
+    assert args == ["10%"]
+
+
+def test_no_placeholders():
+    assert numbered_params("SELECT 100 %% 7") == ("SELECT 100 % 7", [])
+
+
+def test_mixed_placeholders():
+    with pytest.raises(TypeError):
+        numbered_params("SELECT %s, %(name)s", {"name": 1})
+
+
+@pytest.mark.parametrize("name", list(prepared_queries))
+def test_prepared_queries_are_left_alone(name):
+    # they're already numbered, so they go through as they are
+    query = prepared_queries[name][1]
+    assert numbered_params(query, (1, 2)) == (query, [1, 2])
+
+
+def test_numbered_and_percent_placeholders_dont_mix():
+    with pytest.raises(TypeError):
+        numbered_params(prepared_queries["part_data"][1] + " AND mfr_pn = %s", (1, "a"))
+
+
+def test_search_sql_converts():
+    query, values = build_search(part_search_sql, "acme 10%", {"mfr_pn": True, "mfr_name": True})
+    numbered, args = numbered_params(query, values)
+    assert "%s" not in numbered and "%(" not in numbered
+    assert f"${len(args)}" in numbered and f"${len(args) + 1}" not in numbered
+
+
+def test_async_search_and_checkout(organizer):
+    every_part = organizer.part_search("")
+    upc = next(row[2] for row in every_part if not row[6].startswith("Out"))
+    user_id = organizer.user_search("")[0]
+
+    async def smoke_test():
+        async with AsyncOrganizer(organizer.conn_info) as async_organizer:
+            organizer.search_cache.clear()
+            assert await async_organizer.part_search("") == every_part
+            assert await async_organizer.user_search("") == organizer.user_search("")
+            assert await async_organizer.part_data(upc) == organizer.part_data(upc)
+
+            assert await async_organizer.part_checkout(upc, user_id) == "-CHECKOUT_SUCCESS-"
+            checked_out = organizer.part_search(upc)[0][6]
+            # the sync one says who has it the same way
+            holder = await async_organizer.part_checkout(upc, user_id)
+            assert holder.startswith("-PART_HOLDER-;;") and holder == organizer.part_checkout(upc, user_id)
+
+            assert await async_organizer.part_checkin(upc) == "Part successfully returned."
+            assert await async_organizer.part_checkin(upc) == "The scanned part was never checked out."
+            return checked_out
+
+    checked_out = asyncio.run(smoke_test())
+    assert checked_out.startswith("Out")
+    # the checkin threw out the cached "Out" row in the shared cache, so the sync side sees it come back
+    assert not organizer.part_search(upc)[0][6].startswith("Out")
+
+
+def test_async_queries_are_timed(organizer):
+    async def search():
+        async with AsyncOrganizer(organizer.conn_info) as async_organizer:
+            organizer.search_cache.clear()
+            await async_organizer.part_search("resistor")
+            await async_organizer.part_data(100000000001)
+
+    reset_query_stats()
+    asyncio.run(search())
+    methods = query_stats()["methods"]
+    # under the AsyncOrganizer method that ran them, not the fetch helpers
+    assert methods["part_search (async)"]["round_trips"] == 1
+    assert methods["part_data (async)"]["round_trips"] == 1 and methods["part_data (async)"]["rows"] == 1
+    assert not any(method.startswith("fetch") for method in methods)
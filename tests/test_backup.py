@@ -0,0 +1,27 @@
+import pytest
+from psycopg2 import errors as db_err
+from db_interactions import Organizer
+
+
+def test_restore_as_the_customer(organizer, conn_info, tmp_path):
+    archive_path = tmp_path / "backup.zip"
+    manifest = organizer.export_database(archive_path)
+    assert manifest["tables"]["checkout_events"] >= 10
+
+    with Organizer(conn_info={**conn_info, "database": "postgres"}) as postgres:
+        postgres.format_database("blur_restore_test")
+        try:
+            # the kiosk account isn't allowed to make the history's partitions itself
+            customer_info = {**conn_info, "database": "blur_restore_test", "user": "customer_blur_restore_test", "password": "blur4321"}
+            with Organizer(conn_info=customer_info) as restorer:
+                restorer.restore_database(archive_path)
+
+                for table, rows in manifest["tables"].items():
+                    restorer.cursor.execute(f"SELECT count(*) FROM {table}")
+                    assert restorer.cursor.fetchone()[0] == rows
+
+                # and it can't be used to write more history once there is some
+                with pytest.raises(db_err.RaiseException):
+                    restorer.cursor.execute("SELECT restore_checkout_events()")
+        finally:
+            postgres.drop_db("blur_restore_test")
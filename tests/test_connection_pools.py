@@ -0,0 +1,36 @@
+from db_interactions import Organizer, connection_pools, change_listeners
+
+
+def databases(keyed):
+    return [dict(key)["database"] for key in keyed]
+
+
+def test_pool_keeps_connections_that_were_used_at_the_same_time(organizer, conn_info):
+    # a few organizers at once, like the window, the change listener and the upc index loader
+    organizers = [Organizer(conn_info=dict(conn_info)) for _ in range(3)]
+    for other in organizers: other.part_data(100000000001)
+    connections = [other.conn for other in organizers]
+    for other in organizers: other.release_connection()
+
+    # they're still open, and still have their statements prepared
+    assert not any(conn.closed for conn in connections)
+    again = Organizer(conn_info=dict(conn_info))
+    assert again.conn in connections and "part_data" in again.conn.prepared
+    again.release_connection()
+
+
+def test_drop_db_closes_its_pools_and_listeners(conn_info):
+    with Organizer(conn_info={**conn_info, "database": "postgres"}) as postgres:
+        postgres.format_database("blur_drop_test")
+
+        with Organizer(conn_info={**conn_info, "database": "blur_drop_test"}) as organizer:
+            organizer.listen_for_changes()
+        assert "blur_drop_test" in databases(connection_pools)
+        assert "blur_drop_test" in databases(change_listeners)
+
+        postgres.drop_db("blur_drop_test")
+        assert "blur_drop_test" not in databases(connection_pools)
+        assert "blur_drop_test" not in databases(change_listeners)
+
+        postgres.cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'blur_drop_test'")
+        assert not postgres.cursor.fetchall()
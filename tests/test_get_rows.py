@@ -0,0 +1,36 @@
+from db_interactions import invalidate_schema_cache
+
+
+def open_cursors(organizer):
+    organizer.cursor.execute("SELECT count(*) FROM pg_cursors")
+    return organizer.cursor.fetchone()[0]
+
+
+def test_get_rows(organizer):
+    assert sorted(organizer.get_rows("mfr_pn")) == sorted(f"PN-{number}" for number in range(1, 41))
+    assert open_cursors(organizer) == 0
+
+
+def test_get_rows_stopped_early(organizer):
+    for _ in range(3):
+        rows = organizer.get_rows("part_upc")
+        next(rows)
+        rows.close()
+        assert open_cursors(organizer) == 0
+
+    # and the same column can be read again while another read of it is still going
+    first, second = organizer.get_rows("user_id"), organizer.get_rows("user_id")
+    assert next(first) and sorted(second)
+    first.close()
+    assert open_cursors(organizer) == 0
+
+
+def test_column_in_more_than_one_table(organizer):
+    # a newer table with a column that's also in parts doesn't take it over
+    organizer.cursor.execute("CREATE TABLE public.a_parts_copy (mfr_pn varchar)")
+    try:
+        invalidate_schema_cache()
+        assert organizer.column_table("mfr_pn") == "parts"
+    finally:
+        organizer.cursor.execute("DROP TABLE public.a_parts_copy")
+        invalidate_schema_cache()
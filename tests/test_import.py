@@ -0,0 +1,41 @@
+from io import StringIO
+
+
+def import_csv(organizer, text):
+    return organizer.import_parts(StringIO(text))
+
+
+def test_import_parts(organizer):
+    added, problems = import_csv(organizer, "manufacturer,part number,description\nAcme,IMP-1,thing\nInitech,IMP-2,other thing\n")
+    assert (added, problems) == (2, [])
+
+    organizer.cursor.execute("SELECT mfr_pn, part_desc FROM parts WHERE mfr_pn LIKE 'IMP-%' ORDER BY mfr_pn")
+    assert organizer.cursor.fetchall() == [("IMP-1", "thing"), ("IMP-2", "other thing")]
+
+
+def test_import_bad_lines_are_skipped(organizer):
+    text = (
+        "manufacturer,part number,description\n"
+        "Acme,BAD-10,fine\n"          # line 2
+        "Acme,BAD-11,too,many\n"      # line 3
+        "Acme,BAD-12\n"               # line 4
+        "Acme,\"BAD-13\"x,bad quote\n"  # line 5
+        "Acme,BAD-14,\"two\nlines\"\n"  # lines 6 and 7
+        "Acme,,no part number\n"      # line 8
+        "Acme,BAD-15,fine\n"          # line 9
+    )
+    added, problems = import_csv(organizer, text)
+
+    assert added == 3
+    assert [row for row, problem in problems] == [3, 4, 5, 8]
+    assert problems[0][1] == "has 4 columns but the header has 3"
+    assert problems[3][1] == "missing the part number"
+
+    organizer.cursor.execute("SELECT mfr_pn FROM parts WHERE mfr_pn LIKE 'BAD-%' ORDER BY mfr_pn")
+    assert [row[0] for row in organizer.cursor.fetchall()] == ["BAD-10", "BAD-14", "BAD-15"]
+
+
+def test_import_unclosed_quote(organizer):
+    added, problems = import_csv(organizer, "manufacturer,part number\nAcme,QUOTE-20\nAcme,\"QUOTE-21\nAcme,QUOTE-22\n")
+    assert added == 1
+    assert [row for row, problem in problems] == [3]
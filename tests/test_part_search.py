@@ -0,0 +1,24 @@
+def test_part_search_round_trips_dont_depend_on_the_number_of_parts(organizer, round_trips):
+    every_upc = organizer.part_search("", more_info=False)
+    # somebody has to have something checked out, or there aren't any holders to look up
+    assert any(row[6].startswith("Out") for row in organizer.part_search(""))
+
+    counts = {}
+    for search_term in ("", every_upc[0], "nothingmatchesthis"):
+        organizer.search_cache.clear()
+        round_trips.statements.clear()
+        results = organizer.part_search(search_term)
+        counts[search_term] = (len(results), len(round_trips.statements))
+
+    assert counts[""][0] == len(every_upc) > 1
+    assert counts[every_upc[0]][0] == 1
+    # the holders come back with the parts, so it's the same number of queries for all of them or for one
+    assert len({trips for rows, trips in counts.values()}) == 1, counts
+
+
+def test_cached_part_search_doesnt_query(organizer, round_trips):
+    organizer.search_cache.clear()
+    first = organizer.part_search("")
+    round_trips.statements.clear()
+    assert organizer.part_search("") == first
+    assert len(round_trips.statements) == 0
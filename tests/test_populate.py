@@ -0,0 +1,26 @@
+from db_interactions import Organizer, populate_presets
+
+
+def test_populate_after_deleting_users(conn_info):
+    sample = populate_presets["Sample"]
+
+    with Organizer(conn_info={**conn_info, "database": "postgres"}) as postgres:
+        postgres.format_database("blur_populate_test")
+        try:
+            with Organizer(conn_info={**conn_info, "database": "blur_populate_test"}) as organizer:
+                assert organizer.populate_db("blur_populate_test") == sample
+
+                # deleting some users leaves fewer users than the biggest user number
+                organizer.cursor.execute("""
+DELETE FROM users WHERE user_id IN (
+    SELECT user_id FROM users WHERE NOT EXISTS (SELECT 1 FROM part_locations WHERE current_holder = user_id) LIMIT 5
+)""")
+                organizer.cursor.execute("SELECT max(substring(user_id FROM '[0-9]+$')::int) FROM users")
+                last_user = organizer.cursor.fetchone()[0]
+                assert organizer.populate_db("blur_populate_test")["users"] == sample["users"]
+
+                # so the new ones are numbered after it, not after the number of users
+                organizer.cursor.execute("SELECT count(*) FROM users WHERE substring(user_id FROM '[0-9]+$')::int > %s", (last_user,))
+                assert organizer.cursor.fetchone()[0] == sample["users"]
+        finally:
+            postgres.drop_db("blur_populate_test")
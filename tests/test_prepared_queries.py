@@ -0,0 +1,42 @@
+import pytest
+from benchmarks.prepared_lookups import unprepared_sql
+
+
+def run_unprepared(organizer, name, *values):
+    organizer.cursor.execute(unprepared_sql(name), {str(number): value for number, value in enumerate(values, 1)})
+    return organizer.cursor.fetchall()
+
+
+@pytest.fixture
+def some_keys(organizer):
+    upcs = [int(upc) for upc in organizer.part_search("", more_info=False)[:5]]
+    users = organizer.user_search("")[:5]
+    return upcs, users
+
+
+def test_prepared_lookups_match_unprepared(organizer, some_keys):
+    upcs, users = some_keys
+    lookups = [("upc_exists", upc) for upc in upcs] + [("part_data", upc) for upc in upcs] + \
+              [("part_num_from_upc", upc) for upc in upcs] + [("user_data", user) for user in users] + \
+              [("userid_exists", user) for user in users] + [("userid_exists", "nobody")]
+    for name, value in lookups:
+        organizer.execute_prepared(name, value)
+        assert organizer.cursor.fetchall() == run_unprepared(organizer, name, value), name
+
+
+def test_lookups_are_prepared_once_per_connection(organizer, some_keys, round_trips):
+    upcs, users = some_keys
+    organizer.part_data(upcs[0])
+    organizer.user_data(users[0])
+
+    round_trips.statements.clear()
+    for _ in range(20):
+        for upc in upcs: organizer.part_data(upc)
+        for user in users: organizer.user_data(user)
+    # they're all EXECUTEs now
+    assert round_trips.statements and all(statement.startswith("EXECUTE") for statement in round_trips.statements)
+
+    organizer.cursor.execute("SELECT name FROM pg_prepared_statements")
+    prepared = [row[0] for row in organizer.cursor.fetchall()]
+    assert sorted(prepared) == sorted(set(prepared)) and {"part_data", "user_data"} <= set(prepared)
+    assert {"part_data", "user_data"} <= organizer.conn.prepared
@@ -0,0 +1,39 @@
+from db_interactions import SearchCache
+
+
+def put(cache, key, row_count):
+    cache.put(key, range(row_count), [(row,) for row in range(row_count)], cache.generation(key[0]))
+
+
+def test_limited_by_rows():
+    cache = SearchCache(max_entries=10, max_rows=100)
+    put(cache, ("parts", "a"), 60)
+    put(cache, ("parts", "b"), 30)
+    assert cache.stats()["rows"] == 90
+
+    # the oldest search goes to make room
+    put(cache, ("parts", "c"), 20)
+    assert cache.get(("parts", "a")) is None
+    assert cache.get(("parts", "b")) and cache.get(("parts", "c"))
+    assert cache.stats()["rows"] == 50
+
+
+def test_search_bigger_than_the_cache_is_not_cached():
+    cache = SearchCache(max_entries=10, max_rows=100)
+    put(cache, ("parts", "small"), 10)
+    put(cache, ("parts", ""), 500)
+    assert cache.get(("parts", "")) is None
+    assert cache.get(("parts", "small"))
+
+
+def test_rows_are_counted_down_again():
+    cache = SearchCache(max_entries=10, max_rows=100)
+    put(cache, ("parts", "a"), 40)
+    put(cache, ("parts", "a"), 40)
+    put(cache, ("users", "b"), 30)
+    assert cache.stats()["rows"] == 70
+
+    cache.invalidate("parts", row_keys=[5])
+    assert cache.stats()["rows"] == 30
+    cache.clear()
+    assert cache.stats() == {"hits": 0, "misses": 0, "entries": 0, "rows": 0}
@@ -0,0 +1,12 @@
+from db_interactions import search_words, text_search_query
+
+
+def test_scanned_upcs_lose_their_leading_zeros():
+    assert search_words("000123 Volt") == ("123", "volt")
+    assert text_search_query("000123 volt") == "123:* & volt:*"
+
+
+def test_numeric_characters_that_arent_digits():
+    # "²" and "½" count as numeric, but int() can't read them
+    assert search_words("½ watt ²") == ("½", "watt", "²")
+    assert text_search_query("½ watt ²") == "½:* & watt:* & ²:*"
@@ -0,0 +1,43 @@
+import pytest
+from db_interactions import upc_check_digit, make_upc
+
+# real UPC-A codes, check digit included
+known_upcs = ["036000291452", "012345678905", "042100005264", "725272730706", "614141000036", "000000000000"]
+
+
+@pytest.mark.parametrize("upc", known_upcs)
+def test_check_digit_matches_known_upcs(upc):
+    assert upc_check_digit(int(upc[:11])) == int(upc[11])
+
+
+@pytest.mark.parametrize("mfr_id, item_number, upc", [
+    (360, 29145, "036000291452"),
+    (1, 1, "000100000016"),
+    (0, 0, "000000000000"),
+    (9999, 9999999, "999999999993"),
+])
+def test_make_upc(mfr_id, item_number, upc):
+    assert make_upc(mfr_id, item_number) == upc
+
+
+@pytest.mark.parametrize("mfr_id, item_number", [(1, 1), (42, 1234567), (9999, 9999999), (1234, 0)])
+def test_make_upc_is_a_valid_upc(mfr_id, item_number):
+    upc = make_upc(mfr_id, item_number)
+    assert len(upc) == 12 and upc.isdigit()
+    # the check digit makes the weighted sum of all 12 digits a multiple of 10
+    digits = [int(digit) for digit in upc]
+    assert (3 * sum(digits[0::2]) + sum(digits[1::2])) % 10 == 0
+
+
+@pytest.mark.parametrize("mfr_id, item_number", [(10000, 1), (1, 10000000)])
+def test_make_upc_numbers_too_big(mfr_id, item_number):
+    with pytest.raises(Exception, match="too big"):
+        make_upc(mfr_id, item_number)
+
+
+def test_sql_check_digit_matches_python(organizer):
+    # the sql functions make the upcs for import_parts, so they have to agree with make_upc
+    pairs = [(360, 29145), (1, 1), (9999, 9999999), (42, 1234567)]
+    for mfr_id, item_number in pairs:
+        organizer.cursor.execute("SELECT make_upc(%s, %s)", (mfr_id, item_number))
+        assert "{0:012d}".format(organizer.cursor.fetchone()[0]) == make_upc(mfr_id, item_number)